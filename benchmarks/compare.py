@@ -0,0 +1,58 @@
+"""
+    Compare two benchmark result files.
+
+    python -m benchmarks.compare baseline.json candidate.json [--threshold 10]
+
+    Prints the ops/sec and p99 change per case and exits with status 1
+    when any case regressed by more than `--threshold` percent.
+"""
+import argparse
+import json
+import sys
+
+
+def _change(old, new):
+    if not old:
+        return 0.0
+    return (new - old) / old * 100
+
+
+def compare(baseline, candidate, threshold):
+    regressions = []
+    for name, new in candidate["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            print(f"{name:22} (new case)")
+            continue
+        ops = _change(old["ops_per_sec"], new["ops_per_sec"])
+        p99 = _change(old.get("p99_ms", 0), new.get("p99_ms", 0))
+        regressed = ops < -threshold or p99 > threshold
+        if regressed:
+            regressions.append(name)
+        print(
+            f"{name:22} ops/s {ops:+7.1f}%  p99 {p99:+7.1f}%"
+            + ("  REGRESSION" if regressed else "")
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0)
+    args = parser.parse_args()
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    print(
+        f"baseline {baseline['meta'].get('commit')} -> "
+        f"candidate {candidate['meta'].get('commit')}"
+    )
+    if compare(baseline, candidate, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+    Timing loop and machine-readable result files.
+"""
+import datetime
+import json
+import platform
+import subprocess
+import time
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(fn, iterations, warmup=5):
+    """
+    Call `fn(i)` `warmup` + `iterations` times. Returns ops/sec and
+    latency percentiles (ms) of the measured calls; calls that raise
+    are counted as errors and left out of the latencies, warmup calls
+    that raise are ignored.
+    """
+    for i in range(warmup):
+        try:
+            fn(i)
+        except Exception:  # pylint:disable=W0718
+            pass
+
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for i in range(warmup, warmup + iterations):
+        t0 = time.perf_counter()
+        try:
+            fn(i)
+        except Exception:  # pylint:disable=W0718
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "iterations": iterations,
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "ops_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+    }
+    if latencies:
+        result.update({
+            "mean_ms": sum(latencies) / len(latencies) * 1000,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "max_ms": max(latencies) * 1000,
+        })
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], text=True
+        ).strip()
+    except Exception:  # pylint:disable=W0718
+        return None
+
+
+def write_results(path, results, **meta):
+    """Write `{"meta": ..., "results": ...}` as JSON to `path`"""
+    doc = {
+        "meta": {
+            "commit": git_revision(),
+            "created_at": datetime.datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            **meta,
+        },
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(doc, f, indent=2, default=str)
+    return doc
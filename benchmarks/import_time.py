@@ -0,0 +1,117 @@
+"""
+    Import time of the package and its entry points.
+
+    python -m benchmarks.import_time [--runs 10] [--output import.json]
+
+    Every target is imported in `--runs` fresh interpreters. The wall
+    time of each import is measured in-process, and one extra run with
+    `-X importtime` lists the slowest modules it pulled in. Run it on
+    two revisions and diff the JSON files to see what an import change
+    bought.
+"""
+import argparse
+import subprocess
+import sys
+
+from benchmarks.harness import percentile, write_results
+
+TARGETS = [
+    "momenttrack_shared_services",
+    "momenttrack_shared_services.tables",
+    "momenttrack_shared_services.utils",
+    "momenttrack_shared_services.utils.outbox",
+    "momenttrack_shared_services.worker",
+    "momenttrack_shared_services.agent",
+    "momenttrack_shared_services.aio",
+]
+
+# heavy optional modules we want to know about when they get loaded
+WATCHED = [
+    "opensearchpy",
+    "requests",
+    "dictdiffer",
+    "numpy",
+    "momenttrack_shared_models.core.schemas",
+    "momenttrack_shared_services.agent",
+]
+
+_TIMER = (
+    "import sys, time\n"
+    "t0 = time.perf_counter()\n"
+    "import {target}\n"
+    "elapsed = time.perf_counter() - t0\n"
+    "print(elapsed)\n"
+    "print(','.join(m for m in {watched!r} if m in sys.modules))\n"
+)
+
+
+def time_import(target):
+    """Seconds `import target` took in a new interpreter, and watched modules"""
+    out = subprocess.run(
+        [sys.executable, "-c", _TIMER.format(target=target, watched=WATCHED)],
+        capture_output=True, text=True, check=True
+    ).stdout.splitlines()
+    return float(out[0]), [m for m in out[1].split(",") if m]
+
+
+def slowest_modules(target, top=10):
+    """`(module, cumulative_us)` of the slowest imports, from -X importtime"""
+    err = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        capture_output=True, text=True, check=True
+    ).stderr
+    rows = []
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(cumulative)))
+    rows.sort(key=lambda row: row[1], reverse=True)
+    return rows[:top]
+
+
+def bench(target, runs):
+    samples = []
+    loaded = []
+    for _ in range(runs):
+        seconds, loaded = time_import(target)
+        samples.append(seconds)
+    return {
+        "runs": runs,
+        "mean_ms": sum(samples) / len(samples) * 1000,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "min_ms": min(samples) * 1000,
+        "max_ms": max(samples) * 1000,
+        "loaded": loaded,
+        "slowest": slowest_modules(target),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--output", default="import_time.json")
+    parser.add_argument(
+        "--target", action="append",
+        help="module to import, repeatable (default: the package entry points)"
+    )
+    args = parser.parse_args()
+
+    results = {}
+    for target in args.target or TARGETS:
+        try:
+            results[target] = result = bench(target, args.runs)
+        except subprocess.CalledProcessError as e:
+            error = e.stderr.strip().splitlines()[-1] if e.stderr else str(e)
+            print(f"{target:48} FAILED {error}")
+            continue
+        print(
+            f"{target:48} p50 {result['p50_ms']:8.1f}ms  "
+            f"min {result['min_ms']:8.1f}ms  "
+            f"loads {', '.join(result['loaded']) or '-'}"
+        )
+    write_results(args.output, results, runs=args.runs)
+
+
+if __name__ == "__main__":
+    main()
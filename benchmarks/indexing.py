@@ -0,0 +1,143 @@
+"""
+    Offline OpenSearch indexing benchmarks against `FakeOpenSearch`.
+
+    python -m benchmarks.indexing --latency 0.005 --conflict-rate 0.2
+
+    No database is needed. Measures the throughput of the totals
+    updates (one scripted upsert per change vs. `TotalsCoalescer`), of
+    batched UpdateByQuery, and how injected version conflicts and
+    request failures are absorbed by `retry_on_conflict` and the
+    callers' error handling. Results are written as JSON like
+    `benchmarks.run`.
+"""
+import argparse
+import random
+
+from momenttrack_shared_services.testing import FakeOpenSearch
+from momenttrack_shared_services.utils import (
+    PRD_ORDER_TOTALS_INDEX,
+    update_prd_order_totals
+)
+from momenttrack_shared_services.utils.coalesce import TotalsCoalescer
+from momenttrack_shared_services.utils.ubq import (
+    DeadLetterSink,
+    UpdateTaskPoller,
+    update_lp_moves_many
+)
+
+from benchmarks.harness import measure, write_results
+
+
+LOCATION = {"name": "bench", "organization_id": 1}
+
+
+def bench_totals(client, rng, iterations):
+    def call(i):
+        update_prd_order_totals(
+            client, rng.randint(1, 20), rng.randint(1, 50),
+            deduct=rng.random() < 0.5, loc=LOCATION
+        )
+    return measure(call, iterations)
+
+
+def bench_coalesced_totals(client, rng, iterations, batch=100):
+    coalescer = TotalsCoalescer(client, window=60, max_pending=batch * 2)
+
+    def call(i):
+        for _ in range(batch):
+            coalescer.add(
+                rng.randint(1, 20), rng.randint(1, 50),
+                delta=rng.choice((-1, 1)), loc=LOCATION
+            )
+        coalescer.flush()
+    result = measure(call, iterations)
+    result["changes_per_sec"] = result["ops_per_sec"] * batch
+    return result
+
+
+def bench_update_by_query(client, rng, iterations, batch=100):
+    # seed with injection off, only the measured calls should fail
+    failure_rate, client.failure_rate = client.failure_rate, 0.0
+    try:
+        for lp_id in range(1, 1001):
+            client.index(
+                index="lp_move_alias", id=lp_id,
+                body={"license_plate_id": lp_id, "license_plate": {}}
+            )
+    finally:
+        client.failure_rate = failure_rate
+    poller = UpdateTaskPoller(client, dead_letter=_CountingSink())
+
+    def call(i):
+        update_lp_moves_many(
+            client,
+            [
+                (rng.randint(1, 1000),
+                 {"license_plate": {"external_serial_number": f"SN-{i}"}})
+                for _ in range(batch)
+            ],
+            poller=poller
+        )
+        poller.poll()
+    result = measure(call, iterations)
+    result["dead_letters"] = poller.dead_letter.count
+    return result
+
+
+class _CountingSink(DeadLetterSink):
+    def __init__(self):
+        self.count = 0
+
+    def write(self, kind, payload):
+        self.count += 1
+
+
+CASES = {
+    "totals_update": bench_totals,
+    "totals_coalesced": bench_coalesced_totals,
+    "update_by_query_many": bench_update_by_query,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--cases", nargs="*", choices=CASES, default=list(CASES))
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--conflict-rate", type=float, default=0.0)
+    parser.add_argument("--random-seed", type=int, default=0)
+    parser.add_argument("--output", default="indexing-results.json")
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.cases:
+        client = FakeOpenSearch(
+            latency=args.latency,
+            failure_rate=args.failure_rate,
+            conflict_rate=args.conflict_rate,
+            seed=args.random_seed
+        )
+        rng = random.Random(args.random_seed)
+        results[name] = CASES[name](client, rng, args.iterations)
+        results[name]["requests"] = dict(client.calls)
+        results[name]["totals_docs"] = len(
+            client.documents(PRD_ORDER_TOTALS_INDEX)
+        )
+        print(
+            f"{name:22} {results[name]['ops_per_sec']:9.1f} ops/s  "
+            f"p99={results[name].get('p99_ms', 0):8.2f}ms  "
+            f"errors={results[name]['errors']}"
+        )
+
+    write_results(
+        args.output,
+        results,
+        latency=args.latency,
+        failure_rate=args.failure_rate,
+        conflict_rate=args.conflict_rate,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+    Throughput / latency benchmarks of the license plate service agent.
+
+    python -m benchmarks.run --size small --output results.json
+
+    Runs each case against a database seeded by `benchmarks.seed` (which
+    `--seed` does first) and writes ops/sec and p50/p99 latency per case,
+    plus the agent's per-phase timings, as JSON. Compare two runs with
+    `python -m benchmarks.compare old.json new.json`.
+
+    OpenSearch intents go to the outbox by default (`--opensearch
+    outbox`), so the numbers measure the database side only;
+    `--opensearch fake` indexes inline into the in-memory
+    `FakeOpenSearch` (with `--os-latency` / `--os-failure-rate`) and
+    `--opensearch real` uses `setup_opensearch()`.
+"""
+import argparse
+import random
+import uuid
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from momenttrack_shared_models.core.schemas import LicensePlateSchema
+
+from momenttrack_shared_services import LicensePlateServiceAgent
+from momenttrack_shared_services.utils import setup_opensearch
+from momenttrack_shared_services.utils.instrumentation import HistogramSink
+from momenttrack_shared_services.testing import FakeOpenSearch
+
+from benchmarks.harness import measure, write_results
+from benchmarks.seed import Dataset, SIZES, seed
+
+
+class Cases:
+    """One method per benchmark case, each taking the iteration number"""
+
+    def __init__(self, agent, dataset, rng):
+        self.agent = agent
+        self.data = dataset
+        self.rng = rng
+        self.lp_ids = list(dataset.lp_locations)
+
+    def _move_to(self, destinations):
+        lp_id = self.rng.choice(self.lp_ids)
+        current = self.data.lp_locations[lp_id]
+        dest = self.rng.choice(
+            [loc for loc in destinations if loc != current]
+        )
+        self.agent.move(lp_id, dest, self.data.org_id, {}, self.data.user_id)
+        self.data.lp_locations[lp_id] = dest
+
+    def move(self, i):
+        self._move_to(self.data.location_ids)
+
+    def move_hot(self, i):
+        self._move_to(self.data.hot_location_ids)
+
+    def _create(self, production_order_id=None):
+        with self.agent.db.writer_session() as sess:
+            lp = LicensePlateSchema().load(
+                {
+                    "product_id": self.rng.choice(self.data.product_ids),
+                    "quantity": 1,
+                    "lp_id": uuid.uuid4().hex[:25].upper(),
+                },
+                session=sess
+            )
+        lp = self.agent.create(
+            lp, self.data.org_id, self.data.user_id, {},
+            production_order_id=production_order_id
+        )
+        self.data.lp_locations[lp.id] = lp.location_id
+
+    def create(self, i):
+        self._create()
+
+    def create_order(self, i):
+        self._create(production_order_id=self.rng.choice(self.data.order_ids))
+
+    def edit(self, i):
+        self.agent.edit(
+            {
+                "id": self.rng.choice(self.lp_ids),
+                "external_serial_number": f"SN-{i}",
+            },
+            self.data.org_id
+        )
+
+    def comment(self, i):
+        self.agent.comment(
+            self.rng.choice(self.lp_ids), f"benchmark note {i}",
+            self.data.org_id, self.data.user_id, {}
+        )
+
+    def get_location_report(self, i):
+        self.agent.get_location_report(
+            self.rng.choice(self.data.hot_location_ids), self.data.org_id
+        )
+
+    def get_logs(self, i):
+        self.agent.get_logs(
+            "license_plate", self.rng.choice(self.lp_ids), self.data.org_id
+        )
+
+
+CASES = [
+    "move", "move_hot", "create", "create_order",
+    "edit", "comment", "get_location_report", "get_logs",
+]
+
+
+def build_agent(database_url, opensearch, os_latency=0.0, os_failure_rate=0.0):
+    conf = {
+        "SQLALCHEMY_DATABASE_URI": database_url,
+        "SQLALCHEMY_BINDS": {"writer": database_url},
+    }
+    client = None
+    if opensearch == "real":
+        client = setup_opensearch()
+    elif opensearch == "fake":
+        client = FakeOpenSearch(
+            latency=os_latency, failure_rate=os_failure_rate, seed=0
+        )
+    return LicensePlateServiceAgent(
+        conf, os_client=client,
+        use_outbox=opensearch == "outbox",
+        instrumentation=HistogramSink()
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--size", choices=SIZES, default="small")
+    parser.add_argument(
+        "--database-url",
+        default="postgresql://localhost/momenttrack_bench"
+    )
+    parser.add_argument("--seed", action="store_true",
+                        help="reset and seed the database first")
+    parser.add_argument("--cases", nargs="*", choices=CASES, default=CASES)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--opensearch", choices=("outbox", "fake", "real"),
+                        default="outbox")
+    parser.add_argument("--os-latency", type=float, default=0.0,
+                        help="seconds per fake OpenSearch request")
+    parser.add_argument("--os-failure-rate", type=float, default=0.0)
+    parser.add_argument("--random-seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark-results.json")
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    if args.seed:
+        seed(engine, size=args.size, reset=True, random_seed=args.random_seed)
+    with Session(engine) as session:
+        dataset = Dataset.load(session)
+
+    agent = build_agent(
+        args.database_url, args.opensearch,
+        os_latency=args.os_latency, os_failure_rate=args.os_failure_rate
+    )
+    cases = Cases(agent, dataset, random.Random(args.random_seed))
+    results = {}
+    for name in args.cases:
+        results[name] = measure(
+            getattr(cases, name), args.iterations, warmup=args.warmup
+        )
+        print(
+            f"{name:22} {results[name]['ops_per_sec']:9.1f} ops/s  "
+            f"p50={results[name].get('p50_ms', 0):8.2f}ms  "
+            f"p99={results[name].get('p99_ms', 0):8.2f}ms  "
+            f"errors={results[name]['errors']}"
+        )
+
+    write_results(
+        args.output,
+        results,
+        size=args.size,
+        opensearch=args.opensearch,
+        iterations=args.iterations,
+        phases=agent.instrumentation.summary(),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""
+    Seed a local PostgreSQL database with a realistic benchmark dataset.
+
+    python -m benchmarks.seed --size small --database-url postgresql://...
+
+    Every size gets a few organizations with locations, products,
+    production orders and license plates. Each license plate has a
+    move history (with matching activities) that ends at its current
+    location, and every other plate is a line item of an order. A few
+    "hot" locations take a large share of all moves, like the receiving
+    and shipping docks of a real plant. Rows are bulk inserted with
+    explicit ids, so seed into an empty database (`--reset` drops and
+    recreates the schema first).
+"""
+import argparse
+import datetime
+import random
+
+from sqlalchemy import create_engine, insert, select, func, text
+from sqlalchemy.orm import Session
+from momenttrack_shared_models import (
+    Organization,
+    User,
+    Location,
+    Product,
+    ProductionOrder,
+    ProductionOrderLineitem,
+    LicensePlate,
+    LicensePlateMove,
+    LicensePlateStatusEnum,
+    Activity,
+    ActivityTypeEnum,
+)
+
+from momenttrack_shared_services.tables import (
+    create_tables,
+    metadata as service_metadata
+)
+from momenttrack_shared_services.utils.location import LocationService
+
+
+# size: (organizations, locations/org, products/org, orders/org, moves)
+SIZES = {
+    "small": (2, 20, 50, 20, 1_000),
+    "medium": (3, 100, 500, 200, 100_000),
+    "large": (5, 250, 2_000, 1_000, 1_000_000),
+}
+MOVES_PER_LP = 10
+HOT_LOCATIONS = 3
+HOT_SHARE = 0.5
+CHUNK = 10_000
+ORG_PREFIX = "bench-org-"
+
+
+class Dataset:
+    """Ids of a seeded organization, as used by the benchmark cases"""
+
+    def __init__(
+        self, org_id, user_id, location_ids, hot_location_ids,
+        product_ids, order_ids, lp_locations
+    ):
+        self.org_id = org_id
+        self.user_id = user_id
+        self.location_ids = location_ids
+        self.hot_location_ids = hot_location_ids
+        self.product_ids = product_ids
+        self.order_ids = order_ids
+        # {license_plate.id: location_id}, kept current by the cases
+        self.lp_locations = lp_locations
+
+    @classmethod
+    def load(cls, session):
+        """Dataset of the first seeded organization"""
+        org_id = session.scalar(
+            select(Organization.id)
+            .where(Organization.name.like(f"{ORG_PREFIX}%"))
+            .order_by(Organization.id)
+        )
+        if org_id is None:
+            raise RuntimeError("database isn't seeded, run benchmarks.seed")
+        user_id = session.scalar(
+            select(User.id).where(User.organization_id == org_id)
+        )
+        location_ids = session.scalars(
+            select(Location.id)
+            .where(Location.organization_id == org_id)
+            .order_by(Location.id)
+        ).all()
+        product_ids = session.scalars(
+            select(Product.id).where(Product.organization_id == org_id)
+        ).all()
+        order_ids = session.scalars(
+            select(ProductionOrder.id)
+            .where(ProductionOrder.organization_id == org_id)
+        ).all()
+        lp_locations = dict(
+            session.execute(
+                select(LicensePlate.id, LicensePlate.location_id)
+                .where(LicensePlate.organization_id == org_id)
+            ).all()
+        )
+        return cls(
+            org_id, user_id,
+            location_ids[HOT_LOCATIONS:], location_ids[:HOT_LOCATIONS],
+            product_ids, order_ids, lp_locations
+        )
+
+
+def _bulk(session, model, rows):
+    for start in range(0, len(rows), CHUNK):
+        session.execute(insert(model.__table__), rows[start:start + CHUNK])
+
+
+def _fix_sequences(session, models):
+    for model in models:
+        table = model.__table__.name
+        session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"COALESCE((SELECT max(id) FROM {table}), 1))"
+        ))
+
+
+class Seeder:
+    def __init__(self, session, size, rng):
+        self.session = session
+        self.rng = rng
+        (
+            self.orgs, self.locations, self.products,
+            self.orders, self.moves
+        ) = SIZES[size]
+        self.ids = {}
+
+    def next_id(self, model):
+        self.ids[model] = self.ids.get(model, 0) + 1
+        return self.ids[model]
+
+    def run(self):
+        moves_per_org = self.moves // self.orgs
+        for n in range(self.orgs):
+            self.seed_org(n, moves_per_org)
+        _fix_sequences(self.session, [
+            Organization, User, Location, Product, ProductionOrder,
+            ProductionOrderLineitem, LicensePlate, LicensePlateMove, Activity
+        ])
+        self.session.execute(
+            Location.__table__.update().values(
+                lp_qty=select(func.coalesce(func.sum(LicensePlate.quantity), 0))
+                .where(LicensePlate.location_id == Location.id)
+                .scalar_subquery()
+            )
+        )
+        LocationService.rebuild_dwell_stats(self.session)
+        self.session.commit()
+
+    def seed_org(self, n, moves):
+        now = datetime.datetime.utcnow()
+        org_id = self.next_id(Organization)
+        _bulk(self.session, Organization, [
+            {"id": org_id, "name": f"{ORG_PREFIX}{n}"}
+        ])
+        user_id = self.next_id(User)
+        _bulk(self.session, User, [{
+            "id": user_id,
+            "organization_id": org_id,
+            "email": f"bench{n}@example.com",
+            "first_name": "Bench",
+            "last_name": f"User {n}",
+        }])
+
+        location_ids = [self.next_id(Location) for _ in range(self.locations)]
+        _bulk(self.session, Location, [
+            {
+                "id": loc_id,
+                "name": f"Location {i}",
+                "organization_id": org_id,
+                "lp_qty": 0,
+            }
+            for i, loc_id in enumerate(location_ids)
+        ])
+        hot, cold = location_ids[:HOT_LOCATIONS], location_ids[HOT_LOCATIONS:]
+
+        product_ids = [self.next_id(Product) for _ in range(self.products)]
+        _bulk(self.session, Product, [
+            {
+                "id": product_id,
+                "part_number": f"PN-{org_id}-{i:05d}",
+                "organization_id": org_id,
+            }
+            for i, product_id in enumerate(product_ids)
+        ])
+        orders = {}
+        for _ in range(self.orders):
+            orders[self.next_id(ProductionOrder)] = self.rng.choice(product_ids)
+        _bulk(self.session, ProductionOrder, [
+            {
+                "id": order_id,
+                "product_id": product_id,
+                "organization_id": org_id,
+            }
+            for order_id, product_id in orders.items()
+        ])
+
+        lps, line_items, activities, lp_moves = [], [], [], []
+        order_ids = list(orders)
+        for i in range(max(1, moves // MOVES_PER_LP)):
+            lp_id = self.next_id(LicensePlate)
+            order_id = self.rng.choice(order_ids) if i % 2 == 0 else None
+            product_id = (
+                orders[order_id] if order_id
+                else self.rng.choice(product_ids)
+            )
+            at = now - datetime.timedelta(days=self.rng.randint(1, 365))
+            location = self.rng.choice(cold)
+            for _ in range(MOVES_PER_LP):
+                dest = (
+                    self.rng.choice(hot) if self.rng.random() < HOT_SHARE
+                    else self.rng.choice(cold)
+                )
+                if dest == location:
+                    continue
+                at += datetime.timedelta(minutes=self.rng.randint(5, 600))
+                activity_id = self.next_id(Activity)
+                activities.append({
+                    "id": activity_id,
+                    "user_id": user_id,
+                    "organization_id": org_id,
+                    "activity_type": ActivityTypeEnum.LICENSE_PLATE_MOVE,
+                    "model_name": "license_plate",
+                    "model_id": lp_id,
+                    "created_at": at,
+                })
+                if lp_moves and lp_moves[-1]["license_plate_id"] == lp_id:
+                    lp_moves[-1]["left_at"] = at
+                lp_moves.append({
+                    "id": self.next_id(LicensePlateMove),
+                    "license_plate_id": lp_id,
+                    "product_id": product_id,
+                    "organization_id": org_id,
+                    "src_location_id": location,
+                    "dest_location_id": dest,
+                    "user_id": user_id,
+                    "activity_id": activity_id,
+                    "created_at": at,
+                    "left_at": None,
+                })
+                location = dest
+            lps.append({
+                "id": lp_id,
+                "lp_id": f"BENCH{org_id:03d}{lp_id:010d}",
+                "product_id": product_id,
+                "quantity": 1,
+                "organization_id": org_id,
+                "location_id": location,
+                "status": LicensePlateStatusEnum.CREATED,
+            })
+            if order_id:
+                line_items.append({
+                    "id": self.next_id(ProductionOrderLineitem),
+                    "production_order_id": order_id,
+                    "license_plate_id": lp_id,
+                    "organization_id": org_id,
+                })
+            if len(lp_moves) >= CHUNK:
+                self.flush(lps, line_items, activities, lp_moves)
+                lps, line_items, activities, lp_moves = [], [], [], []
+        self.flush(lps, line_items, activities, lp_moves)
+
+    def flush(self, lps, line_items, activities, lp_moves):
+        _bulk(self.session, LicensePlate, lps)
+        _bulk(self.session, ProductionOrderLineitem, line_items)
+        _bulk(self.session, Activity, activities)
+        _bulk(self.session, LicensePlateMove, lp_moves)
+
+
+def seed(engine, size="small", reset=False, random_seed=0):
+    """Create the schema (optionally from scratch) and seed `size`"""
+    metadata = LicensePlate.metadata
+    if reset:
+        service_metadata.drop_all(engine)
+        metadata.drop_all(engine)
+    metadata.create_all(engine)
+    create_tables(engine)
+    with Session(engine) as session:
+        Seeder(session, size, random.Random(random_seed)).run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--size", choices=SIZES, default="small")
+    parser.add_argument(
+        "--database-url",
+        default="postgresql://localhost/momenttrack_bench"
+    )
+    parser.add_argument("--reset", action="store_true")
+    parser.add_argument("--random-seed", type=int, default=0)
+    args = parser.parse_args()
+    seed(
+        create_engine(args.database_url),
+        size=args.size, reset=args.reset, random_seed=args.random_seed
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+import datetime
+
+from loguru import logger
+from sqlalchemy import select
+from momenttrack_shared_models import (
+    LicensePlateStatusEnum,
+    LicensePlate,
+    Location,
+    ActivityTypeEnum,
+    ProductionOrderLineitem,
+    EverythingReport,
+)
+from momenttrack_shared_models.core.schemas import (
+    LicensePlateReportSchema,
+    LicensePlateOpenSearchSchema,
+    ProductionOrder,
+)
+
+from momenttrack_shared_services import messages as MSG
+from momenttrack_shared_services.actions.create import REDIRECT_URLS
+from momenttrack_shared_services.utils.activity import ActivityService
+from momenttrack_shared_services.utils.cache import ReferenceCache
+from momenttrack_shared_services.utils.location import LocationService
+from momenttrack_shared_services.utils.outbox import enqueue_index
+from momenttrack_shared_services.utils import (
+    HttpError,
+    saobj_as_dict,
+    get_diff,
+)
+from momenttrack_shared_services.utils.journal import DeltaJournal
+from momenttrack_shared_services.utils.totals import (
+    TotalsDelta,
+    apply_line_item_totals,
+    apply_part_no_totals
+)
+
+
+class BulkCreate:
+    """Create (or convert) many license plates for one made-it run.
+
+    Lookups are done with `IN (...)` queries per chunk, new rows are
+    inserted with a single flush, each totals row receives one combined
+    increment and every chunk is committed once. A chunk that fails
+    is rolled back and reported per license plate; chunks committed
+    before or after it keep their results.
+    """
+
+    def __init__(
+        self, db, org_id, user_id, client, headers,
+        comment=None, chunk_size=500, ref_cache=None, outbox=False,
+        counters=None, deferred_aggregates=False
+    ):
+        self.db = db
+        self.org_id = org_id
+        self.user_id = user_id
+        self.client = client
+        self.headers = headers
+        self.comment = comment
+        self.chunk_size = chunk_size
+        self.ref_cache = ref_cache or ReferenceCache(maxsize=0)
+        self.outbox = outbox
+        self.counters = counters
+        self.deferred_aggregates = deferred_aggregates
+
+        self.activity_service = ActivityService(
+            db, client, org_id,
+            user_id, headers
+        )
+
+    def execute(self, license_plates, production_order_id=None):
+        """
+        Create `license_plates`, optionally as line items of
+        `production_order_id`.
+
+        Returns a list with one entry per license plate, in input order:
+        `{"lp_id", "success", "license_plate"}` on success and
+        `{"lp_id", "success", "code", "error"}` on failure.
+        """
+        license_plates = list(license_plates)
+        results = []
+        for start in range(0, len(license_plates), self.chunk_size):
+            chunk = license_plates[start:start + self.chunk_size]
+            try:
+                results.extend(self.execute_chunk(chunk, production_order_id))
+            except HttpError as e:
+                results.extend(self.failed_chunk(chunk, e.code, e.message))
+            except Exception as e:  # pylint:disable=W0718
+                logger.error(
+                    f"BULK CREATE: chunk at {start} failed and was "
+                    f"rolled back: {e}"
+                )
+                results.extend(self.failed_chunk(chunk, 500, str(e)))
+        return results
+
+    @staticmethod
+    def failed_chunk(license_plates, code, message):
+        return [
+            {
+                "lp_id": license_plate.lp_id,
+                "success": False,
+                "code": code,
+                "error": message
+            }
+            for license_plate in license_plates
+        ]
+
+    def execute_chunk(self, license_plates, production_order_id=None):
+        db = self.db
+        results = [None] * len(license_plates)
+
+        def fail(idx, code, message):
+            results[idx] = {
+                "lp_id": license_plates[idx].lp_id,
+                "success": False,
+                "code": code,
+                "error": message
+            }
+
+        logger.info(
+            f"Attempting to create {len(license_plates)} license_plates"
+        )
+        with db.writer_session() as sess:
+            sys_loc = self.ref_cache.get_system_location(
+                self.org_id, session=sess
+            )
+            order = None
+            if production_order_id:
+                order = sess.scalar(
+                    select(ProductionOrder).where(
+                        ProductionOrder.id == production_order_id
+                    )
+                )
+                if order is None:
+                    raise HttpError(
+                        code=404, message=MSG.PRODUCTION_ORDER_NOT_FOUND
+                    )
+
+            lp_ids = [lp.lp_id for lp in license_plates]
+            existing = {
+                lp.lp_id: lp for lp in sess.scalars(
+                    select(LicensePlate).where(
+                        LicensePlate.lp_id.in_(lp_ids),
+                        LicensePlate.organization_id == self.org_id
+                    )
+                )
+            }
+            # check if any belong to some other org
+            foreign = set(sess.scalars(
+                select(LicensePlate.lp_id).where(
+                    LicensePlate.lp_id.in_(
+                        [x for x in lp_ids if x not in existing]
+                    ),
+                    LicensePlate.organization_id != self.org_id
+                )
+            ))
+            lineitem_lp_ids = set()
+            if order is not None and existing:
+                lineitem_lp_ids = set(sess.scalars(
+                    select(ProductionOrderLineitem.license_plate_id).where(
+                        ProductionOrderLineitem.license_plate_id.in_(
+                            [lp.id for lp in existing.values()]
+                        ),
+                        ProductionOrderLineitem.production_order_id
+                        == production_order_id
+                    )
+                ))
+
+            # # Validation + conversion ##
+            accepted, messages, seen = [], [], set()
+            new_qty = 0
+            for idx, license_plate in enumerate(license_plates):
+                if license_plate.lp_id in seen:
+                    fail(idx, 400, "Duplicate lp_id in request")
+                    continue
+                seen.add(license_plate.lp_id)
+                if license_plate.lp_id in foreign:
+                    fail(
+                        idx, 400,
+                        "Licenseplate value already belongs "
+                        "to another organization"
+                    )
+                    continue
+                existing_lp = existing.get(license_plate.lp_id)
+                if existing_lp is not None and existing_lp.id in lineitem_lp_ids:
+                    fail(idx, 400, "lineitem with lp_id already exists")
+                    continue
+
+                message = {}
+                license_plate.organization_id = self.org_id
+                license_plate.status = LicensePlateStatusEnum.CREATED
+                if self.org_id in REDIRECT_URLS:
+                    license_plate.redirect_url = REDIRECT_URLS[self.org_id]
+                if license_plate.location_id is None:
+                    license_plate.location_id = sys_loc.id
+
+                if existing_lp is not None:
+                    old_lp_dict = saobj_as_dict(existing_lp)
+                    new_lp_dict = saobj_as_dict(license_plate)
+
+                    # If already exists, just update it.
+                    for col, val in new_lp_dict.items():
+                        if col not in ['location_id']:
+                            setattr(existing_lp, col, val)
+                    license_plate = existing_lp
+                    message["converted"] = True
+                    message["diff"] = get_diff(
+                        old_lp_dict, new_lp_dict,
+                        ignore_keys=["id", "created_at", "updated_at"]
+                    )
+                else:
+                    sess.add(license_plate)
+                    new_qty += license_plate.quantity
+                if order is not None:
+                    message["production_order_id"] = production_order_id
+                accepted.append((idx, license_plate))
+                messages.append(str(message))
+
+            if not accepted:
+                return results
+
+            # single flush assigns ids to every new license plate
+            sess.flush()
+            if new_qty and self.counters is not None:
+                self.counters.add_lp_qty(sess, sys_loc.id, new_qty)
+            elif new_qty:
+                LocationService.add_lp(sys_loc, sess, new_qty)
+
+            if order is not None:
+                sess.add_all([
+                    ProductionOrderLineitem(
+                        production_order_id=production_order_id,
+                        license_plate_id=license_plate.id,
+                        organization_id=self.org_id
+                    )
+                    for _, license_plate in accepted
+                ])
+                self.update_totals(sess, accepted, order)
+
+            activities = self.activity_service.log_many(
+                "license_plate",
+                [license_plate.id for _, license_plate in accepted],
+                ActivityTypeEnum.LICENSE_PLATE_MADEIT,
+                sess,
+                messages=messages,
+            )
+            if self.comment:
+                self.activity_service.log_many(
+                    "license_plate",
+                    [license_plate.id for _, license_plate in accepted],
+                    ActivityTypeEnum.COMMENT,
+                    sess,
+                    message=self.comment,
+                )
+
+            journal = DeltaJournal(sess) if self.deferred_aggregates else None
+            report_schema = LicensePlateReportSchema(
+                exclude=('last_interaction',)
+            )
+            for (idx, license_plate), activity in zip(accepted, activities):
+                lp_report = report_schema.dump(license_plate)
+                if order is not None:
+                    lp_report['production_order_id'] = order.id
+                    lp_report['product_id'] = order.product_id
+                lp_report['last_interaction'] = datetime.datetime.strftime(
+                    activity.created_at,
+                    "%Y-%m-%d %H:%M:%S.%f"
+                )
+                lp_report_upsert_payload = {
+                    'lp_id': license_plate.lp_id,
+                    'po_id': lp_report.get('production_order_id', None),
+                    'report_raw': lp_report
+                }
+                if journal is not None:
+                    journal.lp_report(lp_report_upsert_payload)
+                else:
+                    EverythingReport.upsert(lp_report_upsert_payload, sess)
+            if journal is not None:
+                journal.flush()
+            if self.outbox:
+                idx_schema = LicensePlateOpenSearchSchema()
+                for _, license_plate in accepted:
+                    enqueue_index(
+                        sess, "lp_alias", license_plate.id,
+                        idx_schema.dump(license_plate)
+                    )
+            try:
+                sess.commit()
+            except Exception as e:
+                sess.rollback()
+                raise e
+
+            for idx, license_plate in accepted:
+                results[idx] = {
+                    "lp_id": license_plate.lp_id,
+                    "success": True,
+                    "license_plate": license_plate
+                }
+        return results
+
+    def update_totals(self, sess, accepted, order):
+        line_item_totals = TotalsDelta()
+        part_no_totals = TotalsDelta()
+        for _, license_plate in accepted:
+            line_item_totals.add(
+                (license_plate.location_id, order.id)
+            )
+            part_no_totals.add(
+                (license_plate.location_id, order.product_id)
+            )
+        if self.deferred_aggregates:
+            journal = DeltaJournal(sess)
+            journal.line_items(line_item_totals)
+            journal.part_nos(part_no_totals)
+            journal.flush()
+            return
+        locations = {
+            loc.id: loc for loc in sess.scalars(
+                select(Location).where(
+                    Location.id.in_(
+                        {lp.location_id for _, lp in accepted}
+                    ),
+                    Location.organization_id == self.org_id
+                )
+            )
+        }
+        apply_line_item_totals(
+            sess, line_item_totals, locations, counters=self.counters
+        )
+        apply_part_no_totals(
+            sess, part_no_totals, {order.product_id: order.product},
+            counters=self.counters
+        )
+        sess.flush()
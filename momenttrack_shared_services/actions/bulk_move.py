@@ -0,0 +1,432 @@
+import datetime
+
+from loguru import logger
+from sqlalchemy import select, or_, func, tuple_
+from momenttrack_shared_models import (
+    LicensePlateStatusEnum,
+    LicensePlate,
+    Location,
+    ActivityTypeEnum,
+    LicensePlateMove,
+    Container,
+    ContainerMove,
+    ProductionOrderLineitem,
+    Product,
+)
+from momenttrack_shared_models.core.schemas import (
+    LicensePlateReportSchema,
+    LicensePlateMoveOpenSearchSchema,
+    ContainerMoveSchema
+)
+
+from momenttrack_shared_services.messages import \
+     LICENSE_PLATE_MOVE_NOT_PERMITTED_WITH_SAME_DESTINATION as invalid_move_msg
+from momenttrack_shared_services.actions.move import enqueue_move_intents
+from momenttrack_shared_services.utils.activity import ActivityService
+from momenttrack_shared_services.utils.location import LocationService
+from momenttrack_shared_services import messages as MSG
+from momenttrack_shared_services.utils import HttpError
+from momenttrack_shared_services.utils.journal import DeltaJournal
+from momenttrack_shared_services.utils.totals import (
+    TotalsDelta,
+    net_lp_qty_moves,
+    apply_lp_qty_deltas,
+    apply_line_item_totals,
+    apply_line_graph_moves,
+    apply_part_no_totals
+)
+
+
+def _split_identifiers(items):
+    """Split raw move item ids into (string lp/container ids, numeric ids)"""
+    str_ids, int_ids = set(), set()
+    for item in items:
+        str_ids.add(str(item))
+        if isinstance(item, int) or str(item).isdigit():
+            int_ids.add(int(item))
+    return str_ids, int_ids
+
+
+def _latest_per(session, model, partition_col, filters):
+    """Latest row (by created_at) of `model` per `partition_col` value"""
+    rn = func.row_number().over(
+        partition_by=partition_col,
+        order_by=model.created_at.desc()
+    ).label('rn')
+    sub = select(model.id, rn).where(*filters).subquery()
+    return session.scalars(
+        select(model).join(sub, sub.c.id == model.id).where(sub.c.rn == 1)
+    ).all()
+
+
+class BulkMove:
+    """Move many license plates / containers to one destination.
+
+    Every item is validated individually, valid items are moved in a
+    single transaction, and aggregate rows are netted so each one is
+    written once per batch.
+    """
+
+    def __init__(
+        self,
+        db,
+        org_id: int,
+        dest_location_id: int,
+        user_id: int,
+        headers: dict,
+        client,
+        loglocation: bool = None,
+        outbox: bool = False,
+        counters=None,
+        deferred_aggregates: bool = False
+    ):
+        self.db = db
+        self.outbox = outbox
+        self.counters = counters
+        self.deferred_aggregates = deferred_aggregates
+        self.org_id = org_id
+        self.dest_location_id = dest_location_id
+        self.user_id = user_id
+        self.headers = headers
+        self.client = client
+        self.loglocation = loglocation
+        self.prev_moves = {}
+        self.activity_service = ActivityService(
+            db, client,
+            org_id, user_id,
+            headers
+        )
+
+    def load_items(self, sess, items):
+        """Resolve move item ids to LPs / containers with set-based queries"""
+        str_ids, int_ids = _split_identifiers(items)
+        lps = sess.scalars(
+            select(LicensePlate).where(
+                LicensePlate.organization_id == self.org_id,
+                or_(
+                    LicensePlate.lp_id.in_(str_ids),
+                    LicensePlate.id.in_(int_ids)
+                )
+            )
+        ).all()
+        by_lp_id = {lp.lp_id: lp for lp in lps}
+        by_id = {lp.id: lp for lp in lps}
+
+        resolved = {}
+        for item in items:
+            obj = by_lp_id.get(str(item))
+            if obj is None and str(item).isdigit():
+                obj = by_id.get(int(item))
+            if obj is not None:
+                resolved[item] = obj
+
+        missing = [item for item in items if item not in resolved]
+        if missing:
+            str_ids, int_ids = _split_identifiers(missing)
+            containers = sess.scalars(
+                select(Container).where(
+                    Container.organization_id == self.org_id,
+                    or_(
+                        Container.container_id.in_(str_ids),
+                        Container.id.in_(int_ids)
+                    )
+                )
+            ).all()
+            by_container_id = {c.container_id: c for c in containers}
+            by_id = {c.id: c for c in containers}
+            for item in missing:
+                obj = by_container_id.get(str(item))
+                if obj is None and str(item).isdigit():
+                    obj = by_id.get(int(item))
+                if obj is not None:
+                    resolved[item] = obj
+        return resolved
+
+    def validate(self, obj, seen):
+        if obj is None or (
+            isinstance(obj, LicensePlate) and obj.status in [
+                LicensePlateStatusEnum.RETIRED,
+                LicensePlateStatusEnum.DELETED,
+            ]
+        ):
+            raise HttpError(code=404, message=MSG.LICENSE_PLATE_NOT_FOUND)
+        if (type(obj), obj.id) in seen:
+            raise HttpError(code=400, message=MSG.MOVE_ITEM_DUPLICATED)
+        if obj.location_id == self.dest_location_id:
+            raise HttpError(code=400, message=invalid_move_msg)
+
+    def execute(self, items):
+        """
+        Move `items` to the destination location & record the transactions.
+
+        Returns a list with one entry per item, in input order:
+        `{"move_item_id", "success", "move"}` on success and
+        `{"move_item_id", "success", "code", "error"}` on failure.
+        """
+        db = self.db
+        items = list(items)
+        results = [None] * len(items)
+        with db.writer_session() as sess:
+            dest = sess.scalar(
+                select(Location).where(
+                    Location.id == self.dest_location_id,
+                    Location.organization_id == self.org_id
+                )
+            )
+            if dest is None or dest.is_inactive:
+                raise HttpError(code=404, message=MSG.LOCATION_NOT_FOUND)
+
+            resolved = self.load_items(sess, items)
+
+            # # Validation start ##
+            lps, containers, seen = [], [], set()
+            for idx, item in enumerate(items):
+                obj = resolved.get(item)
+                try:
+                    self.validate(obj, seen)
+                except HttpError as e:
+                    results[idx] = {
+                        "move_item_id": item,
+                        "success": False,
+                        "code": e.code,
+                        "error": e.message
+                    }
+                    continue
+                seen.add((type(obj), obj.id))
+                if isinstance(obj, Container):
+                    containers.append((idx, obj))
+                else:
+                    lps.append((idx, obj))
+            # # Validation end ##
+            logger.debug(
+                f"BULK MOVE: lps={len(lps)} containers={len(containers)} "
+                f"to={self.dest_location_id}"
+            )
+            if not lps and not containers:
+                return results
+
+            # lock every touched location in id order before any write,
+            # so batches moving in opposite directions can't deadlock
+            LocationService.lock_locations(
+                sess,
+                {obj.location_id for _, obj in lps + containers} | {dest.id}
+            )
+            now = datetime.datetime.utcnow()
+            moves = {}
+            if lps:
+                moves.update(self.move_license_plates(sess, lps, dest, now))
+            if containers:
+                moves.update(self.move_containers(sess, containers, now))
+            if self.outbox:
+                sess.flush()
+                self.enqueue_intents(sess, lps + containers, moves)
+
+            try:
+                sess.commit()
+            except Exception as e:
+                sess.rollback()
+                raise e
+
+            lp_schema = LicensePlateMoveOpenSearchSchema()
+            container_schema = ContainerMoveSchema()
+            for idx, move in moves.items():
+                schema = (
+                    container_schema if isinstance(move, ContainerMove)
+                    else lp_schema
+                )
+                results[idx] = {
+                    "move_item_id": items[idx],
+                    "success": True,
+                    "move": schema.dump(move)
+                }
+        return results
+
+    def move_license_plates(self, sess, lps, dest, now):
+        lp_ids = [lp.id for _, lp in lps]
+        src_ids = {lp.location_id for _, lp in lps}
+
+        # preload everything the per-item logic used to query one by one
+        products = {
+            p.id: p for p in sess.scalars(
+                select(Product).where(
+                    Product.id.in_({lp.product_id for _, lp in lps})
+                )
+            )
+        }
+        locations = {
+            loc.id: loc for loc in sess.scalars(
+                select(Location).where(Location.id.in_(src_ids))
+            )
+        }
+        locations[dest.id] = dest
+        prev_moves = {
+            m.license_plate_id: m for m in _latest_per(
+                sess, LicensePlateMove, LicensePlateMove.license_plate_id,
+                [
+                    tuple_(
+                        LicensePlateMove.license_plate_id,
+                        LicensePlateMove.dest_location_id
+                    ).in_([(lp.id, lp.location_id) for _, lp in lps])
+                ]
+            )
+        }
+        line_items = {
+            li.license_plate_id: li for li in _latest_per(
+                sess, ProductionOrderLineitem,
+                ProductionOrderLineitem.license_plate_id,
+                [ProductionOrderLineitem.license_plate_id.in_(lp_ids)]
+            )
+        }
+
+        activities = self.activity_service.log_many(
+            "license_plate",
+            lp_ids,
+            ActivityTypeEnum.LICENSE_PLATE_MOVE,
+            sess,
+            current_org_id=self.org_id,
+            current_user_id=self.user_id,
+        )
+
+        moves = {}
+        lp_qty_moves = []
+        line_item_totals = TotalsDelta()
+        part_no_totals = TotalsDelta()
+        for (idx, lp), activity in zip(lps, activities):
+            prod = products[lp.product_id]
+            move = LicensePlateMove(
+                license_plate_id=lp.id,
+                product_id=lp.product_id,
+                organization_id=self.org_id,
+                src_location_id=lp.location_id,
+                dest_location_id=dest.id,
+                user_id=self.user_id,
+                created_at=now,
+                product=prod,
+                license_plate=lp,
+                activity_id=activity.id
+            )
+            sess.add(move)
+            prev_move = prev_moves.get(lp.id)
+            if prev_move:
+                prev_move.left_at = now
+                self.prev_moves[idx] = prev_move
+
+            lp_qty_moves.append((lp.location_id, dest.id, lp.quantity))
+            part_no_totals.add((lp.location_id, prod.id), -1)
+            part_no_totals.add((dest.id, prod.id), 1)
+            line_item = line_items.get(lp.id)
+            if line_item:
+                po_id = line_item.production_order_id
+                line_item_totals.add((lp.location_id, po_id), -1)
+                line_item_totals.add((dest.id, po_id), 1)
+
+            lp.location_id = dest.id
+            moves[idx] = move
+
+        # flush changes from this transaction
+        sess.flush()
+        LocationService.record_arrival(dest.id, now, sess, count=len(lps))
+        lp_qty = net_lp_qty_moves(
+            self.current_lp_qty(sess, src_ids | {dest.id}), lp_qty_moves
+        )
+        apply_lp_qty_deltas(sess, lp_qty, counters=self.counters)
+        journal = DeltaJournal(sess) if self.deferred_aggregates else None
+        if journal is not None:
+            journal.line_items(line_item_totals)
+            journal.part_nos(part_no_totals)
+        else:
+            apply_line_item_totals(
+                sess, line_item_totals, locations, counters=self.counters
+            )
+            apply_part_no_totals(
+                sess, part_no_totals, products, counters=self.counters
+            )
+
+        report_schema = LicensePlateReportSchema(
+            exclude=(
+                'last_interaction', 'when_last_movement',
+                'who_moved_last', 'id',
+            )
+        )
+        for (idx, lp), activity in zip(lps, activities):
+            move = moves[idx]
+            last_interaction = datetime.datetime.strftime(
+                activity.created_at,
+                "%Y-%m-%d %H:%M:%S.%f"
+            )
+            if journal is not None:
+                journal.line_graph(move)
+                journal.move_report(
+                    move, last_interaction, report_schema.dump(lp)
+                )
+                continue
+            # update everything report
+            move.update_associated_report(
+                last_interaction, report_schema.dump(lp), sess
+            )
+        if journal is not None:
+            journal.flush()
+        else:
+            # one line graph write per (location, day, product)
+            apply_line_graph_moves(sess, [moves[idx] for idx, _ in lps])
+        return moves
+
+    def current_lp_qty(self, sess, location_ids):
+        """
+        `lp_qty` of the locations `execute` locked, the logical value
+        (base + shards) with striped counters
+        """
+        if self.counters is not None:
+            return self.counters.lp_qtys(sess, location_ids)
+        return dict(sess.execute(
+            select(Location.id, Location.lp_qty)
+            .where(Location.id.in_(location_ids))
+        ).all())
+
+    def move_containers(self, sess, containers, now):
+        container_ids = [c.id for _, c in containers]
+        prev_moves = {
+            m.container_id: m for m in _latest_per(
+                sess, ContainerMove, ContainerMove.container_id,
+                [
+                    tuple_(
+                        ContainerMove.container_id,
+                        ContainerMove.dest_location_id
+                    ).in_([(c.id, c.location_id) for _, c in containers])
+                ]
+            )
+        }
+        activities = self.activity_service.log_many(
+            "Container",
+            container_ids,
+            ActivityTypeEnum.CONTAINER_MOVE,
+            sess,
+            current_org_id=self.org_id,
+            current_user_id=self.user_id,
+        )
+        moves = {}
+        for (idx, container), activity in zip(containers, activities):
+            move = ContainerMove(
+                container_id=container.id,
+                organization_id=self.org_id,
+                src_location_id=container.location_id,
+                dest_location_id=self.dest_location_id,
+                user_id=self.user_id,
+                created_at=now,
+                activity_id=activity.id
+            )
+            sess.add(move)
+            prev_move = prev_moves.get(container.id)
+            if prev_move:
+                prev_move.left_at = now
+                self.prev_moves[idx] = prev_move
+            container.location_id = self.dest_location_id
+            moves[idx] = move
+        sess.flush()
+        return moves
+
+    def enqueue_intents(self, sess, entities, moves):
+        for idx, entity in entities:
+            enqueue_move_intents(
+                sess, entity, moves[idx], self.prev_moves.get(idx)
+            )
@@ -0,0 +1,70 @@
+from momenttrack_shared_models import (
+    Organization,
+    LicensePlate,
+    LicensePlateStatusEnum,
+    ActivityTypeEnum,
+)
+import momenttrack_shared_models.core.messages as MSG
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+
+from momenttrack_shared_services.utils import DBErrorHandler
+from momenttrack_shared_services.utils.activity import ActivityService
+from momenttrack_shared_services.utils.instrumentation import mark
+from momenttrack_shared_services.utils.outbox import enqueue_index
+
+
+def _comment(db, lp_id, message, org_id, user_id, headers, client, outbox=False):
+    with db.writer_session() as sess:
+        org = sess.get(Organization, org_id)
+        license_plate = None
+        if org is not None:
+            license_plate = sess.scalar(
+                select(LicensePlate).where(
+                    LicensePlate.id == lp_id,
+                    LicensePlate.organization_id == org.id
+                )
+            )
+        if (
+            license_plate is None
+            or license_plate.status == LicensePlateStatusEnum.DELETED
+        ):
+            raise Exception(MSG.LICENSE_PLATE_NOT_FOUND)
+        mark("lookup")
+        license_plate_id = license_plate.id
+        activity_service = ActivityService(
+            db, client, org.id, user_id, headers
+        )
+        activity = activity_service.log(
+            "license_plate",
+            license_plate_id,
+            ActivityTypeEnum.COMMENT,
+            sess,
+            message=message
+        )
+        mark("activity")
+        if outbox:
+            enqueue_index(
+                sess, "activity", activity.id,
+                {
+                    "id": activity.id,
+                    "user_id": activity.user_id,
+                    "organization_id": activity.organization_id,
+                    "ip_address": activity.ip_address,
+                    "created_at": activity.created_at,
+                    "activity_type": activity.activity_type.name,
+                    "model_name": activity.model_name,
+                    "model_id": activity.model_id,
+                    "message": activity.message,
+                }
+            )
+            mark("enqueue")
+        try:
+            sess.commit()
+        except KeyError as ke:
+            raise Exception(f"Missing key: {str(ke)}")
+        except ValueError as ve:
+            raise Exception(f"Invalid value: {str(ve)}")
+        except SQLAlchemyError as e:
+            DBErrorHandler(e, session=sess)
+        mark("commit")
@@ -22,6 +22,12 @@ from sqlalchemy import select
 from sqlalchemy.exc import SQLAlchemyError
 
 from momenttrack_shared_services.utils.activity import ActivityService
+from momenttrack_shared_services.utils.cache import ReferenceCache
+from momenttrack_shared_services.utils.location import LocationService
+from momenttrack_shared_services.utils.outbox import enqueue_index
+from momenttrack_shared_services.utils.journal import DeltaJournal
+from momenttrack_shared_services.utils.instrumentation import mark
+from momenttrack_shared_services.utils.idempotency import CREATE
 from momenttrack_shared_services.utils import (
     DBErrorHandler,
     saobj_as_dict,
@@ -32,19 +38,38 @@ from momenttrack_shared_services.utils import (
 )
 
 
+# design imaging redirect per organization
+# TODO: remove this hardcoded portion and make this more extensible
+REDIRECT_URLS = {
+    54: 'https://www.sentrelproducts.com/',
+    4: 'https://momenttrack.com/',
+}
+
+
 def add_lp(location, session=None, count=1):
     location.lp_qty += count
     session.commit()
 
 
 class Create:
-    def __init__(self, db, org_id, user_id, client, headers, comment=None):
+    def __init__(
+        self, db, org_id, user_id, client, headers,
+        comment=None, ref_cache=None, outbox=False, counters=None,
+        deferred_aggregates=False, idempotency=None, idempotency_key=None
+    ):
         self.db = db
         self.org_id = org_id
         self.user_id = user_id
         self.client = client
         self.headers = headers
         self.comment = comment
+        self.ref_cache = ref_cache or ReferenceCache(maxsize=0)
+        self.outbox = outbox
+        self.counters = counters
+        # journal aggregate deltas instead of writing them inline
+        self.deferred_aggregates = deferred_aggregates
+        self.idempotency = idempotency
+        self.idempotency_key = idempotency_key
 
         self.activity_service = ActivityService(
             db, client, org_id,
@@ -66,15 +91,16 @@ class Create:
         )
         # Added the common data
         with db.writer_session() as sess:
+            sys_loc = self.ref_cache.get_system_location(
+                self.org_id, session=sess
+            )
+            journal = DeltaJournal(sess) if self.deferred_aggregates else None
             license_plate.organization_id = self.org_id
             license_plate.status = LicensePlateStatusEnum.CREATED
 
             # add design imaging redirect
-            # TODO: remove this hardcoded portion and make this more extensible
-            if self.org_id == 54:
-                license_plate.redirect_url = 'https://www.sentrelproducts.com/'
-            elif self.org_id == 4:
-                license_plate.redirect_url = 'https://momenttrack.com/'
+            if self.org_id in REDIRECT_URLS:
+                license_plate.redirect_url = REDIRECT_URLS[self.org_id]
 
             # default location
             if license_plate.location_id is None:
@@ -82,14 +108,15 @@ class Create:
                     "Location doesn't exist, assigning system \
                         location automatically."
                 )
-                license_plate.location_id = Location.get_system_location(
-                    self.org_id
-                ).id
+                license_plate.location_id = sys_loc.id
+
+            mark("system_location")
 
             # Check if the LP already exists
             existing_lp = LicensePlate.get_by_lp_id_and_org(
                 license_plate.lp_id, self.org_id, session=sess
             )
+            mark("lookup")
             if existing_lp:
                 # if  not self.check_prev_move(existing_lp):
                 #     return 1
@@ -109,22 +136,34 @@ class Create:
                 )
             else:
                 # check if it belongs to some other org
-                lp = LicensePlate.query.filter_by(lp_id=license_plate.lp_id).first()
+                lp = sess.scalars(
+                    select(LicensePlate)
+                    .where(LicensePlate.lp_id == license_plate.lp_id)
+                    .limit(1)
+                ).first()
                 if lp:
                     DBErrorHandler(
                         Exception(
                             "Licenseplate value already belongs "
                             "to another organization"
-                        )
+                        ),
+                        session=sess
                     )
-                loc = Location.get_system_location(self.org_id, session=sess)
                 sess.add(license_plate)
-                add_lp(loc, sess, license_plate.quantity)
+                if self.counters is not None:
+                    self.counters.add_lp_qty(
+                        sess, sys_loc.id, license_plate.quantity
+                    )
+                else:
+                    LocationService.add_lp(
+                        sys_loc, sess, license_plate.quantity
+                    )
 
             lp_report = LicensePlateReportSchema(
                 exclude=('last_interaction',)
             ).dump(license_plate)
             sess.flush()
+            mark("lp_row")
             if production_order_id:
                 # check if lineitem has been made with same lp_id
                 order = sess.scalar(
@@ -134,12 +173,17 @@ class Create:
                 )
                 lp_report['production_order_id'] = order.id
                 lp_report['product_id'] = order.product_id
-                existing_item = ProductionOrderLineitem.query.filter(
-                    ProductionOrderLineitem.license_plate_id == license_plate.id,
-                    ProductionOrderLineitem.production_order_id == production_order_id
+                existing_item = sess.scalars(
+                    select(ProductionOrderLineitem).where(
+                        ProductionOrderLineitem.license_plate_id == license_plate.id,
+                        ProductionOrderLineitem.production_order_id == production_order_id
+                    ).limit(1)
                 ).first()
                 if existing_item:
-                    DBErrorHandler(Exception('lineitem with lp_id already exists'))
+                    DBErrorHandler(
+                        Exception('lineitem with lp_id already exists'),
+                        session=sess
+                    )
                 po_lineitem = ProductionOrderLineitemSchema().load(
                     {
                         "production_order_id": production_order_id,
@@ -149,6 +193,7 @@ class Create:
                 )
                 po_lineitem.organization_id = self.org_id
                 sess.add(po_lineitem)
+                mark("line_item")
                 # try:
                 #     sess.add(po_lineitem)
                 #     sess.flush()
@@ -229,23 +274,43 @@ class Create:
                 # except Exception as e:
                 #     DBErrorHandler(e)
                 try:
-                    loc = Location.get_by_id_and_org(
-                        license_plate.location_id,
-                        self.org_id
-                    )
-                    upsert_payload = {
-                        'production_order_id': production_order_id,
-                        'location': loc
-                    }
-                    LineItemTotals.upsert(upsert_payload, session=sess)
-                    upsert_payload = {
-                        'loc_id': license_plate.location_id,
-                        'product': order.product
-                    }
-                    LocationPartNoTotals.upsert(upsert_payload, sess)
+                    if journal is not None:
+                        journal.line_item(
+                            license_plate.location_id, production_order_id, 1
+                        )
+                        journal.part_no(
+                            license_plate.location_id, order.product_id, 1
+                        )
+                    elif self.counters is not None:
+                        self.counters.add_line_item_total(
+                            sess, license_plate.location_id,
+                            production_order_id, 1
+                        )
+                        self.counters.add_part_no_total(
+                            sess, license_plate.location_id,
+                            order.product_id, 1
+                        )
+                    else:
+                        loc = sess.scalar(
+                            select(Location).where(
+                                Location.id == license_plate.location_id,
+                                Location.organization_id == self.org_id
+                            )
+                        )
+                        upsert_payload = {
+                            'production_order_id': production_order_id,
+                            'location': loc
+                        }
+                        LineItemTotals.upsert(upsert_payload, session=sess)
+                        upsert_payload = {
+                            'loc_id': license_plate.location_id,
+                            'product': order.product
+                        }
+                        LocationPartNoTotals.upsert(upsert_payload, sess)
                     sess.flush()
                 except Exception as e:
-                    DBErrorHandler(e)
+                    DBErrorHandler(e, session=sess)
+                mark("totals")
 
                 message["production_order_id"] = production_order_id
                 # update everything report with order id
@@ -262,8 +327,11 @@ class Create:
                 current_user_id=self.user_id,
             )
 
+            mark("activity")
+
             # log to opensearch
             self.log_made(license_plate, sess)
+            mark("opensearch")
             lp_report['last_interaction'] = datetime.datetime.strftime(
                 activity.created_at,
                 "%Y-%m-%d %H:%M:%S.%f"
@@ -273,12 +341,30 @@ class Create:
                 'po_id': lp_report.get('production_order_id', None),
                 'report_raw': lp_report
             }
-            EverythingReport.upsert(lp_report_upsert_payload, sess)
+            if journal is not None:
+                journal.lp_report(lp_report_upsert_payload)
+                journal.flush()
+            else:
+                EverythingReport.upsert(lp_report_upsert_payload, sess)
+            mark("report")
+            if self.outbox:
+                sess.flush()
+                enqueue_index(
+                    sess, "lp_alias", license_plate.id,
+                    LicensePlateOpenSearchSchema().dump(license_plate)
+                )
+                mark("enqueue")
+            if self.idempotency_key is not None:
+                self.idempotency.record(
+                    sess, self.org_id, self.idempotency_key, CREATE,
+                    entity_id=license_plate.id
+                )
             try:
                 sess.commit()
             except Exception as e:
                 sess.rollback()
                 raise e
+            mark("commit")
             print(license_plate.lp_id)
             return license_plate
 
@@ -319,7 +405,7 @@ class Create:
                 try:
                     sess.flush()
                 except SQLAlchemyError as e:
-                    DBErrorHandler(e)
+                    DBErrorHandler(e, session=sess)
         except Exception as e:  # pylint:disable=W0718
             # sess.flush(license_plate)
             sess.rollback()
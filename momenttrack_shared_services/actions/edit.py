@@ -4,6 +4,7 @@
 """
 
 from loguru import logger
+from sqlalchemy import select
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import lazyload
 from momenttrack_shared_models import (
@@ -23,10 +24,94 @@ from momenttrack_shared_services.utils import (
     update_lp_moves,
     update_line_items
 )
+from momenttrack_shared_services.utils.outbox import (
+    enqueue_update,
+    enqueue_update_by_query
+)
+from momenttrack_shared_services.utils.instrumentation import mark
+from momenttrack_shared_services.utils.ubq import (
+    update_line_items_many,
+    update_lp_moves_many
+)
 from momenttrack_shared_services import messages as MSG
 
 
-def _edit(db, lp_obj, org_id, client):
+def _edit(db, lp_obj, org_id, client, outbox=False, poller=None):
+    """
+    With an `utils.ubq.UpdateTaskPoller` as `poller` the line item and
+    move documents are updated by async UpdateByQuery tasks the poller
+    follows, instead of blocking on each one.
+    """
+    resp, license_plate, line_item, lp_moves = _edit_record(
+        db, lp_obj, org_id, outbox=outbox
+    )
+    if outbox:
+        return resp
+
+    license_plate_id = license_plate.id
+    try:
+        logger.info(
+            "OPENSEARCH [INFO]:: Attempting "
+            "to index license_plate document.."
+        )
+        client.update(
+            index="lp_alias",
+            body={
+                "doc": LicensePlateOpenSearchSchema().dump(license_plate)
+            },
+            id=license_plate_id,
+        )
+
+        # update line-item
+        if line_item:
+            update = {
+                "external_serial_number": resp["external_serial_number"]
+            }
+            if poller is not None:
+                update_line_items_many(
+                    client, [(license_plate_id, update)], poller=poller
+                )
+            else:
+                update_line_items(client, license_plate_id, update)
+
+        if lp_moves:
+            update = {
+                "license_plate": {
+                    "external_serial_number": resp['external_serial_number']
+                }
+            }
+            if poller is not None:
+                update_lp_moves_many(
+                    client, [(license_plate_id, update)], poller=poller
+                )
+            else:
+                update_lp_moves(client, license_plate_id, update)
+
+        client.update(
+            index="everything_report_idx",
+            body={"doc": LicensePlateReportSchema(
+                exclude=('last_interaction',)
+            ).dump(license_plate)},
+            id=license_plate_id
+        )
+        mark("opensearch")
+    except Exception as e:
+        logger.error(
+            "OPENSEARCH [ERROR] An error occurred while trying to "
+            "update the report indexes [production_order_lineitem]"
+            " and or [license_plates]"
+        )
+        db.writer_session.rollback()
+        raise e
+
+    return resp
+
+
+def _edit_record(db, lp_obj, org_id, outbox=False):
+    """
+    Database side of an edit. Returns the dumped license plate and what
+    the OpenSearch updates need: (resp, license_plate, line_item, lp_moves)
+    """
     with db.writer_session() as sess:
         license_plate_id = lp_obj.pop('id')
         license_plate = LicensePlate.get_by_lp_id_or_id_and_org(
@@ -34,23 +119,27 @@ def _edit(db, lp_obj, org_id, client):
         )
         if not license_plate:
             raise HttpError(code=404, message=MSG.LICENSE_PLATE_NOT_FOUND)
+        mark("lookup")
 
         license_plate_id = license_plate.id
         lp_location_id = license_plate.location_id
 
         # find line item
-        line_item = ProductionOrderLineitem.query.filter_by(
-            license_plate_id=license_plate.id
+        line_item = sess.scalars(
+            select(ProductionOrderLineitem)
+            .where(ProductionOrderLineitem.license_plate_id == license_plate.id)
+            .limit(1)
         ).first()
 
         # find moves
-        lp_moves = db.session.query(LicensePlateMove).options(
+        lp_moves = sess.query(LicensePlateMove).options(
             lazyload(LicensePlateMove.user)
         ).options(
             lazyload(LicensePlateMove.product)
         ).options(lazyload(LicensePlateMove.license_plate)).filter_by(
             license_plate_id=license_plate_id
         ).all()
+        mark("related")
 
         schema = LicensePlateSchema(partial=True, session=sess)
         license_plate = schema.load(lp_obj, instance=license_plate)
@@ -64,6 +153,10 @@ def _edit(db, lp_obj, org_id, client):
             raise HttpError(
                 code=403, message=MSG.LICENSE_PLATE_MOVE_NOT_PERMITTED_WITH_PUT
             )
+        mark("load")
+        if outbox:
+            enqueue_edit_intents(sess, license_plate, line_item, lp_moves)
+            mark("enqueue")
         try:
             sess.commit()
             resp = schema.dump(license_plate)
@@ -72,52 +165,51 @@ def _edit(db, lp_obj, org_id, client):
         except ValueError as ve:
             raise HttpError(code=400, message=f"Invalid value: {str(ve)}")
         except SQLAlchemyError as e:
-            DBErrorHandler(e)
+            DBErrorHandler(e, session=sess)
         finally:
             sess.close()
+        mark("commit")
+        return resp, license_plate, line_item, lp_moves
 
-        try:
-            logger.info(
-                "OPENSEARCH [INFO]:: Attempting "
-                "to index license_plate document.."
-            )
-            client.update(
-                index="lp_alias",
-                body={
-                    "doc": LicensePlateOpenSearchSchema().dump(license_plate)
-                },
-                id=license_plate_id,
-            )
 
-            # update line-item
-            if line_item:
-                update = {
-                    "external_serial_number": resp["external_serial_number"]
-                }
-                update_line_items(client, license_plate_id, update)
+def edit_intents(license_plate, line_item, lp_moves):
+    """
+    OpenSearch writes that follow an edit, as `("update", index, doc_id,
+    doc)` and `("update_by_query", index, license_plate_id, updates)`
+    tuples.
+    """
+    serial = license_plate.external_serial_number
+    intents = [(
+        "update", "lp_alias", license_plate.id,
+        LicensePlateOpenSearchSchema().dump(license_plate)
+    )]
+    if line_item:
+        intents.append((
+            "update_by_query", "production_order_lineitems_alias",
+            license_plate.id, {"external_serial_number": serial}
+        ))
+    if lp_moves:
+        intents.append((
+            "update_by_query", "lp_move_alias",
+            license_plate.id, {"license_plate": {"external_serial_number": serial}}
+        ))
+    intents.append((
+        "update", "everything_report_idx", license_plate.id,
+        LicensePlateReportSchema(exclude=('last_interaction',)).dump(
+            license_plate
+        )
+    ))
+    return intents
 
-            if lp_moves:
-                update = {
-                    "license_plate": {
-                        "external_serial_number": resp['external_serial_number']
-                    }
-                }
-                update_lp_moves(client, license_plate_id, update)
 
-            client.update(
-                index="everything_report_idx",
-                body={"doc": LicensePlateReportSchema(
-                    exclude=('last_interaction',)
-                ).dump(license_plate)},
-                id=license_plate_id
+def enqueue_edit_intents(sess, license_plate, line_item, lp_moves):
+    """Outbox counterpart of the OpenSearch updates made after an edit"""
+    for op, index, key, payload in edit_intents(
+        license_plate, line_item, lp_moves
+    ):
+        if op == "update":
+            enqueue_update(sess, index, key, payload, upsert=False)
+        else:
+            enqueue_update_by_query(
+                sess, index, "license_plate_id", key, payload
             )
-        except Exception as e:
-            logger.error(
-                "OPENSEARCH [ERROR] An error occurred while trying to "
-                "update the report indexes [production_order_lineitem]"
-                " and or [license_plates]"
-            )
-            db.writer_session.rollback()
-            raise e
-
-        return resp
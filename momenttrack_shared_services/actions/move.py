@@ -2,7 +2,7 @@ import datetime
 
 from loguru import logger
 from sqlalchemy.orm import lazyload
-from sqlalchemy import select, update, text
+from sqlalchemy import select, update, and_, or_, case, literal
 from momenttrack_shared_models import (
     LicensePlateStatusEnum,
     LicensePlate,
@@ -32,6 +32,18 @@ from momenttrack_shared_services.messages import \
 from momenttrack_shared_services.utils.activity import ActivityService
 from momenttrack_shared_services.utils.location import LocationService
 from momenttrack_shared_services import messages as MSG
+from momenttrack_shared_services.utils.outbox import (
+    enqueue_index,
+    enqueue_update
+)
+from momenttrack_shared_services.utils.counters import StripedCounters
+from momenttrack_shared_services.utils.journal import DeltaJournal
+from momenttrack_shared_services.utils.instrumentation import mark
+from momenttrack_shared_services.utils.idempotency import (
+    IdempotencyStore,
+    MOVE
+)
+from momenttrack_shared_services.utils.cache import ReferenceCache
 from momenttrack_shared_services.utils import (
     HttpError,
     create_or_update_doc,
@@ -41,12 +53,67 @@ from momenttrack_shared_services.utils import (
 )
 
 
+def resolve_lp_or_container(session, identifier, org_id):
+    """
+    Look up a license plate (by lp_id or id) or container (by container_id
+    or id) in a single round trip.
+
+    Both tables are LEFT JOINed onto a one-row anchor, so a miss still
+    returns exactly one (None, None) row. License plates win over
+    containers and lp_id matches win over id matches.
+    """
+    str_id = str(identifier)
+    int_id = int(identifier) if str_id.isdigit() else None
+
+    lp_match = LicensePlate.lp_id == str_id
+    container_match = Container.container_id == str_id
+    if int_id is not None:
+        lp_match = or_(lp_match, LicensePlate.id == int_id)
+        container_match = or_(container_match, Container.id == int_id)
+
+    anchor = select(literal(1).label("anchor")).subquery()
+    stmt = (
+        select(LicensePlate, Container)
+        .select_from(anchor)
+        .outerjoin(
+            LicensePlate,
+            and_(LicensePlate.organization_id == org_id, lp_match)
+        )
+        .outerjoin(
+            Container,
+            and_(Container.organization_id == org_id, container_match)
+        )
+        .order_by(
+            case((LicensePlate.lp_id == str_id, 0), else_=1),
+            case((Container.container_id == str_id, 0), else_=1)
+        )
+        .limit(1)
+    )
+    lp, container = session.execute(stmt).one()
+    return lp if lp is not None else container
+
+
+def enqueue_move_intents(session, entity, move, prev_move=None):
+    """Record the OpenSearch writes for a flushed move in the outbox"""
+    if isinstance(move, ContainerMove):
+        schema, move_index = ContainerMoveSchema(), 'container_move_alias'
+    else:
+        schema, move_index = LicensePlateMoveOpenSearchSchema(), 'lp_move_alias'
+    enqueue_index(session, move_index, move.id, schema.dump(move))
+    if prev_move:
+        enqueue_update(
+            session, move_index, prev_move.id,
+            {"left_at": move.created_at}, upsert=False
+        )
+    if isinstance(entity, LicensePlate):
+        enqueue_update(
+            session, "lp_alias", entity.id,
+            LicensePlateOpenSearchSchema().dump(entity)
+        )
+
+
 def move_lp(src_id, dest_id, session, count=1):
-    src_loc = Location.get_by_id(src_id, session=session)
-    dest_loc = Location.get_by_id(dest_id, session=session)
-    if src_loc.lp_qty > 0:
-        src_loc.lp_qty -= count
-        dest_loc.lp_qty += count
+    LocationService.move_lp(src_id, dest_id, None, session=session, count=count)
     session.commit()
 
 
@@ -60,9 +127,22 @@ class Move:
         user_id: int,
         headers: dict,
         client,
-        loglocation: bool = None
+        loglocation: bool = None,
+        ref_cache: ReferenceCache = None,
+        outbox: bool = False,
+        counters: StripedCounters = None,
+        deferred_aggregates: bool = False,
+        idempotency: IdempotencyStore = None,
+        idempotency_key: str = None
     ):
         self.move_item_id = move_item_id
+        self.outbox = outbox
+        self.counters = counters
+        # journal aggregate deltas instead of writing them inline
+        self.deferred_aggregates = deferred_aggregates
+        self.idempotency = idempotency
+        self.idempotency_key = idempotency_key
+        self.ref_cache = ref_cache or ReferenceCache(maxsize=0)
         self.client = client
         self.org_id = org_id
         self.loglocation = loglocation
@@ -85,6 +165,8 @@ class Move:
         """
 
         db = self.db
+        # move item lookup happens in __init__
+        mark("lookup")
         with db.writer_session() as sess:
             mov_item = self.move_item
 
@@ -125,7 +207,7 @@ class Move:
                     license_plate=mov_item
                 )
                 prev_move = (
-                    moveModel.query.with_session(db.writer_session())
+                    sess.query(moveModel)
                     .options(lazyload(LicensePlateMove.user))
                     .options(lazyload(LicensePlateMove.product))
                     .options(lazyload(LicensePlateMove.license_plate))
@@ -151,7 +233,7 @@ class Move:
                     created_at=datetime.datetime.utcnow()
                 )
                 prev_move = (
-                    moveModel.query.with_session(db.writer_session())
+                    sess.query(moveModel)
                     .options(lazyload(ContainerMove.user))
                     .filter_by(
                         container_id=mov_item.id,
@@ -169,13 +251,23 @@ class Move:
                 )
 
             # verify if dest location exists
-            loc = Location.get_by_id_and_org(
-                self.dest_location_id,
-                self.org_id
+            loc = sess.scalar(
+                select(Location).where(
+                    Location.id == self.dest_location_id,
+                    Location.organization_id == self.org_id
+                )
             )
             if loc is None or loc.is_inactive:
                 raise HttpError(code=404, message=MSG.LOCATION_NOT_FOUND)
             # # Validation end ##
+            mark("validate")
+            # lock src/dest location rows in id order before any write
+            # (the move rows' foreign keys and the dwell stats touch
+            # them too), so moves in opposite directions can't deadlock
+            LocationService.lock_locations(
+                sess, {mov_item.location_id, self.dest_location_id}
+            )
+            mark("lock")
 
             # create an activity
             activity = self.activity_service.log(
@@ -187,6 +279,8 @@ class Move:
                 current_user_id=self.user_id,
             )
 
+            mark("activity")
+
             # Create move trx, first
             Move.activity_id = activity.id
             sess.add(Move)
@@ -232,23 +326,18 @@ class Move:
 
             # flush changes from this transaction
             sess.flush()
-            sql = text("""
-                UPDATE location
-                SET average_duration = (
-                    SELECT
-                        CASE
-                            WHEN COUNT(*) < 2 THEN 0
-                            ELSE EXTRACT(EPOCH FROM (MAX(created_at) - MIN(created_at))) / (COUNT(*) - 1)
-                        END
-                    FROM license_plate_move
-                    WHERE dest_location_id = :loc_id
+            mark("move_row")
+            if not is_container:
+                LocationService.record_arrival(
+                    Move.dest_location_id, Move.created_at, sess
                 )
-                WHERE id = :loc_id
-            """)
-            sess.execute(sql, {'loc_id': Move.dest_location_id})
-            line_item = ProductionOrderLineitem.query.filter_by(
-                license_plate_id=mov_item.id
-            ).order_by(ProductionOrderLineitem.created_at.desc()).first()
+                mark("dwell_stats")
+            line_item = sess.scalars(
+                select(ProductionOrderLineitem)
+                .where(ProductionOrderLineitem.license_plate_id == mov_item.id)
+                .order_by(ProductionOrderLineitem.created_at.desc())
+                .limit(1)
+            ).first()
 
             # resp = self.log_move(
             #     entity=mov_item,
@@ -257,7 +346,20 @@ class Move:
             #     is_container=is_container,
             #     line_item=line_item
             # )
-            if line_item:
+            journal = DeltaJournal(sess) if self.deferred_aggregates else None
+            if line_item and journal is not None:
+                po_id = line_item.production_order_id
+                journal.line_item(Move.src_location_id, po_id, -1)
+                journal.line_item(Move.dest_location_id, po_id, 1)
+            elif line_item and self.counters is not None:
+                po_id = line_item.production_order_id
+                self.counters.add_line_item_total(
+                    sess, Move.src_location_id, po_id, -1
+                )
+                self.counters.add_line_item_total(
+                    sess, Move.dest_location_id, po_id, 1
+                )
+            elif line_item:
                 po_id = line_item.production_order_id
                 stmt = (
                     update(LineItemTotals)
@@ -283,36 +385,65 @@ class Move:
                         total_items=1
                     )
                     sess.add(new_stat)
+            mark("line_item_totals")
             if not is_container:
                 print("MOV ITEM", mov_item, Move.src_location_id, prod.part_number)
-                LocationService.move_lp(
-                    Move.src_location_id,
-                    Move.dest_location_id,
-                    self.db,
-                    count=mov_item.quantity
-                )
+                if self.counters is not None:
+                    # same rule as move_lp: only move out of a non-empty src
+                    if self.counters.lp_qty(sess, Move.src_location_id) > 0:
+                        self.counters.add_lp_qty(
+                            sess, Move.src_location_id, -mov_item.quantity
+                        )
+                        self.counters.add_lp_qty(
+                            sess, Move.dest_location_id, mov_item.quantity
+                        )
+                else:
+                    LocationService.move_lp(
+                        Move.src_location_id,
+                        Move.dest_location_id,
+                        self.db,
+                        session=sess,
+                        count=mov_item.quantity
+                    )
+                mark("lp_qty")
                 # update linegraph info
-                upsert_payload = {
-                    'loc_id': Move.dest_location_id,
-                    'date_key': str(Move.created_at)[:10],
-                    'lp_move': Move,
-                    'product': prod
-                }
-                LineGraphData.upsert(upsert_payload, sess)
+                if journal is not None:
+                    journal.line_graph(Move)
+                else:
+                    upsert_payload = {
+                        'loc_id': Move.dest_location_id,
+                        'date_key': str(Move.created_at)[:10],
+                        'lp_move': Move,
+                        'product': prod
+                    }
+                    LineGraphData.upsert(upsert_payload, sess)
+                mark("line_graph")
                 # update location part_no totals
-                upsert_payload = {
-                    'loc_id': Move.src_location_id,
-                    'product': prod
-                }
-                LocationPartNoTotals.upsert_src_loc_total(
-                    upsert_payload, session=sess
-                )
-                # upsert dest loc
-                upsert_payload = {
-                    'loc_id': Move.dest_location_id,
-                    'product': prod
-                }
-                LocationPartNoTotals.upsert(upsert_payload, sess)
+                if journal is not None:
+                    journal.part_no(Move.src_location_id, prod.id, -1)
+                    journal.part_no(Move.dest_location_id, prod.id, 1)
+                elif self.counters is not None:
+                    self.counters.add_part_no_total(
+                        sess, Move.src_location_id, prod.id, -1
+                    )
+                    self.counters.add_part_no_total(
+                        sess, Move.dest_location_id, prod.id, 1
+                    )
+                else:
+                    upsert_payload = {
+                        'loc_id': Move.src_location_id,
+                        'product': prod
+                    }
+                    LocationPartNoTotals.upsert_src_loc_total(
+                        upsert_payload, session=sess
+                    )
+                    # upsert dest loc
+                    upsert_payload = {
+                        'loc_id': Move.dest_location_id,
+                        'product': prod
+                    }
+                    LocationPartNoTotals.upsert(upsert_payload, sess)
+                mark("part_no_totals")
                 # update everything report
                 lp_report = LicensePlateReportSchema(
                     exclude=(
@@ -320,19 +451,35 @@ class Move:
                         'who_moved_last', 'id',
                     )
                 ).dump(mov_item)
-                Move.update_associated_report(
-                    datetime.datetime.strftime(
-                        activity.created_at,
-                        "%Y-%m-%d %H:%M:%S.%f"
-                    ),
-                    lp_report,
-                    sess
+                last_interaction = datetime.datetime.strftime(
+                    activity.created_at,
+                    "%Y-%m-%d %H:%M:%S.%f"
+                )
+                if journal is not None:
+                    journal.move_report(Move, last_interaction, lp_report)
+                else:
+                    Move.update_associated_report(
+                        last_interaction, lp_report, sess
+                    )
+                mark("report")
+            if journal is not None:
+                journal.flush()
+            if self.outbox:
+                sess.flush()
+                enqueue_move_intents(sess, mov_item, Move, prev_move)
+            mark("enqueue")
+            if self.idempotency_key is not None:
+                sess.flush()
+                self.idempotency.record(
+                    sess, self.org_id, self.idempotency_key, MOVE,
+                    entity_id=Move.id, result=schema.dump(Move)
                 )
             try:
                 sess.commit()
             except Exception as e:
                 sess.rollback()
                 raise e
+            mark("commit")
             resp = schema.dump(Move)
             return resp
 
@@ -480,22 +627,17 @@ class Move:
 
     def get_lp_or_container(self):
         db = self.db
-        obj = None
-
-        obj = LicensePlate.get_by_lp_id_or_id_and_org(
-            self.move_item_id, self.org_id, session=db.writer_session
+        obj = resolve_lp_or_container(
+            db.writer_session, self.move_item_id, self.org_id
         )
-        if not obj:
-            obj = Container.get_by_id_or_by_container_id(
-                self.move_item_id, self.org_id,
-                session=db.writer_session
-            )
         if not obj:
             sess = db.writer_session
-            prod = Product.get_system_product(
-                self.org_id
+            prod = self.ref_cache.get_system_product(
+                self.org_id, session=sess
+            )
+            sys_loc = self.ref_cache.get_system_location(
+                self.org_id, session=sess
             )
-            sys_loc = Location.get_system_location(self.org_id)
             # check if its a container
             print("License plate doesn't already exist creating ...")
             cr = Create(
@@ -504,13 +646,15 @@ class Move:
                 self.user_id,
                 self.client,
                 self.headers,
-                comment="Licenseplate made outside of proper made request"
+                comment="Licenseplate made outside of proper made request",
+                ref_cache=self.ref_cache,
+                outbox=self.outbox,
+                counters=self.counters,
+                deferred_aggregates=self.deferred_aggregates
             )
             license_plate = LicensePlate(
                 lp_id=self.move_item_id,
-                product_id=Product.get_system_product(
-                    self.org_id
-                ).id,
+                product_id=prod.id,
                 quantity=1,
                 organization_id=self.org_id
             )
@@ -525,9 +669,10 @@ class Move:
             try:
                 obj = cr.execute(
                     license_plate,
-                    production_order_id=ProductionOrder.get_system_order(
+                    production_order_id=self.ref_cache.get_system_order(
                         self.org_id,
-                        self.user_id
+                        self.user_id,
+                        session=sess
                     ).id
                 )
                 # fetch obj afterwards
@@ -0,0 +1,436 @@
+import datetime
+
+from momenttrack_shared_models import Location
+import momenttrack_shared_models.core.messages as MSG
+from momenttrack_shared_models.core.extensions import db
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+
+from .actions.move import Move, resolve_lp_or_container
+from .actions.bulk_move import BulkMove
+from .actions.create import Create
+from .actions.bulk_create import BulkCreate
+from .actions.edit import _edit
+from .actions.comment import _comment
+from .utils.activity import ActivityService
+from .utils.location import LocationService
+from .utils import DBErrorHandler, HttpError
+from .utils.cache import ReferenceCache
+from .utils.counters import StripedCounters
+from .utils.executor import MoveExecutor
+from .utils.export import HistoryExporter
+from .utils.idempotency import IdempotencyStore, Replay, MOVE, CREATE
+from .utils.journal import AggregateCompactor
+from .utils.instrumentation import (
+    Instrumentation,
+    CountingClient,
+    install_sql_counter,
+    instrumented
+)
+from .utils.routing import SessionRouter, writes
+from .utils.ubq import UpdateTaskPoller
+
+
+class LicensePlateServiceAgent:
+    def __init__(
+        self, db_config, os_client=None, use_outbox=False, database=None,
+        deferred_aggregates=False, instrumentation=None
+    ):
+        """
+        `database` replaces the shared models' `db` extension, e.g. an
+        `ext.SQLSci.SQLSci` engine registry; it's initialised with
+        `database.init_db(db_config, pool_size=...)` the same way.
+
+        With `deferred_aggregates` the report aggregates (line graph,
+        part number / line item totals, everything report) are journaled
+        and folded later by `utils.journal.AggregateCompactor`.
+
+        `instrumentation` is a `utils.instrumentation.Instrumentation`
+        sink (e.g. `HistogramSink()` or `LogSink()`) that receives per
+        phase timings and SQL / OpenSearch call counts of each operation.
+
+        With `ASYNC_UPDATE_BY_QUERY` set in `db_config`, edits start their
+        UpdateByQuery tasks without waiting; `self.ubq_poller` follows
+        them and dead-letters failures.
+        """
+        self.db = database or db
+        self.instrumentation = instrumentation or Instrumentation()
+        if self.instrumentation.enabled:
+            install_sql_counter()
+            if os_client is not None:
+                os_client = CountingClient(os_client)
+        self.os_client = os_client
+        # write OpenSearch intents to the outbox instead of indexing inline
+        self.use_outbox = use_outbox
+        self.deferred_aggregates = deferred_aggregates
+        self.db_config = db_config
+        self.pool_size = db_config.pop('SQLALCHEMY_DB_POOL_SIZE', 20)
+        self.ref_cache = ReferenceCache(
+            maxsize=db_config.pop('REFERENCE_CACHE_SIZE', 1024),
+            ttl=db_config.pop('REFERENCE_CACHE_TTL', 300)
+        )
+        self.idempotency = IdempotencyStore(
+            maxsize=db_config.pop('IDEMPOTENCY_CACHE_SIZE', 10000),
+            ttl=db_config.pop('IDEMPOTENCY_CACHE_TTL', 3600)
+        )
+        # > 0 spreads hot counter writes over that many shard rows
+        shards = db_config.pop('STRIPED_COUNTER_SHARDS', 0)
+        self.counters = StripedCounters(shards) if shards else None
+        # edits start UpdateByQuery tasks without waiting for them
+        self.ubq_poller = None
+        if db_config.pop('ASYNC_UPDATE_BY_QUERY', False) and os_client:
+            self.ubq_poller = UpdateTaskPoller(self.os_client)
+            self.ubq_poller.start()
+        self.db = self.db.init_db(
+            db_config,
+            pool_size=self.pool_size
+        )
+        # reads that don't feed a write go to the 'reader' bind, if any
+        self.router = SessionRouter(
+            self.db, db_config,
+            reader_bind=db_config.pop('SQLALCHEMY_READER_BIND', 'reader'),
+            pool_size=self.pool_size
+        )
+
+    @instrumented("move")
+    @writes
+    def move(
+        self, move_item_id,
+        dest_location_id, org_id,
+        headers, user_id,
+        loglocation=None,
+        idempotency_key=None
+    ):
+        """
+        With an `idempotency_key`, a replayed request returns the first
+        request's result without moving anything again.
+        """
+        if idempotency_key is not None:
+            replay = self._replay(org_id, idempotency_key, MOVE)
+            if replay is not None:
+                return replay.result
+        db = self.db
+        client = self.os_client
+        _move = Move(
+            db,
+            move_item_id,
+            org_id,
+            dest_location_id,
+            user_id,
+            headers,
+            client,
+            loglocation,
+            ref_cache=self.ref_cache,
+            outbox=self.use_outbox,
+            counters=self.counters,
+            deferred_aggregates=self.deferred_aggregates,
+            idempotency=self.idempotency,
+            idempotency_key=idempotency_key
+        )
+        try:
+            lp_move = _move.execute()
+        except (IntegrityError, HttpError):
+            # a concurrent copy of this request committed first: recording
+            # the key collided, or the item is already at the destination
+            replay = idempotency_key and self._replay(
+                org_id, idempotency_key, MOVE
+            )
+            if not replay:
+                raise
+            return replay.result
+        if idempotency_key is not None:
+            self.idempotency.remember(
+                org_id, idempotency_key,
+                Replay(MOVE, lp_move.get("id"), lp_move)
+            )
+        return lp_move
+
+    def _replay(self, org_id, key, operation):
+        with self.db.writer_session() as sess:
+            return self.idempotency.lookup(sess, org_id, key, operation)
+
+    def _replay_create(self, org_id, key):
+        with self.db.writer_session() as sess:
+            return self.idempotency.created_license_plate(sess, org_id, key)
+
+    def move_item_key(self, move_item_id, org_id):
+        """
+        `(kind, id)` of the license plate or container `move_item_id`
+        names (lp_id / container_id or id), None if there's none yet
+        """
+        with self.db.writer_session() as sess:
+            obj = resolve_lp_or_container(sess, move_item_id, org_id)
+            if obj is None:
+                return None
+            return (type(obj).__name__, obj.id)
+
+    def move_executor(self, max_workers=8, max_retries=5, max_pending=None):
+        """
+        `MoveExecutor` running this agent's moves on a bounded thread
+        pool, serialized per move item and retried on deadlocks
+        """
+        return MoveExecutor(
+            self, max_workers=max_workers,
+            max_retries=max_retries, max_pending=max_pending
+        )
+
+    @instrumented("move_many")
+    @writes
+    def move_many(
+        self, items,
+        dest_location_id, org_id,
+        headers, user_id,
+        loglocation=None
+    ):
+        """Move many LPs/containers to one location in a single transaction.
+
+        Returns one result dict per item (see `BulkMove.execute`); invalid
+        items are reported as failures without aborting the batch.
+        """
+        db = self.db
+        client = self.os_client
+        _move = BulkMove(
+            db,
+            org_id,
+            dest_location_id,
+            user_id,
+            headers,
+            client,
+            loglocation,
+            outbox=self.use_outbox,
+            counters=self.counters,
+            deferred_aggregates=self.deferred_aggregates
+        )
+        return _move.execute(items)
+
+    @instrumented("create")
+    @writes
+    def create(
+        self,
+        lp, org_id,
+        user_id, headers,
+        session=None,
+        production_order_id=None,
+        comment=None,
+        idempotency_key=None
+    ):
+        """
+        With an `idempotency_key`, a replayed request returns the license
+        plate created by the first request without doing any writes.
+        """
+        if idempotency_key is not None:
+            existing = self._replay_create(org_id, idempotency_key)
+            if existing is not None:
+                return existing
+        db = self.db
+        client = self.os_client
+        _create = Create(
+            db,
+            org_id,
+            user_id,
+            client,
+            headers,
+            comment=comment,
+            ref_cache=self.ref_cache,
+            outbox=self.use_outbox,
+            counters=self.counters,
+            deferred_aggregates=self.deferred_aggregates,
+            idempotency=self.idempotency,
+            idempotency_key=idempotency_key
+        )
+        try:
+            lp = _create.execute(
+                license_plate=lp,
+                production_order_id=production_order_id
+            )
+        except IntegrityError:
+            existing = idempotency_key and self._replay_create(
+                org_id, idempotency_key
+            )
+            if existing is None:
+                raise
+            return existing
+        if idempotency_key is not None:
+            self.idempotency.remember(
+                org_id, idempotency_key, Replay(CREATE, lp.id)
+            )
+        return lp
+
+    @instrumented("create_many")
+    @writes
+    def create_many(
+        self,
+        license_plates, production_order_id,
+        org_id, user_id, headers,
+        comment=None,
+        chunk_size=500
+    ):
+        """Create many license plates for one production order.
+
+        Work is committed once per `chunk_size` license plates; a chunk
+        that fails doesn't undo the others. Returns one result dict per
+        license plate (see `BulkCreate.execute`).
+        """
+        db = self.db
+        client = self.os_client
+        _create = BulkCreate(
+            db,
+            org_id,
+            user_id,
+            client,
+            headers,
+            comment=comment,
+            chunk_size=chunk_size,
+            ref_cache=self.ref_cache,
+            outbox=self.use_outbox,
+            counters=self.counters,
+            deferred_aggregates=self.deferred_aggregates
+        )
+        return _create.execute(
+            license_plates,
+            production_order_id=production_order_id
+        )
+
+    @instrumented("comment")
+    @writes
+    def comment(self, lp_id, message, org_id, user_id, headers):
+        return _comment(
+            self.db, lp_id, message, org_id, user_id, headers,
+            self.os_client, outbox=self.use_outbox
+        )
+
+    @instrumented("edit")
+    @writes
+    def edit(self, lp_obj, org_id):
+        return _edit(
+            self.db, lp_obj, org_id, self.os_client,
+            outbox=self.use_outbox, poller=self.ubq_poller
+        )
+
+    def export_activities(
+        self, org_id,
+        start=None, end=None,
+        model_name=None, page_size=1000
+    ):
+        """Generator over an org's activities in (created_at, id) order"""
+        exporter = HistoryExporter(
+            self.router.read_session, org_id, page_size=page_size
+        )
+        return exporter.activities(start=start, end=end, model_name=model_name)
+
+    def export_lp_moves(
+        self, org_id,
+        start=None, end=None,
+        location_id=None, page_size=1000
+    ):
+        """Generator over an org's license plate moves in (created_at, id) order"""
+        exporter = HistoryExporter(
+            self.router.read_session, org_id, page_size=page_size
+        )
+        return exporter.lp_moves(start=start, end=end, location_id=location_id)
+
+    @instrumented("get_logs")
+    def get_logs(
+        self, model_name, model_id, org_id,
+        user_id=None, headers=None,
+        limit=None, offset=0
+    ):
+        """Activity logs of a model, read from the reader bind"""
+        activity_service = ActivityService(
+            self.db, self.os_client, org_id, user_id, headers or {}
+        )
+        with self.router.read_session() as sess:
+            return activity_service.get_logs(
+                model_name, model_id,
+                limit=limit, offset=offset, session=sess
+            )
+
+    @instrumented("get_location_report")
+    def get_location_report(
+        self, location_id, org_id,
+        aggregated=True, limit=50, offset=0
+    ):
+        """Location report, read from the reader bind"""
+        with self.router.read_session() as sess:
+            location = sess.scalar(
+                select(Location).where(
+                    Location.id == location_id,
+                    Location.organization_id == org_id
+                )
+            )
+            if location is None:
+                raise HttpError(code=404, message=MSG.LOCATION_NOT_FOUND)
+            if self.counters is not None:
+                self.counters.load_lp_qty(sess, [location])
+            if aggregated:
+                return LocationService.get_location_report_aggregated(
+                    location, session=sess, limit=limit, offset=offset
+                )
+            return LocationService.get_location_report(location, session=sess)
+
+    def invalidate_reference_cache(self, org_id=None, kind=None):
+        """
+        Forget cached system location/product/order rows, e.g. after an
+        org's system rows were changed. `kind` is one of
+        'system_location', 'system_product' or 'system_order'.
+        """
+        self.ref_cache.invalidate(org_id=org_id, kind=kind)
+
+    def get_lp_qty(self, location_ids):
+        """`{location_id: lp_qty}`, including not yet compacted shards"""
+        with self.router.read_session() as sess:
+            if self.counters is not None:
+                return self.counters.lp_qtys(sess, location_ids)
+            return dict(sess.execute(
+                select(Location.id, Location.lp_qty)
+                .where(Location.id.in_(list(location_ids)))
+            ).all())
+
+    @writes
+    def compact_counters(self, kind=None):
+        """Fold striped counter shards back into their aggregate rows"""
+        if self.counters is None:
+            return 0
+        with self.db.writer_session() as sess:
+            folded = self.counters.compact(sess, kind=kind)
+            try:
+                sess.commit()
+            except SQLAlchemyError as e:
+                DBErrorHandler(e, session=sess)
+            return folded
+
+    @writes
+    def compact_aggregates(self, batch_size=5000):
+        """Fold one batch of journaled aggregate deltas"""
+        compactor = AggregateCompactor(
+            self.db.writer_session, batch_size=batch_size
+        )
+        return compactor.run_once()
+
+    def aggregate_lag(self):
+        """Seconds the deferred aggregates are behind (0 when caught up)"""
+        return AggregateCompactor(self.db.writer_session).lag_seconds()
+
+    @writes
+    def purge_idempotency_keys(self, max_age=datetime.timedelta(days=7)):
+        """Forget idempotency keys older than `max_age`"""
+        with self.db.writer_session() as sess:
+            purged = self.idempotency.purge(
+                sess, datetime.datetime.utcnow() - max_age
+            )
+            try:
+                sess.commit()
+            except SQLAlchemyError as e:
+                DBErrorHandler(e, session=sess)
+            self.idempotency.clear()
+            return purged
+
+    @writes
+    def rebuild_location_stats(self, location_id=None):
+        """Rebuild running dwell stats / average_duration from move history"""
+        with self.db.writer_session() as sess:
+            LocationService.rebuild_dwell_stats(sess, location_id=location_id)
+            try:
+                sess.commit()
+            except SQLAlchemyError as e:
+                DBErrorHandler(e, session=sess)
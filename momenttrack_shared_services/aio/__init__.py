@@ -0,0 +1,9 @@
+"""
+    asyncio counterpart of the service agent.
+
+    Needs the `async` extra (SQLAlchemy's asyncio support, an async
+    database driver such as asyncpg and `opensearch-py[async]`).
+"""
+from .agent import AsyncLicensePlateServiceAgent
+
+__all__ = ["AsyncLicensePlateServiceAgent"]
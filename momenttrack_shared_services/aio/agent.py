@@ -0,0 +1,339 @@
+import asyncio
+
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from momenttrack_shared_models import Location
+import momenttrack_shared_models.core.messages as MSG
+
+from momenttrack_shared_services.actions.move import Move
+from momenttrack_shared_services.actions.bulk_move import BulkMove
+from momenttrack_shared_services.actions.create import Create
+from momenttrack_shared_services.actions.bulk_create import BulkCreate
+from momenttrack_shared_services.actions.edit import _edit_record, edit_intents
+from momenttrack_shared_services.actions.comment import _comment
+from momenttrack_shared_services.ext.SQLSci import ENGINE_OPTION_KEYS
+from momenttrack_shared_services.utils import HttpError
+from momenttrack_shared_services.utils.activity import ActivityService
+from momenttrack_shared_services.utils.cache import ReferenceCache
+from momenttrack_shared_services.utils.counters import StripedCounters
+from momenttrack_shared_services.utils.idempotency import (
+    IdempotencyStore,
+    Replay,
+    MOVE,
+    CREATE
+)
+from momenttrack_shared_services.utils.location import LocationService
+from momenttrack_shared_services.utils.outbox import UPDATE_FIELDS_SCRIPT
+
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def async_url(url):
+    """`url` with its sync driver swapped for the asyncio one"""
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.drivername)
+    return url.set(drivername=driver) if driver else url
+
+
+class _ScopedTo:
+    """`scoped_session` look-alike that always hands out one session"""
+
+    def __init__(self, session):
+        self._session = session
+
+    def __call__(self):
+        return self._session
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    def remove(self):
+        pass
+
+
+class _BoundDatabase:
+    """
+    `db` look-alike whose sessions are all the sync facade of one
+    `AsyncSession`, so the sync actions can run inside `run_sync`
+    """
+
+    def __init__(self, session):
+        self.writer_session = self.session = _ScopedTo(session)
+
+
+class AsyncLicensePlateServiceAgent:
+    """asyncio counterpart of `LicensePlateServiceAgent`.
+
+    Each operation runs the same action classes (validation, aggregates,
+    outbox intents) through `AsyncSession.run_sync`. Their statements are
+    sent by the async driver, so the event loop is never blocked on
+    database I/O and many operations can be in flight at once. The
+    OpenSearch writes that follow an edit are awaited on `os_client` (an
+    `AsyncOpenSearch`); with `use_outbox` they go to the outbox instead.
+
+    The writer bind (`SQLALCHEMY_BINDS['writer']`, else
+    `SQLALCHEMY_DATABASE_URI`) is switched to its asyncio driver, e.g.
+    postgresql:// -> postgresql+asyncpg://.
+    """
+
+    def __init__(
+        self, db_config, os_client=None, use_outbox=False,
+        deferred_aggregates=False, engine=None
+    ):
+        self.os_client = os_client
+        self.use_outbox = use_outbox
+        self.deferred_aggregates = deferred_aggregates
+        self.db_config = db_config
+        self.pool_size = db_config.pop('SQLALCHEMY_DB_POOL_SIZE', 20)
+        self.ref_cache = ReferenceCache(
+            maxsize=db_config.pop('REFERENCE_CACHE_SIZE', 1024),
+            ttl=db_config.pop('REFERENCE_CACHE_TTL', 300)
+        )
+        self.idempotency = IdempotencyStore(
+            maxsize=db_config.pop('IDEMPOTENCY_CACHE_SIZE', 10000),
+            ttl=db_config.pop('IDEMPOTENCY_CACHE_TTL', 3600)
+        )
+        shards = db_config.pop('STRIPED_COUNTER_SHARDS', 0)
+        self.counters = StripedCounters(shards) if shards else None
+        if engine is None:
+            uri = db_config.get('SQLALCHEMY_BINDS', {}).get(
+                'writer', db_config.get('SQLALCHEMY_DATABASE_URI')
+            )
+            options = {
+                k: v for k, v in
+                db_config.get('SQLALCHEMY_ENGINE_OPTIONS', {}).items()
+                if k in ENGINE_OPTION_KEYS
+            }
+            options.setdefault('pool_size', self.pool_size)
+            engine = create_async_engine(async_url(uri), **options)
+        self.engine = engine
+        self.sessionmaker = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        await self.engine.dispose()
+
+    async def run(self, fn, *args, **kwargs):
+        """Run `fn(db, *args, **kwargs)` with a sync `db` on a new AsyncSession"""
+        async with self.sessionmaker() as sess:
+            return await sess.run_sync(
+                lambda sync_sess: fn(_BoundDatabase(sync_sess), *args, **kwargs)
+            )
+
+    def _action_options(self):
+        return {
+            "outbox": self.use_outbox,
+            "counters": self.counters,
+            "deferred_aggregates": self.deferred_aggregates,
+        }
+
+    async def move(
+        self, move_item_id,
+        dest_location_id, org_id,
+        headers, user_id,
+        loglocation=None,
+        idempotency_key=None
+    ):
+        def replay(db):
+            return self.idempotency.lookup(
+                db.session(), org_id, idempotency_key, MOVE
+            )
+
+        def work(db):
+            if idempotency_key is not None:
+                replayed = replay(db)
+                if replayed is not None:
+                    return replayed.result
+            return Move(
+                db, move_item_id, org_id, dest_location_id,
+                user_id, headers, None, loglocation,
+                ref_cache=self.ref_cache,
+                idempotency=self.idempotency,
+                idempotency_key=idempotency_key,
+                **self._action_options()
+            ).execute()
+
+        try:
+            lp_move = await self.run(work)
+        except (IntegrityError, HttpError):
+            # a concurrent copy of this request committed first: recording
+            # the key collided, or the item is already at the destination
+            replayed = idempotency_key and await self.run(replay)
+            if not replayed:
+                raise
+            return replayed.result
+        if idempotency_key is not None:
+            self.idempotency.remember(
+                org_id, idempotency_key,
+                Replay(MOVE, lp_move.get("id"), lp_move)
+            )
+        return lp_move
+
+    async def move_many(
+        self, items,
+        dest_location_id, org_id,
+        headers, user_id,
+        loglocation=None
+    ):
+        def work(db):
+            return BulkMove(
+                db, org_id, dest_location_id, user_id,
+                headers, None, loglocation, **self._action_options()
+            ).execute(items)
+        return await self.run(work)
+
+    async def create(
+        self,
+        lp, org_id,
+        user_id, headers,
+        production_order_id=None,
+        comment=None,
+        idempotency_key=None
+    ):
+        def replay(db):
+            return self.idempotency.created_license_plate(
+                db.session(), org_id, idempotency_key
+            )
+
+        def work(db):
+            if idempotency_key is not None:
+                existing = replay(db)
+                if existing is not None:
+                    return existing
+            return Create(
+                db, org_id, user_id, None, headers,
+                comment=comment, ref_cache=self.ref_cache,
+                idempotency=self.idempotency,
+                idempotency_key=idempotency_key,
+                **self._action_options()
+            ).execute(
+                license_plate=lp,
+                production_order_id=production_order_id
+            )
+
+        try:
+            lp = await self.run(work)
+        except IntegrityError:
+            existing = idempotency_key and await self.run(replay)
+            if existing is None:
+                raise
+            return existing
+        if idempotency_key is not None:
+            self.idempotency.remember(
+                org_id, idempotency_key, Replay(CREATE, lp.id)
+            )
+        return lp
+
+    async def create_many(
+        self,
+        license_plates, production_order_id,
+        org_id, user_id, headers,
+        comment=None,
+        chunk_size=500
+    ):
+        def work(db):
+            return BulkCreate(
+                db, org_id, user_id, None, headers,
+                comment=comment, chunk_size=chunk_size,
+                ref_cache=self.ref_cache, **self._action_options()
+            ).execute(
+                license_plates,
+                production_order_id=production_order_id
+            )
+        return await self.run(work)
+
+    async def comment(self, lp_id, message, org_id, user_id, headers):
+        return await self.run(
+            _comment, lp_id, message, org_id, user_id, headers,
+            None, outbox=self.use_outbox
+        )
+
+    async def edit(self, lp_obj, org_id):
+        def work(db):
+            resp, license_plate, line_item, lp_moves = _edit_record(
+                db, lp_obj, org_id, outbox=self.use_outbox
+            )
+            if self.use_outbox or self.os_client is None:
+                return resp, []
+            return resp, edit_intents(license_plate, line_item, lp_moves)
+
+        resp, intents = await self.run(work)
+        if intents:
+            await self.send_intents(intents)
+        return resp
+
+    async def send_intents(self, intents):
+        """Apply `edit_intents`-style OpenSearch writes concurrently"""
+        calls = []
+        for op, index, key, payload in intents:
+            if op == "update":
+                calls.append(self.os_client.update(
+                    index=index, id=key, body={"doc": payload}
+                ))
+            else:
+                calls.append(self.os_client.update_by_query(
+                    index=index,
+                    body={
+                        "query": {"match": {"license_plate_id": key}},
+                        "script": {
+                            "source": UPDATE_FIELDS_SCRIPT,
+                            "lang": "painless",
+                            "params": {"updates": payload},
+                        },
+                    },
+                    conflicts="proceed"
+                ))
+        return await asyncio.gather(*calls)
+
+    async def get_logs(
+        self, model_name, model_id, org_id,
+        user_id=None, headers=None,
+        limit=None, offset=0
+    ):
+        def work(db):
+            activity_service = ActivityService(
+                db, None, org_id, user_id, headers or {}
+            )
+            return activity_service.get_logs(
+                model_name, model_id,
+                limit=limit, offset=offset, session=db.session()
+            )
+        return await self.run(work)
+
+    async def get_location_report(
+        self, location_id, org_id,
+        aggregated=True, limit=50, offset=0
+    ):
+        def work(db):
+            sess = db.session()
+            location = sess.scalar(
+                select(Location).where(
+                    Location.id == location_id,
+                    Location.organization_id == org_id
+                )
+            )
+            if location is None:
+                raise HttpError(code=404, message=MSG.LOCATION_NOT_FOUND)
+            if self.counters is not None:
+                self.counters.load_lp_qty(sess, [location])
+            if aggregated:
+                return LocationService.get_location_report_aggregated(
+                    location, session=sess, limit=limit, offset=offset
+                )
+            return LocationService.get_location_report(location, session=sess)
+        return await self.run(work)
+
+    def invalidate_reference_cache(self, org_id=None, kind=None):
+        self.ref_cache.invalidate(org_id=org_id, kind=kind)
@@ -1,26 +1,121 @@
+import threading
 from typing import Dict
 
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+
+ENGINE_OPTION_KEYS = (
+    'pool_size', 'max_overflow', 'pool_recycle',
+    'pool_pre_ping', 'pool_timeout', 'echo', 'connect_args',
+)
 
 
 class SQLSci:
+    """Engine registry: one engine (and pool) per bind.
+
+    Engines are created lazily on first use and reused afterwards, and
+    each bind gets one cached `scoped_session`. Options come from the
+    keyword arguments (defaults for every bind), the
+    `SQLALCHEMY_ENGINE_OPTIONS` config key (same) and
+    `SQLALCHEMY_BIND_OPTIONS` (per bind name). Besides the regular
+    `create_engine` pool options, `statement_timeout` (ms) is supported
+    for PostgreSQL binds; it's merged into any `connect_args` given. The
+    default URI is bind `None`.
+    """
     __options: Dict
-    __default_uri: Dict
+    __default_uri: str
+
+    def __init__(self, db_config, **engine_options):
+        self.__options = db_config.get('SQLALCHEMY_BINDS', {})
+        self.__default_uri = db_config.get('SQLALCHEMY_DATABASE_URI')
+        self.__engine_options = {
+            **engine_options,
+            **db_config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        }
+        self.__bind_options = db_config.get('SQLALCHEMY_BIND_OPTIONS', {})
+        self.__engines = {}
+        self.__sessions = {}
+        self.__lock = threading.Lock()
+
+    def init_db(self, db_config=None, **engine_options):
+        """
+        Drop-in for `db.init_db(config, pool_size=...)`. Re-initialising
+        disposes the engines and sessions created so far.
+        """
+        if db_config is not None:
+            self.dispose()
+            self.__init__(db_config, **engine_options)
+        return self
 
-    def __init__(self, db_config):
-        self.binds = {}
-        self.__options = db_config['SQLALCHEMY_BINDS']
-        self.__default_uri = db_config['SQLALCHEMY_DATABASE_URI']
+    def engine_options(self, bind=None):
+        options = {
+            **self.__engine_options,
+            **self.__bind_options.get(bind, {})
+        }
+        kwargs = {k: v for k, v in options.items() if k in ENGINE_OPTION_KEYS}
+        timeout = options.get('statement_timeout')
+        if timeout:
+            connect_args = dict(kwargs.get('connect_args', {}))
+            server_options = connect_args.get('options')
+            connect_args['options'] = ' '.join(filter(None, [
+                server_options, f'-c statement_timeout={int(timeout)}'
+            ]))
+            kwargs['connect_args'] = connect_args
+        return kwargs
 
-        for key, val in self.__options.items():
-            self.binds[key] = create_engine(val)
+    def get_engine(self, bind=None):
+        engine = self.__engines.get(bind)
+        if engine is not None:
+            return engine
+        with self.__lock:
+            if bind not in self.__engines:
+                uri = self.__default_uri if bind is None else self.__options[bind]
+                self.__engines[bind] = create_engine(
+                    uri, **self.engine_options(bind)
+                )
+            return self.__engines[bind]
+
+    def get_session(self, bind=None):
+        """Cached `scoped_session` for `bind`"""
+        factory = self.__sessions.get(bind)
+        if factory is not None:
+            return factory
+        engine = self.get_engine(bind)
+        with self.__lock:
+            if bind not in self.__sessions:
+                self.__sessions[bind] = scoped_session(sessionmaker(engine))
+            return self.__sessions[bind]
+
+    @property
+    def binds(self):
+        return {key: self.get_engine(key) for key in self.__options}
 
     @property
     def writer_session(self):
-        return sessionmaker('writer')
+        return self.get_session('writer')
 
     @property
     def session(self):
-        engine = create_engine(self.__default_uri)
-        return sessionmaker(engine)
+        return self.get_session()
+
+    def pool_status(self, bind=None):
+        """Checked in/out connection counts of a bind's pool"""
+        pool = self.get_engine(bind).pool
+        stats = {'status': pool.status()}
+        for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+            if hasattr(pool, name):
+                stats[name] = getattr(pool, name)()
+        return stats
+
+    def dispose(self, bind=None):
+        """Close pooled connections of one bind, or of every engine"""
+        with self.__lock:
+            keys = list(self.__engines) if bind is None else [bind]
+            for key in keys:
+                session = self.__sessions.pop(key, None)
+                if session is not None:
+                    session.remove()
+                engine = self.__engines.pop(key, None)
+                if engine is not None:
+                    engine.dispose()
@@ -22,6 +22,7 @@ LICENSE_PLATE_MOVE_NOT_PERMITTED_WITH_PUT = (
     "Operation not permitted, please use `move` operation to update the location"
 )
 LICENSE_PLATE_MOVE_NOT_PERMITTED_WITH_SAME_DESTINATION = "Operation not permitted, destination location of license plate can't be same as current location."
+MOVE_ITEM_DUPLICATED = "Operation not permitted, the same item appears more than once in this move."
 LICENSE_PLATE_MOVE_NOT_FOUND = "License Plate move trx not found"
 PICKTICKET_NOT_FOUND = "Pickticket not found"
 PRODUCTION_ORDER_NOT_FOUND = "Production Order not found"
@@ -0,0 +1,113 @@
+"""
+    Tables owned by this library (rather than by momenttrack_shared_models).
+
+    They live on their own `MetaData` so they can be created alongside the
+    shared schema with `create_tables(engine)` or by a migration.
+"""
+import datetime
+
+from sqlalchemy import (
+    MetaData,
+    Table,
+    Column,
+    Integer,
+    BigInteger,
+    String,
+    Text,
+    DateTime,
+)
+
+metadata = MetaData()
+
+# sqlite only autoincrements INTEGER PRIMARY KEY columns
+BIG_ID = BigInteger().with_variant(Integer, "sqlite")
+
+
+# running arrival stats used to maintain `location.average_duration`
+location_dwell_stats = Table(
+    "location_dwell_stats",
+    metadata,
+    Column("location_id", Integer, primary_key=True),
+    Column("move_count", BigInteger, nullable=False, default=0),
+    Column("first_arrival", DateTime),
+    Column("last_arrival", DateTime),
+)
+
+
+# OpenSearch write intents, recorded in the same transaction as the change
+# they describe and drained by `momenttrack_shared_services.worker`
+search_index_outbox = Table(
+    "search_index_outbox",
+    metadata,
+    Column("id", BIG_ID, primary_key=True, autoincrement=True),
+    Column("op", String(32), nullable=False),
+    Column("index", String(255), nullable=False),
+    Column("doc_id", String(255)),
+    Column("body", Text, nullable=False),
+    Column("attempts", Integer, nullable=False, default=0),
+    Column("last_error", Text),
+    Column("created_at", DateTime, default=datetime.datetime.utcnow),
+)
+
+
+# outbox intents that still failed after `OutboxWorker.max_attempts`
+search_index_outbox_dead_letter = Table(
+    "search_index_outbox_dead_letter",
+    metadata,
+    Column("id", BIG_ID, primary_key=True),
+    Column("op", String(32), nullable=False),
+    Column("index", String(255), nullable=False),
+    Column("doc_id", String(255)),
+    Column("body", Text, nullable=False),
+    Column("attempts", Integer, nullable=False, default=0),
+    Column("last_error", Text),
+    Column("created_at", DateTime),
+    Column("failed_at", DateTime, default=datetime.datetime.utcnow),
+)
+
+
+# write-sharded deltas for hot aggregate rows, see `utils.counters`
+counter_shard = Table(
+    "counter_shard",
+    metadata,
+    Column("kind", String(64), primary_key=True),
+    Column("key", String(255), primary_key=True),
+    Column("shard", Integer, primary_key=True),
+    Column("value", BigInteger, nullable=False, default=0),
+)
+
+
+# aggregate deltas appended by actions in deferred mode and folded into
+# the aggregate tables by `utils.journal.AggregateCompactor`
+aggregate_delta_journal = Table(
+    "aggregate_delta_journal",
+    metadata,
+    Column("id", BIG_ID, primary_key=True, autoincrement=True),
+    Column("kind", String(32), nullable=False),
+    Column("location_id", Integer),
+    Column("product_id", Integer),
+    Column("production_order_id", Integer),
+    Column("move_id", BigInteger),
+    Column("lp_key", String(255)),
+    Column("qty", Integer, nullable=False, default=0),
+    Column("payload", Text),
+    Column("created_at", DateTime, default=datetime.datetime.utcnow),
+)
+
+
+# results of move/create requests by idempotency key, see
+# `utils.idempotency`
+idempotency_key = Table(
+    "idempotency_key",
+    metadata,
+    Column("organization_id", Integer, primary_key=True),
+    Column("key", String(255), primary_key=True),
+    Column("operation", String(16), nullable=False),
+    Column("entity_id", BigInteger),
+    Column("result", Text),
+    Column("created_at", DateTime, default=datetime.datetime.utcnow),
+)
+
+
+def create_tables(engine):
+    metadata.create_all(engine)
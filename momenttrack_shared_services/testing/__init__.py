@@ -0,0 +1,6 @@
+"""
+    Test and benchmark helpers shipped with the package.
+"""
+from .opensearch import FakeOpenSearch, register_script
+
+__all__ = ["FakeOpenSearch", "register_script"]
@@ -0,0 +1,762 @@
+"""
+    In-memory stand-in for the OpenSearch client.
+
+    `FakeOpenSearch` implements the part of the `opensearchpy.OpenSearch`
+    API this package uses, so it can be passed to the agent as
+    `os_client`, to `OutboxWorker`, `TotalsCoalescer`, the
+    `UpdateByQuery` helpers and `UpdateTaskPoller`:
+
+    - index / create / get / exists / update / delete with `_seq_no` /
+      `_primary_term` optimistic concurrency (`if_seq_no`,
+      `if_primary_term`, `retry_on_conflict`)
+    - search / count with match, match_all, term(s), range, exists, ids
+      and bool queries, `from`/`size`/`sort`, and terms / composite /
+      sum / value_count aggregations
+    - update_by_query (also with `wait_for_completion=False` and
+      `tasks.get`) and bulk
+
+    Painless scripts aren't interpreted; the scripts this package sends
+    are recognised by their source and run as Python, see
+    `register_script` for adding others. Latency and failures can be
+    injected to exercise timeouts and retry paths:
+
+        client = FakeOpenSearch(latency=(0.002, 0.010), failure_rate=0.01)
+        client.fail_next("update", count=2)
+"""
+import copy
+import datetime
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+
+from opensearchpy.exceptions import (
+    ConflictError,
+    ConnectionError,
+    NotFoundError,
+    RequestError,
+)
+
+from momenttrack_shared_services.utils import INCREMENT_TOTAL_SCRIPT
+from momenttrack_shared_services.utils.outbox import UPDATE_FIELDS_SCRIPT
+
+
+def _normalize(source):
+    return re.sub(r"\s+", "", source or "")
+
+
+def _update_fields(source, params):
+    for key, value in params["updates"].items():
+        source[key] = copy.deepcopy(value)
+
+
+def _increment_total(source, params):
+    source["total_items"] = source.get("total_items", 0) + params["delta"]
+
+
+SCRIPTS = {
+    _normalize(UPDATE_FIELDS_SCRIPT): _update_fields,
+    _normalize(INCREMENT_TOTAL_SCRIPT): _increment_total,
+}
+
+# `ctx._source.field <op> params.name` statements, e.g.
+# "ctx._source.quantity += params.qty; ctx._source.left_at = params.at"
+_ASSIGNMENT = re.compile(
+    r"^ctx\._source(?:\.(\w+)|\['(\w+)'\])\s*(\+=|-=|=)\s*params\.(\w+)$"
+)
+
+
+def register_script(source, fn):
+    """Run `fn(doc_source, params)` for painless scripts equal to `source`"""
+    SCRIPTS[_normalize(source)] = fn
+
+
+def _run_script(script, source):
+    if isinstance(script, str):
+        script = {"source": script}
+    params = script.get("params", {})
+    fn = SCRIPTS.get(_normalize(script.get("source")))
+    if fn is not None:
+        fn(source, params)
+        return
+    statements = [
+        s.strip() for s in (script.get("source") or "").split(";")
+        if s.strip()
+    ]
+    parsed = [_ASSIGNMENT.match(s) for s in statements]
+    if not statements or not all(parsed):
+        raise RequestError(
+            400, "script_exception",
+            {"error": f"unsupported script: {script.get('source')}"}
+        )
+    for match in parsed:
+        field = match.group(1) or match.group(2)
+        op, value = match.group(3), params[match.group(4)]
+        if op == "=":
+            source[field] = copy.deepcopy(value)
+        elif op == "+=":
+            source[field] = source.get(field, 0) + value
+        else:
+            source[field] = source.get(field, 0) - value
+
+
+def _lookup(source, field):
+    """Values of a (dotted) field, flattened over lists.
+
+    `<field>.keyword` reads `<field>`: it's the sub-field dynamic mapping
+    adds to strings, holding the same value unanalysed.
+    """
+    if field.endswith(".keyword"):
+        field = field[:-len(".keyword")]
+    values = [source]
+    for part in field.split("."):
+        found = []
+        for value in values:
+            if isinstance(value, dict) and part in value:
+                item = value[part]
+                found.extend(item if isinstance(item, list) else [item])
+        values = found
+    return [v for v in values if v is not None]
+
+
+def _comparable(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def _text_matches(value, query):
+    if isinstance(value, str) and isinstance(query, str):
+        tokens = set(value.lower().split())
+        return all(t in tokens for t in query.lower().split())
+    return _comparable(value) == _comparable(query) or str(value) == str(query)
+
+
+def _field_query(body):
+    field, spec = next(iter(body.items()))
+    if isinstance(spec, dict):
+        spec = spec.get("query", spec.get("value", spec))
+    return field, spec
+
+
+def _matches(doc_id, source, query):
+    if not query or "match_all" in query:
+        return True
+    kind, body = next(iter(query.items()))
+    if kind == "bool":
+        def clauses(key):
+            value = body.get(key, [])
+            return value if isinstance(value, list) else [value]
+        if not all(_matches(doc_id, source, q) for q in clauses("must")):
+            return False
+        if not all(_matches(doc_id, source, q) for q in clauses("filter")):
+            return False
+        if any(_matches(doc_id, source, q) for q in clauses("must_not")):
+            return False
+        should = clauses("should")
+        if should and not body.get("must") and not body.get("filter"):
+            return any(_matches(doc_id, source, q) for q in should)
+        return True
+    if kind == "ids":
+        return doc_id in {str(v) for v in body["values"]}
+    if kind == "exists":
+        return bool(_lookup(source, body["field"]))
+    if kind in ("match", "match_phrase"):
+        field, value = _field_query(body)
+        return any(_text_matches(v, value) for v in _lookup(source, field))
+    if kind == "term":
+        field, value = _field_query(body)
+        return any(
+            _comparable(v) == _comparable(value)
+            for v in _lookup(source, field)
+        )
+    if kind == "terms":
+        field, values = next(iter(body.items()))
+        wanted = {str(_comparable(v)) for v in values}
+        return any(
+            str(_comparable(v)) in wanted for v in _lookup(source, field)
+        )
+    if kind == "range":
+        field, bounds = next(iter(body.items()))
+        checks = {
+            "gt": lambda a, b: a > b, "gte": lambda a, b: a >= b,
+            "lt": lambda a, b: a < b, "lte": lambda a, b: a <= b,
+        }
+        return any(
+            all(
+                checks[op](_comparable(v), _comparable(bound))
+                for op, bound in bounds.items() if op in checks
+            )
+            for v in _lookup(source, field)
+        )
+    raise RequestError(
+        400, "parsing_exception", {"error": f"unsupported query: {kind}"}
+    )
+
+
+def _bucket_key(source_spec, doc):
+    kind, spec = next(iter(source_spec.items()))
+    values = _lookup(doc, spec["field"])
+    if not values:
+        return None
+    value = values[0]
+    if kind == "date_histogram":
+        # day buckets only, which is what the reports use
+        value = str(_comparable(value))[:10]
+    return value
+
+
+def _aggregate(docs, aggs):
+    result = {}
+    for name, spec in (aggs or {}).items():
+        sub = spec.get("aggs") or spec.get("aggregations")
+        if "sum" in spec:
+            result[name] = {"value": float(sum(
+                v for d in docs for v in _lookup(d, spec["sum"]["field"])
+            ))}
+        elif "value_count" in spec:
+            result[name] = {"value": sum(
+                len(_lookup(d, spec["value_count"]["field"])) for d in docs
+            )}
+        elif "terms" in spec:
+            groups = {}
+            for doc in docs:
+                for value in _lookup(doc, spec["terms"]["field"]):
+                    groups.setdefault(value, []).append(doc)
+            ordered = sorted(groups.items(), key=lambda kv: -len(kv[1]))
+            buckets = []
+            for key, members in ordered[:spec["terms"].get("size", 10)]:
+                bucket = {"key": key, "doc_count": len(members)}
+                bucket.update(_aggregate(members, sub))
+                buckets.append(bucket)
+            result[name] = {"buckets": buckets}
+        elif "composite" in spec:
+            result[name] = _composite(docs, spec["composite"], sub)
+        else:
+            raise RequestError(
+                400, "parsing_exception",
+                {"error": f"unsupported aggregation: {list(spec)}"}
+            )
+    return result
+
+
+def _composite(docs, spec, sub):
+    sources = [next(iter(s.items())) for s in spec["sources"]]
+    groups = {}
+    for doc in docs:
+        key = tuple(_bucket_key(src, doc) for _, src in sources)
+        if None not in key:
+            groups.setdefault(key, []).append(doc)
+
+    def sort_key(key):
+        parts = []
+        for (_, src), value in zip(sources, key):
+            order = next(iter(src.values())).get("order", "asc")
+            parts.append(_Reverse(value) if order == "desc" else value)
+        return parts
+
+    keys = sorted(groups, key=sort_key)
+    after = spec.get("after")
+    if after:
+        after_key = sort_key(tuple(after[name] for name, _ in sources))
+        keys = [k for k in keys if sort_key(k) > after_key]
+    page = keys[:spec.get("size", 10)]
+    buckets = []
+    for key in page:
+        bucket = {
+            "key": {name: value for (name, _), value in zip(sources, key)},
+            "doc_count": len(groups[key]),
+        }
+        bucket.update(_aggregate(groups[key], sub))
+        buckets.append(bucket)
+    result = {"buckets": buckets}
+    if buckets:
+        result["after_key"] = buckets[-1]["key"]
+    return result
+
+
+class _Reverse:
+    """Sort wrapper inverting the order of a value"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return self.value > other.value
+
+    def __gt__(self, other):
+        return self.value < other.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+class _Doc:
+    __slots__ = ("source", "seq_no", "primary_term", "version")
+
+    def __init__(self, source, seq_no, primary_term=1, version=1):
+        self.source = source
+        self.seq_no = seq_no
+        self.primary_term = primary_term
+        self.version = version
+
+
+class _Namespace:
+    def __init__(self, client):
+        self.client = client
+        self.transport = None
+
+
+class IndicesClient(_Namespace):
+    def create(self, index, body=None, **params):
+        with self.client._lock:
+            if index in self.client.store:
+                raise RequestError(
+                    400, "resource_already_exists_exception", {"index": index}
+                )
+            self.client.store[index] = {}
+        return {"acknowledged": True, "index": index}
+
+    def exists(self, index, **params):
+        return index in self.client.store
+
+    def delete(self, index, **params):
+        with self.client._lock:
+            if self.client.store.pop(index, None) is None:
+                raise NotFoundError(
+                    404, "index_not_found_exception", {"index": index}
+                )
+        return {"acknowledged": True}
+
+    def refresh(self, index=None, **params):
+        return {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+
+
+class TasksClient(_Namespace):
+    def get(self, task_id=None, **params):
+        self.client._call("tasks.get")
+        task = self.client.tasks_store.get(task_id)
+        if task is None:
+            raise NotFoundError(
+                404, "resource_not_found_exception", {"task": task_id}
+            )
+        return task
+
+
+class FakeOpenSearch:
+    """Thread-safe in-memory OpenSearch client, see the module docstring.
+
+    `latency` is seconds per request, or a `(min, max)` range.
+    `failure_rate` is the probability that a request fails with a
+    `ConnectionError`. `conflict_rate` is the probability that an update
+    attempt hits a version conflict, so `retry_on_conflict` and
+    client-side retries can be exercised. `calls` counts requests per
+    operation.
+    """
+
+    def __init__(
+        self, latency=0.0, failure_rate=0.0, conflict_rate=0.0, seed=None
+    ):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.conflict_rate = conflict_rate
+        self.rng = random.Random(seed)
+        self.store = {}
+        self.tasks_store = {}
+        self.calls = Counter()
+        self.primary_term = 1
+        self.transport = None
+        self.indices = IndicesClient(self)
+        self.tasks = TasksClient(self)
+        self._seq_no = itertools.count()
+        self._task_ids = itertools.count(1)
+        self._fail_next = Counter()
+        self._lock = threading.RLock()
+
+    # failure / latency injection
+
+    def fail_next(self, operation, count=1):
+        """Make the next `count` `operation` requests fail"""
+        with self._lock:
+            self._fail_next[operation] += count
+
+    def _call(self, operation):
+        self.calls[operation] += 1
+        latency = self.latency
+        if isinstance(latency, (tuple, list)):
+            latency = self.rng.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+        with self._lock:
+            forced = self._fail_next[operation] > 0
+            if forced:
+                self._fail_next[operation] -= 1
+        if forced or (self.failure_rate and self.rng.random() < self.failure_rate):
+            raise ConnectionError(
+                "N/A", f"injected failure ({operation})", None
+            )
+
+    def _conflicts(self):
+        return bool(self.conflict_rate) and self.rng.random() < self.conflict_rate
+
+    # documents
+
+    def _index(self, index):
+        return self.store.setdefault(index, {})
+
+    def _meta(self, index, doc_id, doc, result):
+        return {
+            "_index": index,
+            "_id": doc_id,
+            "_version": doc.version,
+            "result": result,
+            "_seq_no": doc.seq_no,
+            "_primary_term": doc.primary_term,
+            "_shards": {"total": 1, "successful": 1, "failed": 0},
+        }
+
+    def _check_seq_no(self, index, doc_id, doc, if_seq_no, if_primary_term):
+        if if_seq_no is None and if_primary_term is None:
+            return
+        if (
+            doc is None
+            or (if_seq_no is not None and doc.seq_no != int(if_seq_no))
+            or (
+                if_primary_term is not None
+                and doc.primary_term != int(if_primary_term)
+            )
+        ):
+            raise ConflictError(
+                409, "version_conflict_engine_exception",
+                {"index": index, "id": doc_id}
+            )
+
+    def _put(self, index, doc_id, source, op_type="index",
+             if_seq_no=None, if_primary_term=None):
+        docs = self._index(index)
+        doc_id = str(doc_id) if doc_id is not None else (
+            f"fake-{next(self._seq_no)}"
+        )
+        existing = docs.get(doc_id)
+        if op_type == "create" and existing is not None:
+            raise ConflictError(
+                409, "version_conflict_engine_exception",
+                {"index": index, "id": doc_id}
+            )
+        self._check_seq_no(index, doc_id, existing, if_seq_no, if_primary_term)
+        doc = _Doc(
+            json.loads(json.dumps(source, default=str)),
+            next(self._seq_no),
+            self.primary_term,
+            existing.version + 1 if existing else 1
+        )
+        docs[doc_id] = doc
+        return self._meta(
+            index, doc_id, doc, "updated" if existing else "created"
+        )
+
+    def index(self, index, body, id=None, if_seq_no=None,
+              if_primary_term=None, op_type=None, **params):
+        self._call("index")
+        with self._lock:
+            return self._put(
+                index, id, body, op_type or "index",
+                if_seq_no, if_primary_term
+            )
+
+    def create(self, index, id, body, **params):
+        self._call("create")
+        with self._lock:
+            return self._put(index, id, body, "create")
+
+    def get(self, index, id, **params):
+        self._call("get")
+        with self._lock:
+            doc = self.store.get(index, {}).get(str(id))
+            if doc is None:
+                raise NotFoundError(
+                    404, "not_found",
+                    {"_index": index, "_id": str(id), "found": False}
+                )
+            return {
+                "_index": index,
+                "_id": str(id),
+                "_version": doc.version,
+                "_seq_no": doc.seq_no,
+                "_primary_term": doc.primary_term,
+                "found": True,
+                "_source": copy.deepcopy(doc.source),
+            }
+
+    def exists(self, index, id, **params):
+        self._call("exists")
+        with self._lock:
+            return str(id) in self.store.get(index, {})
+
+    def _apply_update(self, index, doc_id, body, if_seq_no=None,
+                      if_primary_term=None, retry_on_conflict=0):
+        doc_id = str(doc_id)
+        for _ in range(int(retry_on_conflict or 0) + 1):
+            if not self._conflicts():
+                break
+        else:
+            raise ConflictError(
+                409, "version_conflict_engine_exception",
+                {"index": index, "id": doc_id}
+            )
+
+        docs = self._index(index)
+        existing = docs.get(doc_id)
+        self._check_seq_no(index, doc_id, existing, if_seq_no, if_primary_term)
+        if existing is None:
+            if "upsert" in body:
+                source = copy.deepcopy(body["upsert"])
+            elif body.get("doc_as_upsert") and "doc" in body:
+                source = copy.deepcopy(body["doc"])
+            else:
+                raise NotFoundError(
+                    404, "document_missing_exception",
+                    {"_index": index, "_id": doc_id}
+                )
+            return self._put(index, doc_id, source)
+
+        source = copy.deepcopy(existing.source)
+        if "script" in body:
+            _run_script(body["script"], source)
+        elif "doc" in body:
+            source.update(json.loads(json.dumps(body["doc"], default=str)))
+        if source == existing.source:
+            return self._meta(index, doc_id, existing, "noop")
+        return self._put(index, doc_id, source)
+
+    def update(self, index, id, body, if_seq_no=None, if_primary_term=None,
+               retry_on_conflict=0, **params):
+        self._call("update")
+        with self._lock:
+            return self._apply_update(
+                index, id, body, if_seq_no, if_primary_term,
+                retry_on_conflict
+            )
+
+    def delete(self, index, id, **params):
+        self._call("delete")
+        with self._lock:
+            doc = self.store.get(index, {}).pop(str(id), None)
+            if doc is None:
+                raise NotFoundError(
+                    404, "not_found", {"_index": index, "_id": str(id)}
+                )
+            doc.version += 1
+            return self._meta(index, str(id), doc, "deleted")
+
+    # search
+
+    def _find(self, index, query):
+        indices = index.split(",") if isinstance(index, str) else (
+            index or list(self.store)
+        )
+        hits = []
+        for name in indices:
+            for doc_id, doc in self.store.get(name, {}).items():
+                if _matches(doc_id, doc.source, query):
+                    hits.append((name, doc_id, doc))
+        return hits
+
+    def search(self, index=None, body=None, **params):
+        self._call("search")
+        body = body or {}
+        started = time.perf_counter()
+        with self._lock:
+            hits = self._find(index, body.get("query"))
+            sources = [copy.deepcopy(doc.source) for _, _, doc in hits]
+        for sort in reversed(body.get("sort", [])):
+            field, order = (sort, "asc") if isinstance(sort, str) else (
+                next(iter(sort.items()))
+            )
+            if isinstance(order, dict):
+                order = order.get("order", "asc")
+            pairs = sorted(
+                zip(hits, sources),
+                key=lambda pair: [
+                    str(_comparable(v)) for v in _lookup(pair[1], field)
+                ],
+                reverse=order == "desc"
+            )
+            hits, sources = [p[0] for p in pairs], [p[1] for p in pairs]
+
+        start = int(body.get("from", params.get("from_", 0)))
+        size = int(body.get("size", params.get("size", 10)))
+        resp = {
+            "took": int((time.perf_counter() - started) * 1000),
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "failed": 0},
+            "hits": {
+                "total": {"value": len(hits), "relation": "eq"},
+                "max_score": 1.0 if hits else None,
+                "hits": [
+                    {
+                        "_index": name,
+                        "_id": doc_id,
+                        "_score": 1.0,
+                        "_seq_no": doc.seq_no,
+                        "_primary_term": doc.primary_term,
+                        "_source": source,
+                    }
+                    for (name, doc_id, doc), source in zip(
+                        hits[start:start + size], sources[start:start + size]
+                    )
+                ],
+            },
+        }
+        aggs = body.get("aggs") or body.get("aggregations")
+        if aggs:
+            resp["aggregations"] = _aggregate(sources, aggs)
+        return resp
+
+    def count(self, index=None, body=None, **params):
+        self._call("count")
+        with self._lock:
+            return {"count": len(self._find(index, (body or {}).get("query")))}
+
+    def update_by_query(self, index, body=None, conflicts=None,
+                        wait_for_completion=True, **params):
+        self._call("update_by_query")
+        body = body or {}
+        started = time.perf_counter()
+        updated, noops, version_conflicts, failures = 0, 0, 0, []
+        with self._lock:
+            for name, doc_id, doc in self._find(index, body.get("query")):
+                if self._conflicts():
+                    version_conflicts += 1
+                    if conflicts != "proceed":
+                        failures.append({
+                            "index": name, "id": doc_id, "status": 409,
+                            "cause": {
+                                "type": "version_conflict_engine_exception"
+                            },
+                        })
+                        break
+                    continue
+                source = copy.deepcopy(doc.source)
+                if "script" in body:
+                    _run_script(body["script"], source)
+                if source == doc.source:
+                    noops += 1
+                    continue
+                self._put(name, doc_id, source)
+                updated += 1
+        resp = {
+            "took": int((time.perf_counter() - started) * 1000),
+            "timed_out": False,
+            "total": updated + noops + version_conflicts,
+            "updated": updated,
+            "deleted": 0,
+            "batches": 1,
+            "version_conflicts": version_conflicts,
+            "noops": noops,
+            "retries": {"bulk": 0, "search": 0},
+            "failures": failures,
+        }
+        if wait_for_completion in (False, "false"):
+            task_id = f"fake:{next(self._task_ids)}"
+            self.tasks_store[task_id] = {
+                "completed": True,
+                "task": {"id": task_id, "action": "indices:data/write/update/byquery"},
+                "response": resp,
+            }
+            return {"task": task_id}
+        return resp
+
+    # bulk
+
+    @staticmethod
+    def _bulk_lines(body):
+        if isinstance(body, (str, bytes)):
+            if isinstance(body, bytes):
+                body = body.decode()
+            return [json.loads(line) for line in body.splitlines() if line.strip()]
+        return list(body)
+
+    def bulk(self, body, index=None, **params):
+        self._call("bulk")
+        started = time.perf_counter()
+        lines = self._bulk_lines(body)
+        items = []
+        position = 0
+        with self._lock:
+            while position < len(lines):
+                action = lines[position]
+                op, meta = next(iter(action.items()))
+                position += 1
+                source = None
+                if op != "delete":
+                    source = lines[position]
+                    position += 1
+                items.append({op: self._bulk_item(op, meta, source, index)})
+        return {
+            "took": int((time.perf_counter() - started) * 1000),
+            "errors": any("error" in next(iter(i.values())) for i in items),
+            "items": items,
+        }
+
+    def _bulk_item(self, op, meta, source, default_index):
+        index = meta.get("_index", default_index)
+        doc_id = meta.get("_id")
+        try:
+            if op in ("index", "create"):
+                resp = self._put(
+                    index, doc_id, source, op,
+                    meta.get("if_seq_no"), meta.get("if_primary_term")
+                )
+                status = 201 if resp["result"] == "created" else 200
+            elif op == "update":
+                resp = self._apply_update(
+                    index, doc_id, source,
+                    meta.get("if_seq_no"), meta.get("if_primary_term"),
+                    meta.get("retry_on_conflict", 0)
+                )
+                status = 201 if resp["result"] == "created" else 200
+            elif op == "delete":
+                doc = self.store.get(index, {}).pop(str(doc_id), None)
+                if doc is None:
+                    return {
+                        "_index": index, "_id": str(doc_id),
+                        "result": "not_found", "status": 404,
+                    }
+                resp = self._meta(index, str(doc_id), doc, "deleted")
+                status = 200
+            else:
+                raise RequestError(
+                    400, "illegal_argument_exception",
+                    {"error": f"unknown bulk action {op}"}
+                )
+        except (ConflictError, NotFoundError, RequestError) as e:
+            return {
+                "_index": index,
+                "_id": doc_id,
+                "status": e.status_code,
+                "error": {"type": e.error, "reason": str(e.info)},
+            }
+        resp.pop("_shards", None)
+        resp["status"] = status
+        return resp
+
+    # helpers
+
+    def documents(self, index):
+        """`{id: source}` of an index, for assertions"""
+        with self._lock:
+            return {
+                doc_id: copy.deepcopy(doc.source)
+                for doc_id, doc in self.store.get(index, {}).items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self.store.clear()
+            self.tasks_store.clear()
+            self.calls.clear()
+            self._fail_next.clear()
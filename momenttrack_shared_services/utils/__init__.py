@@ -1,11 +1,6 @@
 import datetime
-from dictdiffer import (
-    diff, revert
-)
-import statistics
 import re
 import os
-import requests
 
 from momenttrack_shared_models import (
     LicensePlateMove,
@@ -13,17 +8,7 @@ from momenttrack_shared_models import (
     User,
     Location
 )
-from momenttrack_shared_models.core.schemas import \
-    LicensePlateMoveLogsSchema
 from momenttrack_shared_models.core.extensions import db
-from opensearchpy import (
-    OpenSearch,
-    RequestsHttpConnection
-)
-from opensearchpy.exceptions import (
-    ConflictError,
-    NotFoundError
-)
 from sqlalchemy.exc import IntegrityError
 from loguru import logger
 
@@ -122,10 +107,17 @@ def validate_foreignkey_violation(e):
     return None
 
 
-def DBErrorHandler(e):
-    """handle certain db related exceptions"""
-    db.session.rollback()
-    db.writer_session.rollback()
+def DBErrorHandler(e, session=None):
+    """handle certain db related exceptions
+
+    Rolls back `session` when given (e.g. an AsyncSession's sync facade
+    inside `run_sync`), else the global reader and writer sessions.
+    """
+    if session is not None:
+        session.rollback()
+    else:
+        db.session.rollback()
+        db.writer_session.rollback()
 
     # 1. Check if error is due to unique constraint violation
     uniq_error_cols = validate_unique_violation(e)
@@ -176,6 +168,8 @@ def get_diff(obj1, obj2, ignore_keys=None):
         obj2 (Any): Object 2 (new object)
         ignore_keys (List): List of keys that needs to be ignored during diff calculation
     """
+    from dictdiffer import diff
+
     return list(diff(obj1, obj2, ignore=ignore_keys))
 
 
@@ -186,11 +180,51 @@ def revert_diff(diff, obj2):
         diff (list): Diff sequence
         obj2 (Any): New object
     """
+    from dictdiffer import revert
+
     return revert(diff, obj2)
 
 
-def gen_pre_report(report, location_id):
+def mean_gap_seconds(first, last, count):
+    """
+    Mean of the gaps between `count` consecutive timestamps.
+
+    The sum of consecutive differences telescopes to (last - first), so
+    only the endpoints are needed.
+    """
+    if count < 2:
+        return None
+    return (last - first).total_seconds() / (count - 1)
+
+
+def gap_percentiles(timestamps, percentiles=(50, 90)):
+    """
+    Percentiles (in seconds) of the gaps between consecutive timestamps,
+    vectorized with NumPy. Accepts datetimes or ISO formatted strings.
+    Requires the optional `numpy` dependency.
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        raise ImportError(
+            "gap percentiles require numpy, install "
+            "momenttrack_shared_services[stats]"
+        )
+
+    ts = np.sort(np.asarray(timestamps, dtype="datetime64[us]"))
+    gaps = np.diff(ts).astype(np.int64) / 1e6
+    if gaps.size == 0:
+        return {f"p{p}": None for p in percentiles}
+    values = np.percentile(gaps, percentiles)
+    return {f"p{p}": float(v) for p, v in zip(percentiles, values)}
+
+
+def gen_pre_report(report, location_id, percentiles=None):
     from datetime import datetime as dt
+    from momenttrack_shared_models.core.schemas import (
+        LicensePlateSchema,
+        UserSchema
+    )
 
     loc = Location.query.get(location_id)
 
@@ -204,21 +238,23 @@ def gen_pre_report(report, location_id):
         report["oldest_log"] = report["logs"][-1]
         report["latest_log"] = report["logs"][0]
 
-        # average_duration
-        dates = [lpm["arrived_at"] for lpm in report["logs"]]
-        diffs = [
-            (
-                dt.strptime(t2, "%Y-%m-%d %H:%M:%S.%f")
-                - dt.strptime(t1, "%Y-%m-%d %H:%M:%S.%f")
-            ).total_seconds()
-            for t1, t2 in zip(dates[:-1], dates[1:])
-        ]
-        if len(diffs) > 0:
+        # average_duration, from the first & last log only
+        logs = report["logs"]
+        mean_gap = mean_gap_seconds(
+            dt.strptime(logs[0]["arrived_at"], "%Y-%m-%d %H:%M:%S.%f"),
+            dt.strptime(logs[-1]["arrived_at"], "%Y-%m-%d %H:%M:%S.%f"),
+            len(logs)
+        )
+        if mean_gap is not None:
             report["average_duration"] = datetime.timedelta(
-                seconds=statistics.mean(diffs)
+                seconds=mean_gap
             ).seconds
         else:
             report["average_duration"] = 0
+        if percentiles:
+            report["duration_percentiles"] = gap_percentiles(
+                [lpm["arrived_at"] for lpm in logs], percentiles
+            )
     else:
         report["oldest_license_plate"] = None
         report["current_user"] = None
@@ -234,36 +270,76 @@ def gen_pre_report(report, location_id):
     return report
 
 
-def append_line_graph_data(data, client):
-    log_count = len(data["logs"])
-    mset = set()
-    line_graph_map = {}
-    query = {
-        "query": {"match": {"location_id": data["location_id"]}},
-        "sort": {"date": {"order": "desc"}},
-        "size": 10000,
+# keyword sub-field created by the dynamic mapping of `line_graph_data`
+LINE_GRAPH_PART_FIELD = "part_number.keyword"
+LINE_GRAPH_PAGE_SIZE = 1000
+
+
+def line_graph_series(client, location_id, page_size=LINE_GRAPH_PAGE_SIZE):
+    """
+    Daily quantities per part number for a location, grouped by OpenSearch.
+
+    Uses a composite aggregation (part number x day) paged with
+    `after_key`, so nothing is truncated and Python only merges buckets
+    in a single pass. Returns `{part_number: [{"date", "quantity"}, ...]}`
+    with the most recent day first, parts ordered by their latest day.
+    """
+    series = {}
+    latest = {}
+    after_key = None
+    while True:
+        composite = {
+            "size": page_size,
+            "sources": [
+                {"part": {"terms": {"field": LINE_GRAPH_PART_FIELD}}},
+                {
+                    "day": {
+                        "date_histogram": {
+                            "field": "date",
+                            "calendar_interval": "1d",
+                            "format": "yyyy-MM-dd",
+                            "order": "desc",
+                        }
+                    }
+                },
+            ],
+        }
+        if after_key:
+            composite["after"] = after_key
+        query = {
+            "size": 0,
+            "query": {"match": {"location_id": location_id}},
+            "aggs": {
+                "series": {
+                    "composite": composite,
+                    "aggs": {"quantity": {"sum": {"field": "quantity"}}},
+                }
+            },
+        }
+        res = client.search(index="line_graph_data", body=query)
+        agg = res["aggregations"]["series"]
+        for bucket in agg["buckets"]:
+            part_no = bucket["key"]["part"]
+            day = bucket["key"]["day"]
+            series.setdefault(part_no, []).append(
+                {"date": day, "quantity": int(bucket["quantity"]["value"])}
+            )
+            latest.setdefault(part_no, day)
+        after_key = agg.get("after_key")
+        if not after_key or len(agg["buckets"]) < page_size:
+            break
+
+    return {
+        part_no: series[part_no]
+        for part_no in sorted(series, key=latest.get, reverse=True)
     }
-    res = client.search(index="line_graph_data", body=query)
-    line_graph_data = [
-        {"_id": hit["_id"], **hit["_source"]} for hit in res["hits"]["hits"]
+
+
+def append_line_graph_data(data, client):
+    line_graph_map = line_graph_series(client, data["location_id"])
+    line_graph_map = [
+        {"name": k, "values": line_graph_map[k]} for k in line_graph_map
     ]
-    # Create a search request
-
-    for line_item in line_graph_data:
-        _part_no = line_item["part_number"]
-        if _part_no not in mset:
-            others = [
-                {"date": x["date_key"], "quantity": x["quantity"]}
-                for x in line_graph_data
-                if x["part_number"] == _part_no and x["_id"] != line_item["_id"]
-            ]
-            line_graph_map[_part_no] = [
-                {"date": line_item["date_key"], "quantity": line_item["quantity"]},
-                *others,
-            ]
-            mset.add(_part_no)
-
-    line_graph_map = [{"name": k, "values": line_graph_map[k]} for k in line_graph_map]
 
     # formatting the report
     if "oldest_log" in data and "latest_log" in data:
@@ -293,10 +369,15 @@ def append_line_graph_data(data, client):
 
 
 def create_or_update_doc(client, obj, schema, data, index, type=None):
+    from opensearchpy.exceptions import NotFoundError
+
     try:
         ans = client.update(index=index, body=data, id=obj.id)
     except NotFoundError:
         if type == "location":
+            from momenttrack_shared_models.core.schemas import \
+                LicensePlateMoveLogsSchema
+
             lpmoves = LicensePlateMoveLogsSchema(many=True).dump(
                 LicensePlateMove.query.filter_by(dest_location_id=obj.id).all()
             )
@@ -309,101 +390,54 @@ def create_or_update_doc(client, obj, schema, data, index, type=None):
     return ans
 
 
-def update_prd_order_totals(client, loc_id, order_id, deduct=False, loc=None):
-    # find production_order_total obj and update
-    from opensearchpy.exceptions import NotFoundError
-    from opensearchpy import OpenSearch
-    import time
-
-    client: OpenSearch = client
-
-    def update_with_retry(
-            doc_id,
-            index,
-            initial_backoff=1.25,
-            max_retries=30
-        ):
-        """
-        Attempt at thread-safe approach to updating line-items totals.
-        Uses 'backoff retry' policy following a optimistic concurrency control
-        pattern, to allow worker processes retry updates if the document has
-        already been updated by another process since it last fetched the
-        document. Rather than blindly updating the document.
-        """
-        backoff = initial_backoff
-        attempt = 0
-        while True:
-            try:
-                doc = client.get(index=index, id=doc_id)
-                if deduct:
-                    update = {
-                        "total_items": int(doc['_source']["total_items"]) - 1
-                    }
-                else:
-                    update = {
-                        "total_items": int(doc['_source']["total_items"]) + 1
-                    }
-                client.update(
-                    index=index,
-                    id=doc_id,
-                    body={'doc': update},
-                    if_seq_no=doc["_seq_no"],
-                    if_primary_term=doc["_primary_term"]
-                )
-                logger.info(f"update happened on the {attempt+1} attempt")
-                return 0
-            except Exception as e:
-                attempt += 1
-                logger.error(f"Update failed (attempt {attempt + 1}): {e}")
-                time.sleep(backoff)  # Wait before retrying
-                backoff = min(backoff * 2, 30)  # backoff delay <= 30s
-                print(backoff)
-                if max_retries and attempt >= max_retries:
-                    logger.error("Max retries reached. Giving up.")
-                    raise Exception("Max retries reached. Giving up.")
+PRD_ORDER_TOTALS_INDEX = "production_order_lineitems_totals_alias"
+INCREMENT_TOTAL_SCRIPT = "ctx._source.total_items += params.delta"
 
-    try:
-        """
-        !! DISCLAIMER 🔽🔽
-        Done this way to prevent race-condition issues
-        with multiple worker processes trying to index the
-        same document at the same time.
-
-        NOTE: The `Opensearch.create()` method is used to ensure
-        that the lineitems_total document is created exactly once
-        if it doesn't already exist by any one worker process.
-
-        This `create()` method raises a conflictError if the 
-        document already exists (unlike the index() 
-        method which would just reindex it anyways). We can latch
-        onto that error to take other actions, which in the 
-        case below is to perform an update rather 
-        than a re-index which is what would happen if 
-        we did a lookup->then `index()` approach.
-        """
-        new_sum = {
+
+def prd_order_totals_update(loc_id, order_id, delta, loc):
+    """
+    Body of a scripted upsert that adds `delta` to a production order
+    totals document, creating it when it doesn't exist yet.
+    """
+    return {
+        "script": {
+            "source": INCREMENT_TOTAL_SCRIPT,
+            "lang": "painless",
+            "params": {"delta": delta},
+        },
+        "upsert": {
             "name": loc["name"],
-            "total_items": 1,
+            "total_items": max(delta, 0),
             "production_order_id": order_id,
             "location_id": loc_id,
             "organization_id": loc["organization_id"],
             "created_at": datetime.datetime.utcnow().
             strftime("%Y-%m-%d %H:%M:%S.%f")
-        }
-        client.create(
-            index="production_order_lineitems_totals_alias",
-            body=new_sum,
-            id=f"{order_id}_{loc_id}",
-        )
-    except ConflictError:
-        res = client.get(
-            index="production_order_lineitems_totals_alias",
-            id=f"{order_id}_{loc_id}"
-        )
-        update_with_retry(
-            f"{order_id}_{loc_id}",
-            "production_order_lineitems_totals_alias"
-        )
+        },
+    }
+
+
+def update_prd_order_totals(
+    client, loc_id, order_id, deduct=False, loc=None, delta=None
+):
+    """
+    Add +1 (or -1 with `deduct`, or any `delta`) to the
+    `{order_id}_{loc_id}` totals document.
+
+    The increment runs as a painless script on the shard, and a missing
+    document is created through `upsert`. So there is no
+    get/compare/update cycle and no client-side backoff. Concurrent
+    increments from other workers are retried by OpenSearch itself
+    (`retry_on_conflict`).
+    """
+    if delta is None:
+        delta = -1 if deduct else 1
+    return client.update(
+        index=PRD_ORDER_TOTALS_INDEX,
+        id=f"{order_id}_{loc_id}",
+        body=prd_order_totals_update(loc_id, order_id, delta, loc),
+        retry_on_conflict=5,
+    )
 
 
 def update_line_items(client, lp_id, obj):
@@ -436,6 +470,8 @@ def update_line_items(client, lp_id, obj):
             retry -= 1
             obj = r.to_dict()
     if retry == 0:
+        import requests
+
         requests.patch(
             "https://mt-sandbox.firebaseio.com/error_log1.json",
             json={os.urandom(4).hex(): obj})
@@ -474,6 +510,8 @@ def update_lp_moves(client, lp_id, obj):
             retry -= 1
             obj = r.to_dict()
     if retry == 0:
+        import requests
+
         requests.patch(
             "https://mt-sandbox.firebaseio.com/error_log1.json",
             json={os.urandom(4).hex(): obj})
@@ -481,6 +519,8 @@ def update_lp_moves(client, lp_id, obj):
 
 
 def setup_opensearch():
+    from opensearchpy import OpenSearch, RequestsHttpConnection
+
     auth_h = (os.getenv("OPENSEARCH_USER"), os.getenv("OPENSEARCH_PASS"))
     client = OpenSearch(
         hosts=[{"host": os.getenv("OPENSEARCH_HOST"), "port": 443}],
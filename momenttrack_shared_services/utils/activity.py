@@ -8,12 +8,21 @@ from momenttrack_shared_models import (
     User,
     UserStatusEnum,
 )
+from sqlalchemy import select, true
 from momenttrack_shared_services.utils import (
     DataValidationError,
     DBErrorHandler
 )
 
 
+ACTIVITY_LABELS = {
+    ActivityTypeEnum.COMMENT: "NOTES",
+    ActivityTypeEnum.LICENSE_PLATE_MOVE: "LICENSE_PLATE_MOVE",
+    ActivityTypeEnum.LICENSE_PLATE_MADEIT: "LICENSE_PLATE_MADEIT",
+    ActivityTypeEnum.LICENSE_PLATE_DEDUCT: "LICENSE_PLATE_DEDUCT",
+}
+
+
 class ActivityService:
     def __init__(self, db, client, org_id, user_id, headers):
         self.org_id = org_id
@@ -22,96 +31,93 @@ class ActivityService:
         self.db = db
         self.client = client
 
-    def get_logs(self, model_name, model_id, **kwargs):
-        """Get logs by model id"""
-
-        activities = (
-            Activity.query.filter_by(organization_id=self.org_id)
-            .filter_by(model_name=model_name)
-            .filter_by(model_id=model_id)
-            .all()
+    def get_logs(
+        self, model_name, model_id,
+        limit=None, offset=0, session=None, **kwargs
+    ):
+        """Get logs by model id
+
+        Users, moves and destination locations are fetched in the same
+        query as the activities. Pass `limit`/`offset` to page through
+        long histories (ordered oldest first).
+
+        Moves are joined through a LATERAL subquery returning at most the
+        first move of each activity, so every activity is exactly one row
+        and `limit`/`offset` count activities.
+        """
+        is_move = Activity.activity_type == ActivityTypeEnum.LICENSE_PLATE_MOVE
+        first_move = (
+            select(
+                LicensePlateMove.id,
+                LicensePlateMove.dest_location_id
+            )
+            .where(
+                is_move,
+                LicensePlateMove.activity_id == Activity.id,
+                LicensePlateMove.organization_id == self.org_id,
+            )
+            .order_by(LicensePlateMove.id)
+            .limit(1)
+            .lateral()
+        )
+        entities = (Activity, User, first_move.c.id, Location)
+        if session is not None:
+            query = session.query(*entities)
+        else:
+            query = Activity.query.with_entities(*entities)
+        query = (
+            query
+            .outerjoin(User, User.id == Activity.user_id)
+            .outerjoin(first_move, true())
+            .outerjoin(Location, Location.id == first_move.c.dest_location_id)
+            .filter(Activity.organization_id == self.org_id)
+            .filter(Activity.model_name == model_name)
+            .filter(Activity.model_id == model_id)
+            .order_by(Activity.created_at, Activity.id)
         )
+        if offset:
+            query = query.offset(offset)
+        if limit is not None:
+            query = query.limit(limit)
+
         logs = []
-        for activity in activities:
-            user = User.query.get(activity.user_id)
-            if activity.activity_type == ActivityTypeEnum.COMMENT:
-                log = {
-                    "user": user,
-                    "message": activity.message,
-                    "activity": "NOTES",
-                    "created_at": activity.created_at,
-                    "meta": None,
-                }
-            elif activity.activity_type == ActivityTypeEnum.LICENSE_PLATE_MOVE:
-                lp_move = (
-                    LicensePlateMove.query.filter_by(organization_id=self.org_id)
-                    .filter_by(activity_id=activity.id)
-                    .first()
-                )
-                if lp_move:
-                    location = Location.get(lp_move.dest_location_id)
-                    log = {
-                        "user": user,
-                        "message": activity.message,
-                        "activity": "LICENSE_PLATE_MOVE",
-                        "created_at": activity.created_at,
-                        "meta": {"location": {"id": location.id, "name": location.name}}
-                        if location
-                        else None,
-                    }
-                else:
-                    log = {
-                        "user": user,
-                        "message": activity.message,
-                        "activity": "LICENSE_PLATE_MOVE",
-                        "created_at": activity.created_at,
-                        "meta": None,
-                    }
-            elif activity.activity_type == ActivityTypeEnum.LICENSE_PLATE_MADEIT:
-                log = {
-                    "user": user,
-                    "message": activity.message,
-                    "activity": "LICENSE_PLATE_MADEIT",
-                    "created_at": activity.created_at,
-                    "meta": None,
-                }
-            elif activity.activity_type == ActivityTypeEnum.LICENSE_PLATE_DEDUCT:
-                log = {
-                    "user": user,
-                    "message": activity.message,
-                    "activity": "LICENSE_PLATE_DEDUCT",
-                    "created_at": activity.created_at,
-                    "meta": None,
-                }
-            else:
-                log = {
+        for activity, user, lp_move_id, location in query.all():
+            meta = None
+            if lp_move_id and location:
+                meta = {"location": {"id": location.id, "name": location.name}}
+            logs.append(
+                {
                     "user": user,
                     "message": activity.message,
-                    "activity": None,
+                    "activity": ACTIVITY_LABELS.get(activity.activity_type),
                     "created_at": activity.created_at,
-                    "meta": None,
+                    "meta": meta,
                 }
-
-            logs.append(log)
+            )
 
         return logs
 
+    def _check_acting_user(self, x_user_id, sess):
+        """Reject an X-Momenttrack-User that isn't a user of the org"""
+        if x_user_id == self.user_id:
+            return
+        x_user = User.get_by_id_and_org(x_user_id, self.org_id, session=sess)
+        if x_user is None or x_user.status not in [
+            UserStatusEnum.ACTIVE,
+            UserStatusEnum.UNCONFIRMED,
+        ]:
+            raise DataValidationError(
+                message="User does not exist",
+                errors={
+                    "headers": {"X-Momenttrack-User": ["User Id does not exist."]}
+                },
+            )
+
     def log(self, model_name, model_id, activity_type, sess, **kwargs):
         ip_address = self.headers.get("X-Forwarded-For", None)
         x_user_id = self.headers.get("X-Momenttrack-User", self.user_id)
 
-        if x_user_id != self.user_id:
-            x_user = User.get_by_id_and_org(x_user_id, self.org_id)
-            if x_user is None or x_user.status not in [
-                UserStatusEnum.ACTIVE,
-                UserStatusEnum.UNCONFIRMED,
-            ]:
-                raise DataValidationError(
-                    message="User does not exist",
-                    errors={
-                        "headers": {"X-Momenttrack-User": ["User Id does not exist."]}
-                    },
-                )
+        self._check_acting_user(x_user_id, sess)
 
         activity = Activity(
             model_name=model_name,
@@ -139,10 +145,47 @@ class ActivityService:
             # }
             # self.client.index(index="activity", body=data)
         except Exception as e:
-            DBErrorHandler(e)
+            DBErrorHandler(e, session=sess)
 
         return activity
 
+    def log_many(self, model_name, model_ids, activity_type, sess, **kwargs):
+        """Log one activity per model id with a single flush.
+
+        `messages` may be given instead of `message` to set a separate
+        message per model id.
+        """
+        ip_address = self.headers.get("X-Forwarded-For", None)
+        x_user_id = self.headers.get("X-Momenttrack-User", self.user_id)
+
+        self._check_acting_user(x_user_id, sess)
+
+        model_ids = list(model_ids)
+        messages = kwargs.get("messages", None)
+        if messages is None:
+            messages = [kwargs.get("message", None)] * len(model_ids)
+        activities = [
+            Activity(
+                model_name=model_name,
+                model_id=model_id,
+                user_id=x_user_id,
+                loggedin_user_id=self.user_id,
+                organization_id=self.org_id,
+                message=message,
+                activity_type=activity_type,
+                ip_address=ip_address,
+            )
+            for model_id, message in zip(model_ids, messages)
+        ]
+        sess.add_all(activities)
+
+        try:
+            sess.flush()
+        except Exception as e:
+            DBErrorHandler(e, session=sess)
+
+        return activities
+
     def log_change(self, model_name, model_id, field, old_value, new_value, message):
         activity_id = self.log(
             model_name, model_id, ActivityTypeEnum.CHANGE_TRACK, message=message
@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+from momenttrack_shared_models import (
+    Location,
+    Product,
+    ProductionOrder,
+)
+
+
+def _detached_copy(obj):
+    """Session-independent copy of `obj` holding only its column values"""
+    mapper = inspect(obj).mapper
+    copy = mapper.class_(**{
+        attr.key: getattr(obj, attr.key) for attr in mapper.column_attrs
+    })
+    make_transient_to_detached(copy)
+    return copy
+
+
+class ReferenceCache:
+    """Per-organization TTL/LRU cache for rarely changing reference rows
+    (system location, system product, system production order).
+
+    Cached rows are kept as detached copies; when a session is passed
+    they are merged into it without a SELECT. Only use them for reads:
+    counters such as `Location.lp_qty` must be changed with SQL-side
+    updates, never from a cached value. `maxsize=0` disables caching.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_system_location(self, org_id, session=None):
+        return self._get(
+            ("system_location", org_id),
+            lambda: Location.get_system_location(org_id, session=session),
+            session
+        )
+
+    def get_system_product(self, org_id, session=None):
+        return self._get(
+            ("system_product", org_id),
+            lambda: Product.get_system_product(org_id, session=session),
+            session
+        )
+
+    def get_system_order(self, org_id, user_id, session=None):
+        return self._get(
+            ("system_order", org_id),
+            lambda: ProductionOrder.get_system_order(
+                org_id, user_id, session=session
+            ),
+            session
+        )
+
+    def invalidate(self, org_id=None, kind=None):
+        """Drop cached rows, optionally only for one org and/or kind"""
+        with self._lock:
+            for key in list(self._entries):
+                if (
+                    (org_id is None or key[1] == org_id)
+                    and (kind is None or key[0] == kind)
+                ):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _get(self, key, loader, session):
+        if not self.maxsize:
+            return loader()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is None:
+            obj = loader()
+            if obj is None:
+                return None
+            entry = (time.monotonic() + self.ttl, _detached_copy(obj))
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+
+        cached = entry[1]
+        if session is not None:
+            current = session.identity_map.get(inspect(cached).key)
+            if current is not None:
+                return current
+            return session.merge(cached, load=False)
+        return cached
@@ -0,0 +1,152 @@
+import threading
+
+from loguru import logger
+
+from momenttrack_shared_services.utils import (
+    PRD_ORDER_TOTALS_INDEX,
+    prd_order_totals_update
+)
+
+
+class TotalsCoalescer:
+    """Merge production order totals deltas in-process before indexing.
+
+    `add()` only records the delta for the `{order_id}_{loc_id}` document.
+    Pending deltas are flushed as one `_bulk` request of scripted upserts
+    every `window` seconds, or once `max_pending` documents are waiting,
+    so a burst of +1/-1 moves costs one update per document.
+
+    Deltas of a failed request, or of a document the bulk response
+    reports an error for, are merged back and sent with the next flush.
+    After `max_attempts` failed flushes they are handed to `dead_letter`
+    (a `utils.ubq.DeadLetterSink`), or logged and dropped without one.
+    """
+
+    def __init__(
+        self, client, window=0.5, max_pending=1000,
+        max_attempts=5, dead_letter=None
+    ):
+        self.client = client
+        self.window = window
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.dead_letter = dead_letter
+        self._pending = {}
+        self._attempts = {}
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def add(self, loc_id, order_id, delta=1, loc=None):
+        key = (order_id, loc_id)
+        with self._lock:
+            self._merge(key, delta, loc)
+            flush_now = len(self._pending) >= self.max_pending
+            if not flush_now:
+                self._schedule()
+        if flush_now:
+            self.flush()
+
+    def _merge(self, key, delta, loc):
+        prev_delta, prev_loc = self._pending.get(key, (0, None))
+        self._pending[key] = (
+            prev_delta + delta,
+            loc if loc is not None else prev_loc
+        )
+
+    def _schedule(self):
+        if self._timer is None:
+            self._timer = threading.Timer(self.window, self._flush_on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_on_timer(self):
+        try:
+            self.flush()
+        except Exception as e:  # pylint:disable=W0718
+            logger.error(f"OPENSEARCH [ERROR] timed totals flush failed: {e}")
+
+    def flush(self):
+        """
+        Send all pending deltas now, returns the number of documents
+        updated. Raises if the bulk request itself fails; its deltas are
+        kept for the next flush.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        keys, actions = [], []
+        for (order_id, loc_id), (delta, loc) in pending.items():
+            if not delta:
+                continue
+            keys.append((order_id, loc_id))
+            actions.append({
+                "update": {
+                    "_index": PRD_ORDER_TOTALS_INDEX,
+                    "_id": f"{order_id}_{loc_id}",
+                    "retry_on_conflict": 5,
+                }
+            })
+            actions.append(
+                prd_order_totals_update(loc_id, order_id, delta, loc)
+            )
+        if not actions:
+            return 0
+
+        try:
+            resp = self.client.bulk(body=actions)
+        except Exception as e:
+            logger.error(f"OPENSEARCH [ERROR] totals flush failed: {e}")
+            self._retry({key: pending[key] for key in keys}, e)
+            raise
+
+        failed = {}
+        for key, item in zip(keys, resp["items"]):
+            error = item["update"].get("error")
+            if error:
+                failed[key] = error
+        with self._lock:
+            for key in keys:
+                if key not in failed:
+                    self._attempts.pop(key, None)
+        if failed:
+            logger.error(
+                f"OPENSEARCH [ERROR] {len(failed)} totals updates "
+                f"failed: {list(failed.values())}"
+            )
+            for key, error in failed.items():
+                self._retry({key: pending[key]}, error)
+        return len(keys) - len(failed)
+
+    def _retry(self, entries, error):
+        """Merge failed deltas back, dead-letter those out of attempts"""
+        dead = []
+        with self._lock:
+            for key, (delta, loc) in entries.items():
+                attempts = self._attempts.get(key, 0) + 1
+                if attempts >= self.max_attempts:
+                    self._attempts.pop(key, None)
+                    dead.append((key, delta, loc))
+                    continue
+                self._attempts[key] = attempts
+                self._merge(key, delta, loc)
+            if self._pending:
+                self._schedule()
+
+        for (order_id, loc_id), delta, loc in dead:
+            payload = {
+                "index": PRD_ORDER_TOTALS_INDEX,
+                "id": f"{order_id}_{loc_id}",
+                "delta": delta,
+                "loc": loc,
+                "error": str(error),
+            }
+            if self.dead_letter is not None:
+                self.dead_letter.write("order_totals", payload)
+            else:
+                logger.error(f"OPENSEARCH [ERROR] dropped totals delta: {payload}")
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,230 @@
+"""
+    Concurrent moves without lock waits between themselves.
+
+    `MoveExecutor` runs `agent.move()` calls on a bounded thread pool:
+
+    - requests for the same move item run one after the other, in
+      submission order, so they never wait on each other's row locks;
+      an item is recognised by its primary key, whether it was given
+      as lp_id / container_id or as id
+    - every move locks its source and destination location rows in id
+      order before writing, so moves between the same locations
+      serialize instead of deadlocking
+    - serialization failures and deadlocks (SQLSTATE 40001 / 40P01)
+      are retried with jittered exponential backoff
+
+        with agent.move_executor(max_workers=16) as executor:
+            futures = [
+                executor.submit(lp_id, dest_id, org_id, {}, user_id)
+                for lp_id in lp_ids
+            ]
+        results = [f.result() for f in futures]
+"""
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from loguru import logger
+
+
+RETRYABLE_SQLSTATES = {"40001", "40P01"}
+
+
+def is_retryable(exc):
+    """True for serialization failures and deadlocks, however wrapped"""
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        code = getattr(exc, "pgcode", None) or getattr(exc, "sqlstate", None)
+        if code in RETRYABLE_SQLSTATES:
+            return True
+        exc = getattr(exc, "orig", None) or exc.__cause__ or exc.__context__
+    return False
+
+
+class MoveExecutor:
+    """Bounded, per-item ordered, deadlock-retrying runner of moves.
+
+    `max_pending` bounds the number of submitted but unfinished moves;
+    `submit` blocks once it's reached. `resolve(move_item_id, org_id)`
+    returns the `(kind, id)` a move item is serialized on, or None for
+    items that don't exist yet (default: `agent.move_item_key`).
+    """
+
+    def __init__(
+        self, agent, max_workers=8, max_retries=5,
+        backoff=0.05, max_backoff=2.0, max_pending=None,
+        resolve=None, key_cache_size=10000
+    ):
+        self.agent = agent
+        self.resolve = resolve or agent.move_item_key
+        self.key_cache_size = key_cache_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="move-executor"
+        )
+        self._slots = (
+            threading.BoundedSemaphore(max_pending) if max_pending else None
+        )
+        self._queues = {}
+        self._keys = OrderedDict()
+        self._outstanding = 0
+        self._idle = threading.Condition()
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def submit(
+        self, move_item_id,
+        dest_location_id, org_id,
+        headers, user_id,
+        loglocation=None,
+        idempotency_key=None
+    ):
+        """Queue a move, returns a `Future` of `agent.move()`'s result"""
+        if self._closed:
+            raise RuntimeError("MoveExecutor is shut down")
+        if self._slots is not None:
+            self._slots.acquire()
+        future = Future()
+        request = (
+            future,
+            (move_item_id, dest_location_id, org_id, headers, user_id),
+            {"loglocation": loglocation, "idempotency_key": idempotency_key},
+        )
+        key = self._key(org_id, move_item_id)
+        with self._idle:
+            self._outstanding += 1
+            queue = self._queues.get(key)
+            if queue is not None:
+                queue.append(request)
+                return future
+            self._queues[key] = deque()
+        try:
+            self._pool.submit(self._run, key, *request)
+        except RuntimeError:
+            # shut down between the check above and here
+            self._done(key)
+            raise
+        return future
+
+    def _key(self, org_id, move_item_id):
+        given = (org_id, str(move_item_id))
+        with self._idle:
+            key = self._keys.get(given)
+            if key is not None:
+                self._keys.move_to_end(given)
+                return key
+            if given in self._queues:
+                # queued before it existed, keep its order
+                return given
+        resolved = self.resolve(move_item_id, org_id)
+        if resolved is None:
+            return given
+        key = (org_id, *resolved)
+        with self._idle:
+            self._keys[given] = key
+            while len(self._keys) > self.key_cache_size:
+                self._keys.popitem(last=False)
+        return key
+
+    def map(self, requests):
+        """Submit many moves given as dicts of `submit` arguments"""
+        return [self.submit(**request) for request in requests]
+
+    def _run(self, key, future, args, kwargs):
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(self._move(args, kwargs))
+                except Exception as e:  # pylint:disable=W0718
+                    future.set_exception(e)
+        finally:
+            self._done(key)
+
+    def _done(self, key):
+        """Release a finished request and start the next one of `key`"""
+        while True:
+            if self._slots is not None:
+                self._slots.release()
+            with self._idle:
+                self._outstanding -= 1
+                queue = self._queues[key]
+                if not queue:
+                    del self._queues[key]
+                    self._idle.notify_all()
+                    return
+                request = queue.popleft()
+            # the next request of this move item goes to the back of the pool
+            try:
+                self._pool.submit(self._run, key, *request)
+                return
+            except RuntimeError as e:
+                _fail(request[0], e)
+
+    def _move(self, args, kwargs):
+        attempt = 0
+        while True:
+            try:
+                return self.agent.move(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = random.uniform(
+                    0, min(self.max_backoff, self.backoff * 2 ** attempt)
+                )
+                attempt += 1
+                logger.warning(
+                    f"MOVE EXECUTOR: retry {attempt} of move {args[0]} "
+                    f"in {delay:.3f}s after {type(e).__name__}"
+                )
+                time.sleep(delay)
+
+    @property
+    def pending(self):
+        with self._idle:
+            return self._outstanding
+
+    def wait(self, timeout=None):
+        """Block until every submitted move finished"""
+        with self._idle:
+            return self._idle.wait_for(
+                lambda: self._outstanding == 0, timeout=timeout
+            )
+
+    def shutdown(self, wait=True):
+        """Stop accepting moves. With `wait=False` moves still queued
+        behind a running one of the same item fail with RuntimeError.
+        """
+        self._closed = True
+        if wait:
+            self.wait()
+        else:
+            self._fail_queued()
+        self._pool.shutdown(wait=wait)
+
+    def _fail_queued(self):
+        with self._idle:
+            queued = [r for queue in self._queues.values() for r in queue]
+            for queue in self._queues.values():
+                queue.clear()
+            self._outstanding -= len(queued)
+            self._idle.notify_all()
+        error = RuntimeError("MoveExecutor is shut down")
+        for future, _, _ in queued:
+            _fail(future, error)
+            if self._slots is not None:
+                self._slots.release()
+
+
+def _fail(future, exc):
+    if future.set_running_or_notify_cancel():
+        future.set_exception(exc)
@@ -0,0 +1,71 @@
+from sqlalchemy import select, tuple_, inspect
+from momenttrack_shared_models import (
+    Activity,
+    LicensePlateMove,
+)
+
+
+def _row_as_dict(obj):
+    return {
+        attr.key: getattr(obj, attr.key)
+        for attr in inspect(obj).mapper.column_attrs
+    }
+
+
+class HistoryExporter:
+    """Stream an organization's activity / move history.
+
+    Rows are read in keyset-paginated pages on (created_at, id) through a
+    server-side cursor (`yield_per`), and each page is expunged from the
+    session once yielded, so memory use doesn't depend on history size.
+    """
+
+    def __init__(self, session_factory, org_id, page_size=1000):
+        self.session_factory = session_factory
+        self.org_id = org_id
+        self.page_size = page_size
+
+    def activities(self, start=None, end=None, model_name=None):
+        filters = []
+        if model_name is not None:
+            filters.append(Activity.model_name == model_name)
+        return self.stream(Activity, start, end, filters)
+
+    def lp_moves(self, start=None, end=None, location_id=None):
+        filters = []
+        if location_id is not None:
+            filters.append(LicensePlateMove.dest_location_id == location_id)
+        return self.stream(LicensePlateMove, start, end, filters)
+
+    def stream(self, model, start=None, end=None, filters=None):
+        """
+        Yield rows of `model` for the org as plain dicts, ordered by
+        (created_at, id), with `start <= created_at < end`.
+        """
+        filters = [model.organization_id == self.org_id, *(filters or [])]
+        if start is not None:
+            filters.append(model.created_at >= start)
+        if end is not None:
+            filters.append(model.created_at < end)
+
+        last_key = None
+        with self.session_factory() as sess:
+            while True:
+                query = select(model).where(*filters)
+                if last_key is not None:
+                    query = query.where(
+                        tuple_(model.created_at, model.id) > last_key
+                    )
+                query = (
+                    query.order_by(model.created_at, model.id)
+                    .limit(self.page_size)
+                    .execution_options(yield_per=self.page_size)
+                )
+                count = 0
+                for obj in sess.scalars(query):
+                    count += 1
+                    last_key = (obj.created_at, obj.id)
+                    yield _row_as_dict(obj)
+                sess.expunge_all()
+                if count < self.page_size:
+                    break
@@ -0,0 +1,142 @@
+"""
+    Idempotency keys for move / create.
+
+    A request carrying a key records its result in `idempotency_key` in
+    the same transaction as its writes. A replay of the key returns the
+    stored result after one primary key lookup (or none, from the
+    in-process LRU) and does none of the write work. Two copies of a
+    request racing each other can't both commit: the second one fails on
+    the key's primary key and is answered with the first one's result.
+"""
+import datetime
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select, insert, delete
+from momenttrack_shared_models import LicensePlate
+
+from momenttrack_shared_services.tables import idempotency_key as keys
+from momenttrack_shared_services.utils import HttpError
+
+
+MOVE = "move"
+CREATE = "create"
+
+
+class Replay:
+    """Stored outcome of an idempotency key"""
+    __slots__ = ("operation", "entity_id", "result")
+
+    def __init__(self, operation, entity_id=None, result=None):
+        self.operation = operation
+        self.entity_id = entity_id
+        self.result = result
+
+
+class IdempotencyStore:
+    """Idempotency key table plus a bounded, TTL'd in-process LRU"""
+
+    def __init__(self, maxsize=10000, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, cache_key):
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                return None
+            expires, replay = entry
+            if expires < time.monotonic():
+                del self._entries[cache_key]
+                return None
+            self._entries.move_to_end(cache_key)
+            return replay
+
+    def remember(self, org_id, key, replay):
+        """Cache a committed result"""
+        if not self.maxsize:
+            return
+        with self._lock:
+            self._entries[(org_id, key)] = (time.monotonic() + self.ttl, replay)
+            self._entries.move_to_end((org_id, key))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def _check(replay, operation):
+        if replay.operation != operation:
+            raise HttpError(
+                code=422,
+                message=f"Idempotency key was already used for a {replay.operation}"
+            )
+
+    def lookup(self, session, org_id, key, operation):
+        """`Replay` of a key, or None when it wasn't used yet"""
+        replay = self._cached((org_id, key))
+        if replay is None:
+            row = session.execute(
+                select(keys.c.operation, keys.c.entity_id, keys.c.result)
+                .where(keys.c.organization_id == org_id, keys.c.key == key)
+            ).first()
+            if row is None:
+                return None
+            replay = Replay(
+                row.operation, row.entity_id,
+                json.loads(row.result) if row.result else None
+            )
+            self.remember(org_id, key, replay)
+        self._check(replay, operation)
+        return replay
+
+    def created_license_plate(self, session, org_id, key):
+        """The license plate created under `key` (one lookup), or None"""
+        replay = self._cached((org_id, key))
+        if replay is not None:
+            self._check(replay, CREATE)
+            return session.get(LicensePlate, replay.entity_id)
+        row = session.execute(
+            select(keys.c.operation, keys.c.entity_id, LicensePlate)
+            .outerjoin(LicensePlate, LicensePlate.id == keys.c.entity_id)
+            .where(keys.c.organization_id == org_id, keys.c.key == key)
+        ).first()
+        if row is None:
+            return None
+        replay = Replay(row.operation, row.entity_id)
+        self._check(replay, CREATE)
+        self.remember(org_id, key, replay)
+        return row.LicensePlate
+
+    def record(self, session, org_id, key, operation, entity_id=None, result=None):
+        """
+        Store a result in the caller's transaction. Raises an
+        `IntegrityError` if another transaction recorded the key first.
+        """
+        session.execute(
+            insert(keys).values(
+                organization_id=org_id,
+                key=key,
+                operation=operation,
+                entity_id=entity_id,
+                result=(
+                    json.dumps(result, default=str)
+                    if result is not None else None
+                ),
+                created_at=datetime.datetime.utcnow(),
+            )
+        )
+        return Replay(operation, entity_id, result)
+
+    def purge(self, session, older_than):
+        """Delete keys recorded before `older_than` (a datetime)"""
+        res = session.execute(
+            delete(keys).where(keys.c.created_at < older_than)
+        )
+        return res.rowcount
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,226 @@
+"""
+    Per-phase timing of agent operations.
+
+    An operation (`move`, `create`, `edit`, `comment`, ...) is traced by
+    the `instrumented` decorator on the agent. Actions mark the end of
+    each phase with `mark("phase")`, which records the time since the
+    previous mark. SQL statements and OpenSearch calls made while the
+    operation runs are counted as well. Finished traces go to a sink:
+
+        agent = LicensePlateServiceAgent(
+            db_config, client, instrumentation=HistogramSink()
+        )
+        ...
+        agent.instrumentation.summary()
+
+    Without a sink the current trace is a shared no-op object, so a
+    `mark()` costs one context variable lookup.
+"""
+import contextvars
+import functools
+import threading
+import time
+from collections import defaultdict
+
+from loguru import logger
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class Instrumentation:
+    """Metrics sink interface, the base class discards everything"""
+    enabled = False
+
+    def record(self, operation, phases, counts, total, error=None):
+        """
+        Called once per finished operation. `phases` maps phase names to
+        seconds (in execution order), `counts` maps counter names
+        ('sql', 'opensearch') to totals.
+        """
+
+
+class HistogramSink(Instrumentation):
+    """Keeps every sample in memory, `summary()` reports percentiles"""
+    enabled = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.counts = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, operation, phases, counts, total, error=None):
+        with self._lock:
+            self.samples[(operation, "total")].append(total)
+            for phase, seconds in phases.items():
+                self.samples[(operation, phase)].append(seconds)
+            for name, value in counts.items():
+                self.counts[(operation, name)].append(value)
+            if error is not None:
+                self.errors[operation] += 1
+
+    @staticmethod
+    def _percentile(values, pct):
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def summary(self):
+        """`{operation: {phase: {count, mean, p50, p99, max}}}` in seconds"""
+        with self._lock:
+            samples = {k: list(v) for k, v in self.samples.items()}
+            counts = {k: list(v) for k, v in self.counts.items()}
+            errors = dict(self.errors)
+
+        result = defaultdict(dict)
+        for (operation, phase), values in samples.items():
+            result[operation][phase] = {
+                "count": len(values),
+                "mean": sum(values) / len(values),
+                "p50": self._percentile(values, 50),
+                "p99": self._percentile(values, 99),
+                "max": max(values),
+            }
+        for (operation, name), values in counts.items():
+            result[operation][f"{name}_per_op"] = sum(values) / len(values)
+        for operation, value in errors.items():
+            result[operation]["errors"] = value
+        return dict(result)
+
+    def reset(self):
+        with self._lock:
+            self.samples.clear()
+            self.counts.clear()
+            self.errors.clear()
+
+
+class LogSink(Instrumentation):
+    """Logs one line per operation, optionally only slow ones"""
+    enabled = True
+
+    def __init__(self, slower_than=0.0):
+        self.slower_than = slower_than
+
+    def record(self, operation, phases, counts, total, error=None):
+        if total < self.slower_than:
+            return
+        breakdown = " ".join(
+            f"{phase}={seconds * 1000:.1f}ms"
+            for phase, seconds in phases.items()
+        )
+        stats = " ".join(f"{k}={v}" for k, v in counts.items())
+        logger.info(
+            f"TIMING: {operation} total={total * 1000:.1f}ms "
+            f"{breakdown} {stats}"
+            + (f" error={error}" if error is not None else "")
+        )
+
+
+class _NullTrace:
+    def mark(self, phase):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+_current = contextvars.ContextVar("instrumentation_trace", default=NULL_TRACE)
+
+
+class Trace:
+    """Timings and counters of one running operation"""
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.started = self.last = time.perf_counter()
+        self.phases = {}
+        self.counts = defaultdict(int)
+
+    def mark(self, phase):
+        """End `phase` now, it lasted since the previous mark"""
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+
+
+def mark(phase):
+    """End a phase of the current operation (no-op when not traced)"""
+    _current.get().mark(phase)
+
+
+def count(name, n=1):
+    _current.get().count(name, n)
+
+
+_sql_listener_lock = threading.Lock()
+_sql_listener_installed = False
+
+
+def _count_sql(conn, cursor, statement, parameters, context, executemany):
+    _current.get().count("sql")
+
+
+def install_sql_counter():
+    """Count SQL statements of every engine into the current trace"""
+    global _sql_listener_installed
+    with _sql_listener_lock:
+        if not _sql_listener_installed:
+            event.listen(Engine, "before_cursor_execute", _count_sql)
+            _sql_listener_installed = True
+
+
+class CountingClient:
+    """Proxy around an OpenSearch client counting calls per trace.
+
+    Namespaces such as `client.indices` or `client.tasks` are proxied
+    as well.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if callable(attr):
+            @functools.wraps(attr)
+            def call(*args, **kwargs):
+                _current.get().count("opensearch")
+                return attr(*args, **kwargs)
+            return call
+        if not name.startswith("_") and hasattr(attr, "transport"):
+            return CountingClient(attr)
+        return attr
+
+
+def instrumented(operation):
+    """Trace an agent method as `operation` into `self.instrumentation`"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            sink = self.instrumentation
+            if not sink.enabled:
+                return method(self, *args, **kwargs)
+            trace = Trace(operation)
+            token = _current.set(trace)
+            error = None
+            try:
+                return method(self, *args, **kwargs)
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                _current.reset(token)
+                total = time.perf_counter() - trace.started
+                try:
+                    sink.record(
+                        operation, trace.phases, dict(trace.counts),
+                        total, error=error
+                    )
+                except Exception as e:
+                    logger.error(f"TIMING: sink failed: {e}")
+        return wrapper
+    return decorator
@@ -0,0 +1,233 @@
+"""
+    Deferred aggregate maintenance.
+
+    In deferred mode actions don't touch `LineGraphData`,
+    `LocationPartNoTotals`, `LineItemTotals` or `EverythingReport` inline;
+    they append compact delta rows to `aggregate_delta_journal` in their
+    own transaction and `AggregateCompactor` folds journal ranges into the
+    aggregate tables in set-based batches. Aggregates are eventually
+    consistent, `AggregateCompactor.lag_seconds` measures by how much.
+"""
+import datetime
+import json
+import time
+
+from loguru import logger
+from sqlalchemy import select, insert, delete, func
+from momenttrack_shared_models import (
+    Location,
+    Product,
+    LicensePlateMove,
+    EverythingReport,
+)
+
+from momenttrack_shared_services.tables import aggregate_delta_journal as journal
+from momenttrack_shared_services.utils.totals import (
+    TotalsDelta,
+    apply_line_item_totals,
+    apply_line_graph_moves,
+    apply_part_no_totals
+)
+
+
+LINE_ITEM = "line_item"
+PART_NO = "part_no"
+LINE_GRAPH = "line_graph"
+MOVE_REPORT = "move_report"
+LP_REPORT = "lp_report"
+
+# pg_advisory_xact_lock key held by the compactor folding a batch
+COMPACTOR_LOCK_KEY = 0x6A6F75726E616C
+
+
+class DeltaJournal:
+    """Collects an action's aggregate deltas, written with one INSERT"""
+
+    def __init__(self, session):
+        self.session = session
+        self.rows = []
+
+    def _add(self, kind, **values):
+        self.rows.append({
+            "kind": kind,
+            "location_id": None,
+            "product_id": None,
+            "production_order_id": None,
+            "move_id": None,
+            "lp_key": None,
+            "qty": 0,
+            "payload": None,
+            "created_at": datetime.datetime.utcnow(),
+            **values
+        })
+
+    def line_item(self, loc_id, po_id, qty):
+        self._add(
+            LINE_ITEM, location_id=loc_id, production_order_id=po_id, qty=qty
+        )
+
+    def part_no(self, loc_id, product_id, qty):
+        self._add(PART_NO, location_id=loc_id, product_id=product_id, qty=qty)
+
+    def line_items(self, deltas):
+        """Journal a netted `TotalsDelta` of (location_id, po_id) keys"""
+        for (loc_id, po_id), qty in deltas.items():
+            self.line_item(loc_id, po_id, qty)
+
+    def part_nos(self, deltas):
+        """Journal a netted `TotalsDelta` of (location_id, product_id) keys"""
+        for (loc_id, product_id), qty in deltas.items():
+            self.part_no(loc_id, product_id, qty)
+
+    def line_graph(self, move):
+        self._add(
+            LINE_GRAPH,
+            location_id=move.dest_location_id,
+            product_id=move.product_id,
+            move_id=move.id,
+            qty=1
+        )
+
+    def move_report(self, move, last_interaction, report):
+        self._add(
+            MOVE_REPORT,
+            move_id=move.id,
+            lp_key=str(move.license_plate_id),
+            payload=json.dumps(
+                {"last_interaction": last_interaction, "report": report},
+                default=str
+            )
+        )
+
+    def lp_report(self, upsert_payload):
+        self._add(
+            LP_REPORT,
+            lp_key=str(upsert_payload["lp_id"]),
+            payload=json.dumps(upsert_payload, default=str)
+        )
+
+    def flush(self):
+        if self.rows:
+            self.session.execute(insert(journal), self.rows)
+            self.rows = []
+
+
+class AggregateCompactor:
+    """Fold journal rows into the aggregate tables, oldest first.
+
+    Report rows are last-writer-wins, so batches must be folded in
+    journal order: on PostgreSQL each batch takes a transaction-level
+    advisory lock first and concurrent compactors queue behind it
+    instead of folding newer rows ahead of older ones. A batch is
+    applied and deleted in one transaction.
+    """
+
+    def __init__(self, session_factory, batch_size=5000):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+
+    def run_once(self):
+        """Fold one batch, returns the number of journal rows consumed"""
+        with self.session_factory() as sess:
+            if sess.get_bind().dialect.name == "postgresql":
+                sess.execute(
+                    select(func.pg_advisory_xact_lock(COMPACTOR_LOCK_KEY))
+                )
+            rows = sess.execute(
+                select(journal)
+                .order_by(journal.c.id)
+                .limit(self.batch_size)
+                .with_for_update()
+            ).all()
+            if not rows:
+                return 0
+
+            self.fold(sess, rows)
+            sess.execute(
+                delete(journal).where(journal.c.id.in_([r.id for r in rows]))
+            )
+            sess.commit()
+            logger.info(f"JOURNAL: folded {len(rows)} aggregate deltas")
+            return len(rows)
+
+    def fold(self, sess, rows):
+        line_items = TotalsDelta()
+        part_nos = TotalsDelta()
+        graph_move_ids = []
+        reports = {}
+        for row in rows:
+            if row.kind == LINE_ITEM:
+                line_items.add(
+                    (row.location_id, row.production_order_id), row.qty
+                )
+            elif row.kind == PART_NO:
+                part_nos.add((row.location_id, row.product_id), row.qty)
+            elif row.kind == LINE_GRAPH:
+                graph_move_ids.append(row.move_id)
+            else:
+                # report rows are upserts, only the latest per LP matters
+                reports.pop((row.kind, row.lp_key), None)
+                reports[(row.kind, row.lp_key)] = row
+
+        if line_items:
+            locations = {
+                loc.id: loc for loc in sess.scalars(
+                    select(Location).where(
+                        Location.id.in_({k[0] for k, _ in line_items.items()})
+                    )
+                )
+            }
+            apply_line_item_totals(sess, line_items, locations)
+        if part_nos:
+            products = {
+                p.id: p for p in sess.scalars(
+                    select(Product).where(
+                        Product.id.in_({k[1] for k, _ in part_nos.items()})
+                    )
+                )
+            }
+            apply_part_no_totals(sess, part_nos, products)
+
+        move_ids = set(graph_move_ids) | {
+            row.move_id for (kind, _), row in reports.items()
+            if kind == MOVE_REPORT
+        }
+        moves = {}
+        if move_ids:
+            moves = {
+                m.id: m for m in sess.scalars(
+                    select(LicensePlateMove).where(
+                        LicensePlateMove.id.in_(move_ids)
+                    )
+                )
+            }
+        apply_line_graph_moves(
+            sess, [moves[m] for m in graph_move_ids if m in moves]
+        )
+        for (kind, _), row in reports.items():
+            payload = json.loads(row.payload)
+            if kind == LP_REPORT:
+                EverythingReport.upsert(payload, sess)
+            elif row.move_id in moves:
+                moves[row.move_id].update_associated_report(
+                    payload["last_interaction"], payload["report"], sess
+                )
+        sess.flush()
+
+    def lag_seconds(self):
+        """Age of the oldest unfolded delta (0 when the journal is empty)"""
+        with self.session_factory() as sess:
+            oldest = sess.scalar(select(func.min(journal.c.created_at)))
+        if oldest is None:
+            return 0
+        return (datetime.datetime.utcnow() - oldest).total_seconds()
+
+    def run_forever(self, idle_sleep=1.0):
+        while True:
+            try:
+                folded = self.run_once()
+            except Exception as e:
+                logger.error(f"JOURNAL: batch failed: {e}")
+                folded = 0
+            if folded < self.batch_size:
+                time.sleep(idle_sleep)
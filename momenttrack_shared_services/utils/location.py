@@ -1,6 +1,8 @@
 import datetime
-import statistics
 
+from loguru import logger
+from sqlalchemy import select, update, func, literal, case, inspect
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import lazyload
 from momenttrack_shared_models.core.database.models import (
     User,
@@ -8,6 +10,38 @@ from momenttrack_shared_models.core.database.models import (
     LicensePlate,
     LicensePlateMove
 )
+from momenttrack_shared_services.tables import location_dwell_stats
+from momenttrack_shared_services.utils import (
+    mean_gap_seconds,
+    gap_percentiles
+)
+
+
+def _average_duration(move_count, first_arrival, last_arrival):
+    if not move_count:
+        return 0
+    return mean_gap_seconds(first_arrival, last_arrival, move_count) or 0
+
+
+# engine -> whether `location_dwell_stats` exists, checked once per process
+_dwell_stats_tables = {}
+
+
+def _has_dwell_stats(session):
+    engine = session.get_bind()
+    found = _dwell_stats_tables.get(engine)
+    if found is None:
+        found = inspect(session.connection()).has_table(
+            location_dwell_stats.name
+        )
+        if not found:
+            logger.warning(
+                "location_dwell_stats is missing, average_duration is "
+                "recomputed from move history until it's created "
+                "(see README)"
+            )
+        _dwell_stats_tables[engine] = found
+    return found
 
 
 class LocationService:
@@ -17,8 +51,12 @@ class LocationService:
         self.db = db
 
     @staticmethod
-    def get_location_report(location, session=None):
-        """Get report by location object"""
+    def get_location_report(location, session=None, percentiles=None):
+        """Get report by location object
+
+        Pass e.g. `percentiles=(50, 90)` to also get dwell percentiles
+        (requires numpy).
+        """
 
         location.logs = None
         location.oldest_license_plate = None
@@ -29,7 +67,7 @@ class LocationService:
         if session:
             # Get all the moves from this location
             lp_moves = (
-                LicensePlateMove.query.with_session(session)
+                session.query(LicensePlateMove)
                 .options(lazyload(LicensePlateMove.user))
                 .options(lazyload(LicensePlateMove.product))
                 .options(lazyload(LicensePlateMove.license_plate))
@@ -52,39 +90,257 @@ class LocationService:
         if lp_moves:
             location.logs = lp_moves
 
-            # average_duration
-            dates = [lpm.created_at for lpm in lp_moves]
-            diffs = [(t2 - t1).total_seconds() for t1, t2 in zip(dates[:-1], dates[1:])]
-            if len(diffs) > 0:
+            # average_duration, from the first & last move only
+            mean_gap = mean_gap_seconds(
+                lp_moves[0].created_at, lp_moves[-1].created_at, len(lp_moves)
+            )
+            if mean_gap is not None:
                 location.average_duration = datetime.timedelta(
-                    seconds=statistics.mean(diffs)
+                    seconds=mean_gap
                 ).seconds
             else:
                 location.average_duration = 0
+            if percentiles:
+                location.duration_percentiles = gap_percentiles(
+                    [lpm.created_at for lpm in lp_moves], percentiles
+                )
 
             # oldest items
             location.oldest_log = lp_moves[-1]
             location.latest_log = lp_moves[0]
-            location.oldest_license_plate = LicensePlate.get(
-                lp_moves[-1].license_plate_id
+            if session:
+                location.oldest_license_plate = session.get(
+                    LicensePlate, lp_moves[-1].license_plate_id
+                )
+                location.current_user = session.get(
+                    User, lp_moves[-1].user_id
+                )
+            else:
+                location.oldest_license_plate = LicensePlate.get(
+                    lp_moves[-1].license_plate_id
+                )
+                location.current_user = User.get(lp_moves[-1].user_id)
+
+        return location
+
+    @staticmethod
+    def get_location_report_aggregated(
+        location, session=None, limit=50, offset=0
+    ):
+        """Get report by location object, aggregated in the database.
+
+        Count, oldest/latest arrival and average dwell come from one
+        aggregate query, the oldest LP and its user from one joined
+        query, and `logs` holds only the requested page of moves
+        (newest first) instead of the full history.
+        """
+        if session is None:
+            session = LicensePlateMove.query.session
+
+        location.logs = []
+        location.log_count = 0
+        location.oldest_license_plate = None
+        location.current_user = None
+        location.oldest_log = None
+        location.latest_log = None
+
+        here = LicensePlateMove.dest_location_id == location.id
+        count, first_arrival, last_arrival = session.execute(
+            select(
+                func.count(),
+                func.min(LicensePlateMove.created_at),
+                func.max(LicensePlateMove.created_at),
+            ).where(here)
+        ).one()
+        if not count:
+            return location
+
+        location.log_count = count
+        location.average_duration = int(
+            _average_duration(count, first_arrival, last_arrival)
+        )
+
+        oldest = session.execute(
+            select(LicensePlateMove, LicensePlate, User)
+            .outerjoin(
+                LicensePlate,
+                LicensePlate.id == LicensePlateMove.license_plate_id
+            )
+            .outerjoin(User, User.id == LicensePlateMove.user_id)
+            .options(lazyload(LicensePlateMove.user))
+            .options(lazyload(LicensePlateMove.product))
+            .options(lazyload(LicensePlateMove.license_plate))
+            .where(here)
+            .order_by(LicensePlateMove.created_at, LicensePlateMove.id)
+            .limit(1)
+        ).one()
+        location.oldest_log, location.oldest_license_plate, \
+            location.current_user = oldest
+
+        newest_first = (
+            select(LicensePlateMove)
+            .options(lazyload(LicensePlateMove.user))
+            .options(lazyload(LicensePlateMove.product))
+            .options(lazyload(LicensePlateMove.license_plate))
+            .where(here)
+            .order_by(
+                LicensePlateMove.created_at.desc(),
+                LicensePlateMove.id.desc()
             )
-            location.current_user = User.get(lp_moves[-1].user_id)
+        )
+        location.logs = session.scalars(
+            newest_first.offset(offset).limit(limit)
+        ).all()
+        if offset == 0 and location.logs:
+            location.latest_log = location.logs[0]
+        else:
+            location.latest_log = session.scalars(newest_first.limit(1)).first()
 
         return location
 
     @staticmethod
     def move_lp(src_id, dest_id, db, session=None, count=1):
+        """
+        Move `count` from src to dest `lp_qty` (only if src is non-empty).
+
+        Both rows are locked in id order first, so concurrent moves in
+        opposite directions can't deadlock. Then a single UPDATE applies
+        `lp_qty -/+ :count` to both, with no read-modify-write in Python.
+        Pass the caller's `session` to keep this in its transaction.
+        """
         if not session:
             session = db.writer_session()
-        src_loc = Location.get_by_id(src_id, session=session)
-        dest_loc = Location.get_by_id(dest_id, session=session)
-        if src_loc.lp_qty > 0:
-            src_loc.lp_qty -= count
-            dest_loc.lp_qty += count
+        LocationService.lock_locations(session, {src_id, dest_id})
+        src_qty = (
+            select(Location.lp_qty)
+            .where(Location.id == src_id)
+            .scalar_subquery()
+        )
+        session.execute(
+            update(Location)
+            .where(Location.id.in_({src_id, dest_id}), src_qty > 0)
+            .values(
+                lp_qty=case(
+                    (Location.id == src_id, Location.lp_qty - count),
+                    else_=Location.lp_qty + count
+                )
+            )
+            .execution_options(synchronize_session=False)
+        )
 
-            session.flush()
+    @staticmethod
+    def lock_locations(session, location_ids):
+        """Lock location rows FOR UPDATE, always in id order"""
+        session.execute(
+            select(Location.id)
+            .where(Location.id.in_(set(location_ids)))
+            .order_by(Location.id)
+            .with_for_update()
+        )
 
     @staticmethod
     def add_lp(location, session=None, count=1):
-        location.lp_qty += count
+        """Atomically add `count` to a location's `lp_qty`"""
+        session.execute(
+            update(Location)
+            .where(Location.id == location.id)
+            .values(lp_qty=Location.lp_qty + count)
+        )
         session.flush()
+
+    @staticmethod
+    def record_arrival(loc_id, arrived_at, session, count=1):
+        """
+        Fold `count` arrivals at `arrived_at` into the location's running
+        stats and refresh `location.average_duration` from them.
+
+        The mean gap between consecutive arrivals telescopes to
+        (last - first) / (n - 1), so count/first/last are all that's
+        needed. Must run after the new move rows are flushed: a location
+        with no stats row yet is seeded from its history (once). Without
+        the `location_dwell_stats` table the average is recomputed from
+        the location's whole history, as before the table existed.
+        """
+        if not _has_dwell_stats(session):
+            count, first, last = session.execute(
+                select(
+                    func.count(),
+                    func.min(LicensePlateMove.created_at),
+                    func.max(LicensePlateMove.created_at),
+                ).where(LicensePlateMove.dest_location_id == loc_id)
+            ).one()
+            session.execute(
+                update(Location)
+                .where(Location.id == loc_id)
+                .values(average_duration=_average_duration(count, first, last))
+            )
+            return
+        stats = location_dwell_stats
+        row = session.execute(
+            update(stats)
+            .where(stats.c.location_id == loc_id)
+            .values(
+                move_count=stats.c.move_count + count,
+                first_arrival=func.least(stats.c.first_arrival, arrived_at),
+                last_arrival=func.greatest(stats.c.last_arrival, arrived_at),
+            )
+            .returning(
+                stats.c.move_count,
+                stats.c.first_arrival,
+                stats.c.last_arrival
+            )
+        ).first()
+        if row is None:
+            LocationService.rebuild_dwell_stats(session, location_id=loc_id)
+            return
+        session.execute(
+            update(Location)
+            .where(Location.id == loc_id)
+            .values(average_duration=_average_duration(*row))
+        )
+
+    @staticmethod
+    def rebuild_dwell_stats(session, location_id=None):
+        """
+        Recompute running stats (and `average_duration`) from
+        license_plate_move history, for one location or all of them.
+        """
+        query = select(
+            LicensePlateMove.dest_location_id,
+            func.count(),
+            func.min(LicensePlateMove.created_at),
+            func.max(LicensePlateMove.created_at),
+        ).group_by(LicensePlateMove.dest_location_id)
+        if location_id is not None:
+            query = query.where(
+                LicensePlateMove.dest_location_id == location_id
+            )
+        stmt = pg_insert(location_dwell_stats).from_select(
+            ["location_id", "move_count", "first_arrival", "last_arrival"],
+            query
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[location_dwell_stats.c.location_id],
+            set_={
+                "move_count": stmt.excluded.move_count,
+                "first_arrival": stmt.excluded.first_arrival,
+                "last_arrival": stmt.excluded.last_arrival,
+            }
+        )
+        session.execute(stmt)
+
+        stats = location_dwell_stats
+        avg = func.coalesce(
+            func.extract(
+                "epoch", stats.c.last_arrival - stats.c.first_arrival
+            ) / func.nullif(stats.c.move_count - 1, 0),
+            literal(0)
+        )
+        refresh = (
+            update(Location)
+            .where(Location.id == stats.c.location_id)
+            .values(average_duration=avg)
+        )
+        if location_id is not None:
+            refresh = refresh.where(stats.c.location_id == location_id)
+        session.execute(refresh)
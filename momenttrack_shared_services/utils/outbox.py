@@ -0,0 +1,271 @@
+"""
+    Transactional outbox for OpenSearch writes.
+
+    Actions record *intents* (index/update/delete a document, or run an
+    update-by-query) in the `search_index_outbox` table inside their own
+    DB transaction; `OutboxWorker` drains them in batches through the
+    `_bulk` API, so request latency no longer depends on OpenSearch.
+"""
+import json
+import time
+
+from loguru import logger
+from sqlalchemy import select, insert, update, delete, tuple_
+
+from momenttrack_shared_services.tables import (
+    search_index_outbox as outbox,
+    search_index_outbox_dead_letter as dead_letters
+)
+
+
+UPDATE_FIELDS_SCRIPT = """
+    for (entry in params.updates.entrySet())
+    {
+        ctx._source[entry.getKey()] = entry.getValue();
+    }
+"""
+
+
+def enqueue(session, op, index, body=None, doc_id=None):
+    """Record an OpenSearch write intent in the caller's transaction"""
+    session.execute(
+        insert(outbox).values(
+            op=op,
+            index=index,
+            doc_id=str(doc_id) if doc_id is not None else None,
+            body=json.dumps(body or {}, default=str),
+            attempts=0,
+        )
+    )
+
+
+def enqueue_index(session, index, doc_id, doc):
+    enqueue(session, "index", index, doc, doc_id)
+
+
+def enqueue_update(session, index, doc_id, doc, upsert=True):
+    enqueue(
+        session, "update", index,
+        {"doc": doc, "doc_as_upsert": upsert}, doc_id
+    )
+
+
+def enqueue_update_by_query(session, index, field, value, updates):
+    """Set `updates` on every document of `index` where `field` == `value`"""
+    enqueue(
+        session, "update_by_query", index,
+        {
+            "query": {"match": {field: value}},
+            "script": {
+                "source": UPDATE_FIELDS_SCRIPT,
+                "lang": "painless",
+                "params": {"updates": updates},
+            },
+        }
+    )
+
+
+def _doc_key(row):
+    """Intents with the same key must apply in id order"""
+    if row.doc_id is not None:
+        return (row.index, row.doc_id)
+    query = json.loads(row.body).get("query")
+    return (row.index, json.dumps(query, sort_keys=True))
+
+
+def _missing_document(row, result):
+    """
+    Deleting a missing document, or updating one without upsert (e.g. a
+    move indexed before the outbox existed), is as good as done
+    """
+    if row.op == "delete":
+        return result.get("status") == 404
+    error = result.get("error")
+    return (
+        row.op == "update" and isinstance(error, dict)
+        and error.get("type") == "document_missing_exception"
+    )
+
+
+class OutboxWorker:
+    """Drain the outbox in batches.
+
+    Rows are claimed with `FOR UPDATE SKIP LOCKED`, so several workers can
+    run side by side. Intents for one document apply in id order: a
+    batch only sends a document's rows when every older pending row of it
+    is in the same batch, and rows that follow a failed one are kept and
+    sent again after it. Successful intents are deleted; failed ones are
+    kept with their error and retried, and once they have failed
+    `max_attempts` times they move to `search_index_outbox_dead_letter`.
+    Updating or deleting a document that doesn't exist counts as done.
+    """
+
+    def __init__(self, session_factory, client, batch_size=500, max_attempts=10):
+        self.session_factory = session_factory
+        self.client = client
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+
+    def run_once(self):
+        """Process one batch, returns the number of intents claimed"""
+        with self.session_factory() as sess:
+            claimed = sess.execute(
+                select(outbox)
+                .order_by(outbox.c.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            ).all()
+            if not claimed:
+                return 0
+
+            rows = self.ready(sess, claimed)
+            done, failed = [], {}
+            bulk_rows = [row for row in rows if row.op != "update_by_query"]
+            if bulk_rows:
+                self.send_bulk(bulk_rows, done, failed)
+            failed_keys = {_doc_key(row) for row in bulk_rows if row.id in failed}
+            for row in rows:
+                if row.op != "update_by_query":
+                    continue
+                if _doc_key(row) in failed_keys:
+                    continue
+                self.send_update_by_query(row, done, failed)
+                if row.id in failed:
+                    failed_keys.add(_doc_key(row))
+            done = self.in_order(rows, done, failed)
+
+            if done:
+                sess.execute(delete(outbox).where(outbox.c.id.in_(done)))
+            for row_id, error in failed.items():
+                sess.execute(
+                    update(outbox)
+                    .where(outbox.c.id == row_id)
+                    .values(
+                        attempts=outbox.c.attempts + 1,
+                        last_error=str(error)[:2000]
+                    )
+                )
+            dead = [
+                row.id for row in rows
+                if row.id in failed and row.attempts + 1 >= self.max_attempts
+            ]
+            if dead:
+                self.dead_letter(sess, dead)
+            sess.commit()
+            logger.info(
+                f"OUTBOX: indexed={len(done)} failed={len(failed)} "
+                f"dead_lettered={len(dead)} "
+                f"waiting={len(claimed) - len(done) - len(failed)}"
+            )
+            return len(claimed)
+
+    @staticmethod
+    def ready(sess, claimed):
+        """
+        Claimed rows whose older rows for the same document are all
+        claimed too. A document row locked by another worker, or not
+        claimed at all, holds back that document's later rows.
+        """
+        claimed_ids = {row.id for row in claimed}
+        keys = {(row.index, row.doc_id) for row in claimed if row.doc_id is not None}
+        pending = {}
+        if keys:
+            for index, doc_id, row_id in sess.execute(
+                select(outbox.c.index, outbox.c.doc_id, outbox.c.id)
+                .where(
+                    tuple_(outbox.c.index, outbox.c.doc_id).in_(keys),
+                    outbox.c.id <= max(claimed_ids)
+                )
+                .order_by(outbox.c.id)
+            ):
+                pending.setdefault((index, doc_id), []).append(row_id)
+
+        ready_ids = set()
+        for ids in pending.values():
+            for row_id in ids:
+                if row_id not in claimed_ids:
+                    break
+                ready_ids.add(row_id)
+        return [
+            row for row in claimed
+            if row.doc_id is None or row.id in ready_ids
+        ]
+
+    @staticmethod
+    def in_order(rows, done, failed):
+        """`done` without rows that follow a failed row of their document"""
+        done_ids = set(done)
+        blocked = set()
+        result = []
+        for row in rows:
+            key = _doc_key(row)
+            if row.id in failed:
+                blocked.add(key)
+            elif row.id in done_ids and key not in blocked:
+                result.append(row.id)
+        return result
+
+    @staticmethod
+    def dead_letter(sess, row_ids):
+        columns = [c.name for c in outbox.c]
+        sess.execute(
+            insert(dead_letters).from_select(
+                columns,
+                select(*outbox.c).where(outbox.c.id.in_(row_ids))
+            )
+        )
+        sess.execute(delete(outbox).where(outbox.c.id.in_(row_ids)))
+        logger.error(f"OUTBOX: moved {len(row_ids)} intents to the dead letter table")
+
+    def send_bulk(self, rows, done, failed):
+        actions = []
+        for row in rows:
+            meta = {"_index": row.index}
+            if row.doc_id is not None:
+                meta["_id"] = row.doc_id
+            actions.append({row.op: meta})
+            if row.op != "delete":
+                actions.append(json.loads(row.body))
+        try:
+            resp = self.client.bulk(body=actions)
+        except Exception as e:
+            logger.error(f"OPENSEARCH [ERROR] bulk request failed: {e}")
+            for row in rows:
+                failed[row.id] = e
+            return
+
+        for row, item in zip(rows, resp["items"]):
+            result = next(iter(item.values()))
+            error = result.get("error")
+            if error is None or _missing_document(row, result):
+                done.append(row.id)
+            else:
+                failed[row.id] = error
+
+    def send_update_by_query(self, row, done, failed):
+        try:
+            resp = self.client.update_by_query(
+                index=row.index,
+                body=json.loads(row.body),
+                conflicts="proceed"
+            )
+        except Exception as e:
+            failed[row.id] = e
+            return
+        if resp.get("failures"):
+            failed[row.id] = resp["failures"]
+        elif resp.get("version_conflicts"):
+            # skipped by conflicts="proceed": retried, then dead-lettered
+            failed[row.id] = f"{resp['version_conflicts']} version conflicts"
+        else:
+            done.append(row.id)
+
+    def run_forever(self, idle_sleep=1.0):
+        while True:
+            try:
+                claimed = self.run_once()
+            except Exception as e:
+                logger.error(f"OUTBOX: batch failed: {e}")
+                claimed = 0
+            if claimed < self.batch_size:
+                time.sleep(idle_sleep)
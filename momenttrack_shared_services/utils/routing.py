@@ -0,0 +1,71 @@
+import contextvars
+import functools
+from contextlib import contextmanager
+
+from momenttrack_shared_services.ext.SQLSci import SQLSci
+
+
+_in_write = contextvars.ContextVar("in_write_transaction", default=False)
+
+
+class SessionRouter:
+    """Route read-only work to a reader (replica) bind.
+
+    Reads issued while a write is in progress in the current context
+    (see `writing()`) stay on the writer, so a request always reads its
+    own writes. Without a reader bind everything goes to the writer.
+    """
+
+    def __init__(self, db, db_config=None, reader_bind='reader', **engine_options):
+        """
+        The reader bind is registered on `db` when it's an `SQLSci`
+        registry, so it shares its engine options and `db.dispose()`.
+        Otherwise (the shared models' `db`) the router keeps a registry of
+        its own, built with the same config and `engine_options`, which
+        `dispose()` closes.
+        """
+        self.db = db
+        self.reader = None
+        self.reader_bind = reader_bind
+        self._registry = None
+        binds = (db_config or {}).get('SQLALCHEMY_BINDS', {})
+        if reader_bind in binds:
+            if isinstance(db, SQLSci):
+                registry = db
+            else:
+                registry = self._registry = SQLSci(db_config, **engine_options)
+            self.reader = registry.get_session(reader_bind)
+
+    def dispose(self):
+        """Close the reader pool, if the router created it"""
+        if self._registry is not None:
+            self._registry.dispose()
+
+    @contextmanager
+    def writing(self):
+        """Mark the enclosed block as (part of) a write transaction"""
+        token = _in_write.set(True)
+        try:
+            yield
+        finally:
+            _in_write.reset(token)
+
+    @property
+    def in_write(self):
+        return _in_write.get()
+
+    @property
+    def read_session(self):
+        """Session factory for read-only work"""
+        if self.reader is None or self.in_write:
+            return self.db.writer_session
+        return self.reader
+
+
+def writes(method):
+    """Run an agent method inside `self.router.writing()`"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.router.writing():
+            return method(self, *args, **kwargs)
+    return wrapper
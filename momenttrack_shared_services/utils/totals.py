@@ -0,0 +1,193 @@
+from collections import defaultdict
+
+from sqlalchemy import update, case
+from momenttrack_shared_models import (
+    Location,
+    LineGraphData,
+    LineItemTotals,
+    LocationPartNoTotals,
+)
+
+
+class TotalsDelta:
+    """Nets +/- quantities per aggregate key.
+
+    Batch operations record every unit change here and then write each
+    aggregate row once, in key order so concurrent batches lock rows in
+    the same sequence.
+    """
+
+    def __init__(self):
+        self._deltas = defaultdict(int)
+
+    def add(self, key, qty=1):
+        self._deltas[key] += qty
+
+    def items(self):
+        return [
+            (key, qty) for key, qty in sorted(self._deltas.items())
+            if qty
+        ]
+
+    def __bool__(self):
+        return any(self._deltas.values())
+
+    def __len__(self):
+        return len(self.items())
+
+
+def net_lp_qty_moves(current, moves):
+    """Net `lp_qty` deltas of `(src_id, dest_id, count)` moves.
+
+    `current` maps location ids to their `lp_qty` before the batch. The
+    moves are replayed in order with the rule of `LocationService.move_lp`:
+    quantity only moves when the source is non-empty at that point. So a
+    batch ends with the same `lp_qty` values as the same moves made one
+    by one.
+    """
+    qty = dict(current)
+    delta = TotalsDelta()
+    for src_id, dest_id, count in moves:
+        if (qty.get(src_id) or 0) <= 0:
+            continue
+        qty[src_id] = (qty.get(src_id) or 0) - count
+        qty[dest_id] = (qty.get(dest_id) or 0) + count
+        delta.add(src_id, -count)
+        delta.add(dest_id, count)
+    return delta
+
+
+def apply_lp_qty_deltas(session, deltas, counters=None):
+    """Apply `{location_id: qty}` deltas to `Location.lp_qty`, never below 0
+
+    With `counters` (a `StripedCounters`) the deltas go to shard rows.
+    """
+    for loc_id, qty in deltas.items():
+        if counters is not None:
+            counters.add_lp_qty(session, loc_id, qty)
+            continue
+        new_qty = Location.lp_qty + qty
+        session.execute(
+            update(Location)
+            .where(Location.id == loc_id)
+            .values(lp_qty=case((new_qty < 0, 0), else_=new_qty))
+        )
+
+
+def apply_line_item_totals(session, deltas, locations, counters=None):
+    """Apply `{(location_id, production_order_id): qty}` deltas.
+
+    Decrements never take a row below zero (matching `Move.execute`),
+    increments create the row if it doesn't exist yet. `locations` maps
+    location ids to `Location` objects used to fill in new rows. With
+    `counters` the deltas go to shard rows.
+    """
+    for (loc_id, po_id), qty in deltas.items():
+        if counters is not None:
+            counters.add_line_item_total(session, loc_id, po_id, qty)
+            continue
+        new_total = LineItemTotals.total_items + qty
+        stmt = (
+            update(LineItemTotals)
+            .where(
+                LineItemTotals.location_id == loc_id,
+                LineItemTotals.production_order_id == po_id
+            )
+            .values(total_items=case((new_total < 0, 0), else_=new_total))
+        )
+        res = session.execute(stmt)
+        if res.rowcount == 0 and qty > 0:
+            loc = locations[loc_id]
+            session.add(
+                LineItemTotals(
+                    name=loc.name,
+                    production_order_id=po_id,
+                    location_id=loc_id,
+                    organization_id=loc.organization_id,
+                    total_items=qty
+                )
+            )
+
+
+def _add_part_no_total(session, loc_id, product_id, qty):
+    new_total = LocationPartNoTotals.total_items + qty
+    return session.execute(
+        update(LocationPartNoTotals)
+        .where(
+            LocationPartNoTotals.location_id == loc_id,
+            LocationPartNoTotals.product_id == product_id
+        )
+        .values(total_items=case((new_total < 0, 0), else_=new_total))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def apply_part_no_totals(session, deltas, products, counters=None):
+    """Apply `{(location_id, product_id): qty}` deltas to LocationPartNoTotals.
+
+    Each netted key is one UPDATE adding its whole delta, never taking
+    the row below zero (as `upsert_src_loc_total` does). A positive delta
+    for a row that doesn't exist yet creates it through the model's
+    `upsert`, which fills in the product details, and adds the rest. With
+    `counters` the deltas go to shard rows.
+    """
+    for (loc_id, product_id), qty in deltas.items():
+        if counters is not None:
+            counters.add_part_no_total(session, loc_id, product_id, qty)
+            continue
+        res = _add_part_no_total(session, loc_id, product_id, qty)
+        if res.rowcount == 0 and qty > 0:
+            LocationPartNoTotals.upsert(
+                {'loc_id': loc_id, 'product': products[product_id]}, session
+            )
+            if qty > 1:
+                session.flush()
+                _add_part_no_total(session, loc_id, product_id, qty - 1)
+
+
+def _add_line_graph_count(session, loc_id, date_key, product_id, qty):
+    return session.execute(
+        update(LineGraphData)
+        .where(
+            LineGraphData.location_id == loc_id,
+            LineGraphData.date_key == date_key,
+            LineGraphData.product_id == product_id
+        )
+        .values(quantity=LineGraphData.quantity + qty)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def apply_line_graph_moves(session, moves):
+    """Count `moves` into LineGraphData, one UPDATE per (location, day, product)
+
+    Moves are grouped by destination, `date_key` and product. A group
+    whose row doesn't exist yet creates it through the model's `upsert`
+    with its first move, and the rest of the group is added on top.
+    """
+    groups = defaultdict(list)
+    for move in moves:
+        key = (
+            move.dest_location_id, str(move.created_at)[:10], move.product_id
+        )
+        groups[key].append(move)
+    for (loc_id, date_key, product_id), group in sorted(groups.items()):
+        qty = len(group)
+        res = _add_line_graph_count(session, loc_id, date_key, product_id, qty)
+        if res.rowcount:
+            continue
+        first = group[0]
+        LineGraphData.upsert(
+            {
+                'loc_id': loc_id,
+                'date_key': date_key,
+                'lp_move': first,
+                'product': first.product
+            },
+            session
+        )
+        if qty > 1:
+            session.flush()
+            _add_line_graph_count(
+                session, loc_id, date_key, product_id, qty - 1
+            )
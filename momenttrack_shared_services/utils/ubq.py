@@ -0,0 +1,237 @@
+"""
+    Batched, asynchronous UpdateByQuery for line items and LP moves.
+
+    Instead of one blocking UpdateByQuery per license plate, updates with
+    the same shape are grouped into a single `terms` query and started
+    with `wait_for_completion=false`. `UpdateTaskPoller` follows the
+    returned tasks and hands failures to a pluggable dead-letter sink.
+"""
+import abc
+import datetime
+import json
+import sqlite3
+import threading
+
+from loguru import logger
+
+from momenttrack_shared_services.utils.outbox import UPDATE_FIELDS_SCRIPT
+
+
+class DeadLetterSink(abc.ABC):
+    """Where failed OpenSearch updates end up"""
+
+    @abc.abstractmethod
+    def write(self, kind, payload):
+        """Record one failure, `payload` must be JSON serialisable"""
+
+
+class LogDeadLetterSink(DeadLetterSink):
+    """Only log failures"""
+
+    def write(self, kind, payload):
+        logger.error(f"OPENSEARCH [DEAD LETTER] {kind}: {payload}")
+
+
+class FileDeadLetterSink(DeadLetterSink):
+    """Append failures as JSON lines to a local file"""
+
+    def __init__(self, path="opensearch_dead_letters.jsonl"):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, kind, payload):
+        line = json.dumps(
+            {
+                "kind": kind,
+                "payload": payload,
+                "created_at": datetime.datetime.utcnow(),
+            },
+            default=str
+        )
+        with self._lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+
+
+class SQLiteDeadLetterSink(DeadLetterSink):
+    """Store failures in a local SQLite database (the default sink)"""
+
+    def __init__(self, path="opensearch_dead_letters.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        with sqlite3.connect(self.path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS dead_letter ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "kind TEXT NOT NULL, "
+                "payload TEXT NOT NULL, "
+                "created_at TEXT NOT NULL)"
+            )
+
+    def write(self, kind, payload):
+        with self._lock, sqlite3.connect(self.path) as conn:
+            conn.execute(
+                "INSERT INTO dead_letter (kind, payload, created_at) "
+                "VALUES (?, ?, ?)",
+                (
+                    kind,
+                    json.dumps(payload, default=str),
+                    datetime.datetime.utcnow().isoformat()
+                )
+            )
+
+
+class UpdateTaskPoller:
+    """Track async UpdateByQuery tasks until they complete.
+
+    Call `poll()` periodically, or `start()` to poll from a daemon thread.
+    Tasks that finish with failures or version conflicts (skipped with
+    `conflicts=proceed`), or can't be looked up, are written to the
+    dead-letter sink.
+    """
+
+    def __init__(self, client, dead_letter=None, interval=2.0):
+        self.client = client
+        self.dead_letter = dead_letter or SQLiteDeadLetterSink()
+        self.interval = interval
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def track(self, task_id, context=None):
+        with self._lock:
+            self._tasks[task_id] = context
+
+    @property
+    def pending(self):
+        return len(self._tasks)
+
+    def poll(self):
+        """Check every tracked task once, returns the ids that completed"""
+        with self._lock:
+            tasks = list(self._tasks.items())
+
+        completed = []
+        for task_id, context in tasks:
+            try:
+                resp = self.client.tasks.get(task_id=task_id)
+            except Exception as e:
+                logger.error(f"OPENSEARCH [ERROR] task {task_id} lookup: {e}")
+                self.dead_letter.write(
+                    "update_by_query",
+                    {"task": task_id, "context": context, "error": str(e)}
+                )
+                completed.append(task_id)
+                continue
+            if not resp.get("completed"):
+                continue
+            completed.append(task_id)
+            response = resp.get("response") or {}
+            failures = response.get("failures")
+            conflicts = response.get("version_conflicts")
+            if failures or conflicts or resp.get("error"):
+                self.dead_letter.write(
+                    "update_by_query",
+                    {
+                        "task": task_id,
+                        "context": context,
+                        "failures": failures,
+                        "version_conflicts": conflicts,
+                        "error": resp.get("error"),
+                    }
+                )
+
+        with self._lock:
+            for task_id in completed:
+                self._tasks.pop(task_id, None)
+        return completed
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+
+def update_by_query_many(
+    client, index, updates,
+    field="license_plate_id", poller=None, chunk_size=1000,
+    dead_letter=None
+):
+    """
+    Apply many `(value, updates_dict)` pairs to `index`.
+
+    Pairs sharing the same `updates_dict` become one `terms` query on
+    `field` (chunked by `chunk_size`). Each one is started with
+    `wait_for_completion=false`. Returns the started task ids, which are
+    also handed to `poller` if given. A batch whose task can't be started
+    goes to `dead_letter` (default: the poller's sink, else the log) and
+    the remaining batches are still started.
+    """
+    if dead_letter is None:
+        dead_letter = (
+            poller.dead_letter if poller is not None else LogDeadLetterSink()
+        )
+    groups = {}
+    for value, obj in updates:
+        shape = json.dumps(obj, sort_keys=True, default=str)
+        groups.setdefault(shape, (obj, []))[1].append(value)
+
+    task_ids = []
+    for obj, values in groups.values():
+        for start in range(0, len(values), chunk_size):
+            chunk = values[start:start + chunk_size]
+            body = {
+                "query": {"terms": {field: chunk}},
+                "script": {
+                    "source": UPDATE_FIELDS_SCRIPT,
+                    "lang": "painless",
+                    "params": {"updates": obj},
+                },
+            }
+            context = {"index": index, field: chunk, "updates": obj}
+            try:
+                resp = client.update_by_query(
+                    index=index,
+                    body=body,
+                    conflicts="proceed",
+                    wait_for_completion=False
+                )
+                task_id = resp["task"]
+            except Exception as e:  # pylint:disable=W0718
+                logger.error(
+                    f"OPENSEARCH [ERROR] update_by_query on {index} "
+                    f"couldn't start: {e}"
+                )
+                dead_letter.write(
+                    "update_by_query", {"context": context, "error": str(e)}
+                )
+                continue
+            task_ids.append(task_id)
+            if poller is not None:
+                poller.track(task_id, context)
+    return task_ids
+
+
+def update_line_items_many(client, updates, poller=None):
+    """Batched counterpart of `update_line_items`"""
+    return update_by_query_many(
+        client, "production_order_lineitems_alias", updates, poller=poller
+    )
+
+
+def update_lp_moves_many(client, updates, poller=None):
+    """Batched counterpart of `update_lp_moves`"""
+    return update_by_query_many(
+        client, "lp_move_alias", updates, poller=poller
+    )
@@ -0,0 +1,51 @@
+"""
+    Background worker entry points.
+
+    python -m momenttrack_shared_services.worker [outbox|aggregates]
+
+    Configured through the same environment as the services:
+    DATABASE_URL_WRITER and OPENSEARCH_HOST/USER/PASS, plus optional
+    OUTBOX_BATCH_SIZE / OUTBOX_IDLE_SLEEP for the outbox worker and
+    AGGREGATE_BATCH_SIZE / AGGREGATE_IDLE_SLEEP for the aggregate
+    compactor.
+"""
+import os
+import sys
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from momenttrack_shared_services.utils import setup_opensearch
+from momenttrack_shared_services.utils.journal import AggregateCompactor
+from momenttrack_shared_services.utils.outbox import OutboxWorker
+
+
+def _session_factory():
+    load_dotenv()
+    return sessionmaker(create_engine(os.environ["DATABASE_URL_WRITER"]))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "aggregates":
+        return compactor_main()
+    worker = OutboxWorker(
+        _session_factory(),
+        setup_opensearch(),
+        batch_size=int(os.getenv("OUTBOX_BATCH_SIZE", 500)),
+    )
+    worker.run_forever(idle_sleep=float(os.getenv("OUTBOX_IDLE_SLEEP", 1.0)))
+
+
+def compactor_main():
+    compactor = AggregateCompactor(
+        _session_factory(),
+        batch_size=int(os.getenv("AGGREGATE_BATCH_SIZE", 5000)),
+    )
+    compactor.run_forever(
+        idle_sleep=float(os.getenv("AGGREGATE_IDLE_SLEEP", 1.0))
+    )
+
+
+if __name__ == "__main__":
+    main()
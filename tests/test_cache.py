@@ -0,0 +1,116 @@
+import pytest
+
+pytest.importorskip("momenttrack_shared_models")
+
+from sqlalchemy import Integer, String, create_engine, select  # noqa: E402
+from sqlalchemy.orm import (  # noqa: E402
+    DeclarativeBase,
+    Mapped,
+    mapped_column,
+    sessionmaker
+)
+
+import momenttrack_shared_services.utils.cache as cache_module  # noqa: E402
+from momenttrack_shared_services.utils.cache import ReferenceCache  # noqa: E402
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class SystemLocation(Base):
+    __tablename__ = "system_location"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    organization_id: Mapped[int] = mapped_column(Integer)
+    name: Mapped[str] = mapped_column(String(50))
+
+    loads = 0
+
+    @classmethod
+    def get_system_location(cls, org_id, session=None):
+        cls.loads += 1
+        return session.scalar(select(cls).where(cls.organization_id == org_id))
+
+
+@pytest.fixture
+def session_factory(monkeypatch):
+    monkeypatch.setattr(cache_module, "Location", SystemLocation)
+    SystemLocation.loads = 0
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(engine)
+    with factory() as sess:
+        sess.add_all([
+            SystemLocation(id=1, organization_id=10, name="system-10"),
+            SystemLocation(id=2, organization_id=20, name="system-20"),
+        ])
+        sess.commit()
+    return factory
+
+
+def test_miss_loads_then_hit_reuses(session_factory):
+    cache = ReferenceCache()
+    with session_factory() as sess:
+        first = cache.get_system_location(10, session=sess)
+        again = cache.get_system_location(10, session=sess)
+    assert first.name == "system-10"
+    assert again is first
+    assert SystemLocation.loads == 1
+
+
+def test_cached_row_is_usable_in_a_later_session(session_factory):
+    cache = ReferenceCache()
+    with session_factory() as sess:
+        cache.get_system_location(10, session=sess)
+    with session_factory() as sess:
+        loc = cache.get_system_location(10, session=sess)
+        assert loc in sess
+        assert (loc.id, loc.name) == (1, "system-10")
+        assert sess.get(SystemLocation, 1) is loc
+    assert cache.get_system_location(10).name == "system-10"
+    assert SystemLocation.loads == 1
+
+
+def test_expired_entries_are_loaded_again(session_factory, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    cache = ReferenceCache(ttl=300)
+    with session_factory() as sess:
+        cache.get_system_location(10, session=sess)
+        now[0] += 299
+        cache.get_system_location(10, session=sess)
+        assert SystemLocation.loads == 1
+        now[0] += 2
+        cache.get_system_location(10, session=sess)
+    assert SystemLocation.loads == 2
+
+
+def test_invalidate_by_org_and_kind(session_factory):
+    cache = ReferenceCache()
+    with session_factory() as sess:
+        cache.get_system_location(10, session=sess)
+        cache.get_system_location(20, session=sess)
+        cache.invalidate(org_id=10)
+        cache.get_system_location(20, session=sess)
+        assert SystemLocation.loads == 2
+        cache.get_system_location(10, session=sess)
+        assert SystemLocation.loads == 3
+        cache.invalidate(kind="system_product")
+        cache.get_system_location(10, session=sess)
+        assert SystemLocation.loads == 3
+        cache.invalidate(kind="system_location")
+        cache.get_system_location(20, session=sess)
+    assert SystemLocation.loads == 4
+
+
+def test_lru_bound_and_disabled_cache(session_factory):
+    cache = ReferenceCache(maxsize=1)
+    with session_factory() as sess:
+        cache.get_system_location(10, session=sess)
+        cache.get_system_location(20, session=sess)
+        cache.get_system_location(10, session=sess)
+        assert SystemLocation.loads == 3
+        disabled = ReferenceCache(maxsize=0)
+        disabled.get_system_location(10, session=sess)
+        disabled.get_system_location(10, session=sess)
+    assert SystemLocation.loads == 5
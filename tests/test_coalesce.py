@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+pytest.importorskip("momenttrack_shared_models")
+
+from opensearchpy.exceptions import ConnectionError  # noqa: E402
+
+from momenttrack_shared_services.testing import FakeOpenSearch  # noqa: E402
+from momenttrack_shared_services.utils import PRD_ORDER_TOTALS_INDEX  # noqa: E402
+from momenttrack_shared_services.utils.coalesce import TotalsCoalescer  # noqa: E402
+from momenttrack_shared_services.utils.ubq import DeadLetterSink  # noqa: E402
+
+LOC = {"name": "dock", "organization_id": 1}
+
+
+class ListSink(DeadLetterSink):
+    def __init__(self):
+        self.entries = []
+
+    def write(self, kind, payload):
+        self.entries.append((kind, payload))
+
+
+def totals(client):
+    return {
+        doc_id: doc["total_items"]
+        for doc_id, doc in client.documents(PRD_ORDER_TOTALS_INDEX).items()
+    }
+
+
+def coalescer(client, **kwargs):
+    # a long window keeps the timer out of the way
+    return TotalsCoalescer(client, window=60, **kwargs)
+
+
+def test_deltas_are_netted_per_document():
+    client = FakeOpenSearch()
+    c = coalescer(client)
+    c.add(1, 10, loc=LOC)
+    c.add(1, 10, loc=LOC)
+    c.add(1, 10, delta=-1)
+    c.add(2, 10, loc=LOC)
+    c.add(3, 10, delta=1, loc=LOC)
+    c.add(3, 10, delta=-1)
+
+    assert c.flush() == 2
+    assert client.calls["bulk"] == 1
+    assert totals(client) == {"10_1": 1, "10_2": 1}
+
+
+def test_failed_request_keeps_deltas_for_the_next_flush():
+    client = FakeOpenSearch()
+    c = coalescer(client)
+    c.add(1, 10, delta=2, loc=LOC)
+
+    client.fail_next("bulk")
+    with pytest.raises(ConnectionError):
+        c.flush()
+    c.add(1, 10, loc=LOC)
+
+    assert c.flush() == 1
+    assert totals(client) == {"10_1": 3}
+
+
+def test_item_errors_are_retried_then_dead_lettered():
+    client = FakeOpenSearch(conflict_rate=1.0)
+    sink = ListSink()
+    c = coalescer(client, max_attempts=2, dead_letter=sink)
+    c.add(1, 10, delta=2, loc=LOC)
+
+    assert c.flush() == 0
+    assert sink.entries == []
+    assert c.flush() == 0
+    [(kind, payload)] = sink.entries
+    assert kind == "order_totals"
+    assert (payload["id"], payload["delta"]) == ("10_1", 2)
+    assert c.flush() == 0
+    assert client.calls["bulk"] == 2
+
+
+def test_timer_flush_logs_instead_of_raising():
+    client = FakeOpenSearch()
+    c = TotalsCoalescer(client, window=0.01)
+    client.fail_next("bulk")
+    c.add(1, 10, loc=LOC)
+
+    # the failed delta is rescheduled and sent by the next timer
+    deadline = time.monotonic() + 2
+    while not totals(client) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert client.calls["bulk"] == 2
+    assert totals(client) == {"10_1": 1}
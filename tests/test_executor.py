@@ -0,0 +1,86 @@
+import threading
+
+import pytest
+
+pytest.importorskip("momenttrack_shared_models")
+
+from momenttrack_shared_services.utils.executor import MoveExecutor  # noqa: E402
+
+# lp_id -> primary key, as `agent.move_item_key` would resolve them
+LP_IDS = {"LP-1": 1, "1": 1, "LP-2": 2, "2": 2}
+
+
+class SerializationFailure(Exception):
+    pgcode = "40001"
+
+
+class FakeAgent:
+    def __init__(self, fail_first=0):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.overlaps = 0
+        self.calls = []
+        self.fail_first = fail_first
+        self.gate = None
+
+    def move_item_key(self, move_item_id, org_id):
+        pk = LP_IDS.get(str(move_item_id))
+        return None if pk is None else ("LicensePlate", pk)
+
+    def move(self, move_item_id, dest_location_id, org_id, headers, user_id,
+             **kwargs):
+        pk = LP_IDS[str(move_item_id)]
+        with self.lock:
+            if self.running.get(pk):
+                self.overlaps += 1
+            self.running[pk] = True
+            self.calls.append((move_item_id, dest_location_id))
+            fail = self.fail_first > 0
+            self.fail_first -= 1
+        try:
+            if self.gate is not None:
+                self.gate.wait(5)
+            if fail:
+                raise SerializationFailure()
+            return {"license_plate_id": pk, "dest": dest_location_id}
+        finally:
+            with self.lock:
+                self.running[pk] = False
+
+
+def test_lp_id_and_id_of_one_plate_run_in_order():
+    agent = FakeAgent()
+    with MoveExecutor(agent, max_workers=8) as executor:
+        futures = [
+            executor.submit(item, dest, 1, {}, 7)
+            for dest, item in enumerate(["LP-1", 1, "1", "LP-1", 1] * 4)
+        ]
+    assert [f.result()["dest"] for f in futures] == list(range(20))
+    assert agent.overlaps == 0
+    assert [dest for _, dest in agent.calls] == list(range(20))
+
+
+def test_serialization_failures_are_retried():
+    agent = FakeAgent(fail_first=2)
+    with MoveExecutor(agent, backoff=0.001) as executor:
+        future = executor.submit("LP-2", 5, 1, {}, 7)
+    assert future.result() == {"license_plate_id": 2, "dest": 5}
+    assert len(agent.calls) == 3
+
+
+def test_shutdown_without_wait_fails_queued_moves():
+    agent = FakeAgent()
+    agent.gate = threading.Event()
+    executor = MoveExecutor(agent, max_workers=2, max_pending=10)
+    running = executor.submit("LP-1", 1, 1, {}, 7)
+    queued = [executor.submit(1, dest, 1, {}, 7) for dest in (2, 3)]
+    executor.shutdown(wait=False)
+    for future in queued:
+        with pytest.raises(RuntimeError):
+            future.result(timeout=1)
+    agent.gate.set()
+    assert running.result(timeout=5)["dest"] == 1
+    assert executor.wait(timeout=5)
+    assert executor.pending == 0
+    with pytest.raises(RuntimeError):
+        executor.submit("LP-2", 1, 1, {}, 7)
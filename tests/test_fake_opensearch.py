@@ -0,0 +1,102 @@
+import pytest
+
+pytest.importorskip("momenttrack_shared_models")
+
+from momenttrack_shared_services.testing import FakeOpenSearch  # noqa: E402
+from momenttrack_shared_services.utils import (  # noqa: E402
+    line_graph_series
+)
+
+
+@pytest.fixture
+def client():
+    client = FakeOpenSearch()
+    rows = [
+        ("1", 10, "PN-1", "2024-01-01T08:00:00", 2),
+        ("2", 10, "PN-1", "2024-01-02T08:00:00", 3),
+        ("3", 10, "PN-2", "2024-01-01T09:00:00", 1),
+        ("4", 11, "PN-1", "2024-01-01T10:00:00", 7),
+    ]
+    for doc_id, loc_id, part_no, date, qty in rows:
+        client.index(
+            index="line_graph_data", id=doc_id,
+            body={
+                "location_id": loc_id,
+                "part_number": part_no,
+                "date": date,
+                "date_key": date[:10],
+                "quantity": qty,
+            }
+        )
+    return client
+
+
+def hit_ids(client, query, **body):
+    res = client.search(
+        index="line_graph_data", body={"query": query, **body}
+    )
+    return [hit["_id"] for hit in res["hits"]["hits"]]
+
+
+def test_term_and_terms_read_the_keyword_sub_field(client):
+    assert sorted(
+        hit_ids(client, {"term": {"part_number.keyword": "PN-2"}})
+    ) == ["3"]
+    assert sorted(
+        hit_ids(client, {"terms": {"part_number.keyword": ["PN-1", "PN-3"]}})
+    ) == ["1", "2", "4"]
+
+
+def test_bool_range_and_sort(client):
+    query = {
+        "bool": {
+            "filter": [{"term": {"location_id": 10}}],
+            "must_not": [{"match": {"part_number": "PN-2"}}],
+            "should": [{"range": {"quantity": {"gte": 100}}}],
+        }
+    }
+    assert hit_ids(client, query, sort=[{"date": "desc"}]) == ["2", "1"]
+    assert hit_ids(
+        client, {"range": {"quantity": {"gt": 1, "lt": 7}}}
+    ) == ["1", "2"]
+    assert hit_ids(client, {"match_all": {}}, size=2, **{"from": 1}) == [
+        "2", "3"
+    ]
+
+
+def test_terms_aggregation_on_keyword(client):
+    res = client.search(
+        index="line_graph_data",
+        body={
+            "size": 0,
+            "aggs": {
+                "parts": {
+                    "terms": {"field": "part_number.keyword"},
+                    "aggs": {"qty": {"sum": {"field": "quantity"}}},
+                }
+            },
+        }
+    )
+    buckets = {
+        b["key"]: (b["doc_count"], b["qty"]["value"])
+        for b in res["aggregations"]["parts"]["buckets"]
+    }
+    assert buckets == {"PN-1": (3, 12.0), "PN-2": (1, 1.0)}
+
+
+def test_line_graph_series_pages_composite_buckets(client):
+    assert line_graph_series(client, 10, page_size=1) == {
+        "PN-1": [
+            {"date": "2024-01-02", "quantity": 3},
+            {"date": "2024-01-01", "quantity": 2},
+        ],
+        "PN-2": [{"date": "2024-01-01", "quantity": 1}],
+    }
+
+
+def test_update_of_missing_document_raises_not_found(client):
+    from opensearchpy.exceptions import NotFoundError
+
+    with pytest.raises(NotFoundError) as exc:
+        client.update(index="line_graph_data", id="404", body={"doc": {}})
+    assert exc.value.error == "document_missing_exception"
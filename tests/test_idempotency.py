@@ -0,0 +1,114 @@
+import pytest
+
+pytest.importorskip("momenttrack_shared_models")
+
+from sqlalchemy.exc import IntegrityError  # noqa: E402
+
+import momenttrack_shared_services.agent as agent_module  # noqa: E402
+from momenttrack_shared_services.ext.SQLSci import SQLSci  # noqa: E402
+from momenttrack_shared_services.tables import create_tables  # noqa: E402
+from momenttrack_shared_services.utils import HttpError  # noqa: E402
+from momenttrack_shared_services.utils.idempotency import (  # noqa: E402
+    CREATE,
+    MOVE,
+    IdempotencyStore
+)
+
+ORG = 1
+RESULT = {"id": 42, "dest_location_id": 9}
+
+
+def config():
+    return {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+        'SQLALCHEMY_BINDS': {'writer': 'sqlite://'},
+    }
+
+
+@pytest.fixture
+def agent():
+    db = SQLSci(config())
+    agent = agent_module.LicensePlateServiceAgent(config(), database=db)
+    create_tables(agent.db.get_engine('writer'))
+    return agent
+
+
+def record_elsewhere(agent, key, result=RESULT):
+    """Commit a result for `key` as a concurrent copy of the request would"""
+    with agent.db.writer_session() as sess:
+        agent.idempotency.record(
+            sess, ORG, key, MOVE, entity_id=result["id"], result=result
+        )
+        sess.commit()
+
+
+def fake_move(monkeypatch, execute):
+    class FakeMove:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def execute(self):
+            return execute()
+    monkeypatch.setattr(agent_module, "Move", FakeMove)
+
+
+def test_store_replays_and_rejects_other_operations(agent):
+    store = IdempotencyStore()
+    with agent.db.writer_session() as sess:
+        store.record(sess, ORG, "k", MOVE, entity_id=42, result=RESULT)
+        sess.commit()
+        replay = store.lookup(sess, ORG, "k", MOVE)
+        assert (replay.entity_id, replay.result) == (42, RESULT)
+        with pytest.raises(HttpError) as exc:
+            store.lookup(sess, ORG, "k", CREATE)
+        assert exc.value.code == 422
+        assert store.lookup(sess, ORG, "other", MOVE) is None
+
+
+def test_second_record_of_a_key_conflicts(agent):
+    record_elsewhere(agent, "k")
+    with agent.db.writer_session() as sess:
+        with pytest.raises(IntegrityError):
+            agent.idempotency.record(sess, ORG, "k", MOVE, entity_id=1)
+
+
+def test_replayed_move_does_no_work(agent, monkeypatch):
+    record_elsewhere(agent, "k")
+    fake_move(monkeypatch, lambda: pytest.fail("move ran again"))
+    assert agent.move(1, 9, ORG, {}, 7, idempotency_key="k") == RESULT
+
+
+def test_move_is_remembered_after_success(agent, monkeypatch):
+    fake_move(monkeypatch, lambda: RESULT)
+    assert agent.move(1, 9, ORG, {}, 7, idempotency_key="k") == RESULT
+    cached = agent.idempotency._cached((ORG, "k"))
+    assert (cached.operation, cached.result) == (MOVE, RESULT)
+
+
+def test_lost_same_destination_race_replays(agent, monkeypatch):
+    def execute():
+        # the other copy commits while this one runs, then this one finds
+        # the plate already at the destination
+        record_elsewhere(agent, "k")
+        raise HttpError(code=400, message="same destination")
+    fake_move(monkeypatch, execute)
+    assert agent.move(1, 9, ORG, {}, 7, idempotency_key="k") == RESULT
+
+
+def test_lost_key_insert_race_replays(agent, monkeypatch):
+    def execute():
+        record_elsewhere(agent, "k")
+        with agent.db.writer_session() as sess:
+            agent.idempotency.record(sess, ORG, "k", MOVE, entity_id=1)
+    fake_move(monkeypatch, execute)
+    assert agent.move(1, 9, ORG, {}, 7, idempotency_key="k") == RESULT
+
+
+def test_errors_without_a_replay_propagate(agent, monkeypatch):
+    def execute():
+        raise HttpError(code=400, message="same destination")
+    fake_move(monkeypatch, execute)
+    with pytest.raises(HttpError):
+        agent.move(1, 9, ORG, {}, 7, idempotency_key="k")
+    with pytest.raises(HttpError):
+        agent.move(1, 9, ORG, {}, 7)
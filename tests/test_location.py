@@ -0,0 +1,22 @@
+import pytest
+
+pytest.importorskip("momenttrack_shared_models")
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from momenttrack_shared_services.tables import create_tables  # noqa: E402
+from momenttrack_shared_services.utils.location import (  # noqa: E402
+    _has_dwell_stats
+)
+
+
+def test_dwell_stats_table_is_detected_once_per_engine():
+    missing = sessionmaker(create_engine("sqlite://"))
+    with missing() as sess:
+        assert not _has_dwell_stats(sess)
+
+    engine = create_engine("sqlite://")
+    create_tables(engine)
+    with sessionmaker(engine)() as sess:
+        assert _has_dwell_stats(sess)
@@ -0,0 +1,152 @@
+import pytest
+
+pytest.importorskip("momenttrack_shared_models")
+
+from sqlalchemy import create_engine, select  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from momenttrack_shared_services.tables import (  # noqa: E402
+    create_tables,
+    search_index_outbox as outbox,
+    search_index_outbox_dead_letter as dead_letters
+)
+from momenttrack_shared_services.testing import FakeOpenSearch  # noqa: E402
+from momenttrack_shared_services.utils.outbox import (  # noqa: E402
+    OutboxWorker,
+    enqueue,
+    enqueue_index,
+    enqueue_update,
+    enqueue_update_by_query
+)
+
+
+@pytest.fixture
+def session_factory():
+    engine = create_engine("sqlite://")
+    create_tables(engine)
+    return sessionmaker(engine)
+
+
+@pytest.fixture
+def client():
+    return FakeOpenSearch()
+
+
+def pending(session_factory):
+    with session_factory() as sess:
+        return sess.execute(select(outbox).order_by(outbox.c.id)).all()
+
+
+def test_drains_intents_in_one_bulk(session_factory, client):
+    with session_factory() as sess:
+        enqueue_index(sess, "lp_alias", 1, {"lp_id": "a"})
+        enqueue_update(sess, "lp_alias", 1, {"status": "moved"})
+        sess.commit()
+
+    assert OutboxWorker(session_factory, client).run_once() == 2
+    assert client.documents("lp_alias") == {
+        "1": {"lp_id": "a", "status": "moved"}
+    }
+    assert client.calls["bulk"] == 1
+    assert pending(session_factory) == []
+
+
+def test_update_of_missing_document_is_done(session_factory, client):
+    with session_factory() as sess:
+        enqueue_update(sess, "lp_move_alias", 7, {"left_at": "x"}, upsert=False)
+        sess.commit()
+
+    OutboxWorker(session_factory, client).run_once()
+    assert pending(session_factory) == []
+    assert client.documents("lp_move_alias") == {}
+
+
+def test_failed_request_is_retried_then_dead_lettered(session_factory, client):
+    with session_factory() as sess:
+        enqueue_index(sess, "lp_alias", 1, {"lp_id": "a"})
+        sess.commit()
+    worker = OutboxWorker(session_factory, client, max_attempts=2)
+
+    client.fail_next("bulk")
+    worker.run_once()
+    [row] = pending(session_factory)
+    assert row.attempts == 1
+    assert row.last_error
+
+    client.fail_next("bulk")
+    worker.run_once()
+    assert pending(session_factory) == []
+    with session_factory() as sess:
+        [dead] = sess.execute(select(dead_letters)).all()
+    assert (dead.index, dead.doc_id, dead.attempts) == ("lp_alias", "1", 2)
+
+
+def test_update_by_query_conflicts_are_retried_then_dead_lettered(
+    session_factory, client
+):
+    client.index(index="lp_move_alias", id=1, body={"license_plate_id": 1})
+    with session_factory() as sess:
+        enqueue_update_by_query(
+            sess, "lp_move_alias", "license_plate_id", 1, {"serial": "a"}
+        )
+        sess.commit()
+    worker = OutboxWorker(session_factory, client, max_attempts=2)
+
+    client.conflict_rate = 1.0
+    worker.run_once()
+    [row] = pending(session_factory)
+    assert row.attempts == 1
+    assert "version conflicts" in row.last_error
+
+    client.conflict_rate = 0.0
+    worker.run_once()
+    assert pending(session_factory) == []
+    assert client.documents("lp_move_alias")["1"]["serial"] == "a"
+
+    with session_factory() as sess:
+        enqueue_update_by_query(
+            sess, "lp_move_alias", "license_plate_id", 1, {"serial": "b"}
+        )
+        sess.commit()
+    client.conflict_rate = 1.0
+    worker.run_once()
+    worker.run_once()
+    assert pending(session_factory) == []
+    with session_factory() as sess:
+        [dead] = sess.execute(select(dead_letters)).all()
+    assert (dead.op, dead.attempts) == ("update_by_query", 2)
+
+
+def test_rows_after_a_failed_row_of_the_same_document_wait(
+    session_factory, client
+):
+    client.index(index="lp_alias", id=1, body={"lp_id": "a"})
+    with session_factory() as sess:
+        # conflicts with the existing document
+        enqueue(sess, "create", "lp_alias", {"lp_id": "b"}, 1)
+        enqueue_update(sess, "lp_alias", 1, {"status": "moved"})
+        enqueue_index(sess, "lp_alias", 2, {"lp_id": "c"})
+        sess.commit()
+
+    OutboxWorker(session_factory, client).run_once()
+    rows = pending(session_factory)
+    assert [(row.op, row.doc_id, row.attempts) for row in rows] == [
+        ("create", "1", 1),
+        ("update", "1", 0),
+    ]
+    assert "2" in client.documents("lp_alias")
+
+
+def test_rows_wait_for_older_unclaimed_rows(session_factory):
+    with session_factory() as sess:
+        enqueue_update(sess, "lp_alias", 1, {"a": 1})
+        enqueue_update(sess, "lp_alias", 1, {"a": 2})
+        enqueue_update(sess, "lp_alias", 2, {"a": 3})
+        sess.commit()
+        first, second, other = sess.execute(
+            select(outbox).order_by(outbox.c.id)
+        ).all()
+
+        # the first row is held by another worker
+        ready = OutboxWorker.ready(sess, [second, other])
+    assert [row.id for row in ready] == [other.id]
@@ -0,0 +1,45 @@
+import pytest
+
+pytest.importorskip("momenttrack_shared_models")
+
+from momenttrack_shared_services.ext.SQLSci import SQLSci  # noqa: E402
+from momenttrack_shared_services.utils.routing import SessionRouter  # noqa: E402
+
+
+CONFIG = {
+    'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+    'SQLALCHEMY_BINDS': {'writer': 'sqlite://', 'reader': 'sqlite://'},
+    'SQLALCHEMY_BIND_OPTIONS': {'reader': {'pool_size': 3}},
+}
+
+
+def test_reader_bind_lives_on_the_registry():
+    db = SQLSci(CONFIG)
+    router = SessionRouter(db, CONFIG)
+    assert router.read_session is db.get_session('reader')
+    assert router._registry is None
+
+
+def test_reads_inside_a_write_stay_on_the_writer():
+    db = SQLSci(CONFIG)
+    router = SessionRouter(db, CONFIG)
+    with router.writing():
+        assert router.read_session is db.writer_session
+    assert router.read_session is not db.writer_session
+
+
+def test_without_reader_bind_everything_goes_to_the_writer():
+    config = {**CONFIG, 'SQLALCHEMY_BINDS': {'writer': 'sqlite://'}}
+    db = SQLSci(config)
+    router = SessionRouter(db, config)
+    assert router.read_session is db.writer_session
+
+
+def test_other_databases_get_a_router_owned_registry():
+    class Database:
+        writer_session = object()
+
+    router = SessionRouter(Database(), CONFIG, pool_size=2)
+    assert router._registry is not None
+    assert router.read_session is router._registry.get_session('reader')
+    router.dispose()
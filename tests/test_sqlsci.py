@@ -0,0 +1,39 @@
+from momenttrack_shared_services.ext.SQLSci import SQLSci
+
+
+def config(**engine_options):
+    return {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+        'SQLALCHEMY_BINDS': {'writer': 'sqlite://'},
+        'SQLALCHEMY_ENGINE_OPTIONS': engine_options,
+    }
+
+
+def test_statement_timeout_is_merged_into_connect_args():
+    db = SQLSci(config(
+        statement_timeout=500,
+        connect_args={'options': '-c search_path=app', 'sslmode': 'require'}
+    ))
+    assert db.engine_options()['connect_args'] == {
+        'options': '-c search_path=app -c statement_timeout=500',
+        'sslmode': 'require',
+    }
+
+
+def test_engines_and_sessions_are_cached_per_bind():
+    db = SQLSci(config())
+    assert db.get_engine('writer') is db.get_engine('writer')
+    assert db.get_engine('writer') is not db.get_engine()
+    assert db.writer_session is db.get_session('writer')
+
+
+def test_init_db_disposes_previous_engines():
+    db = SQLSci(config())
+    engine = db.get_engine('writer')
+    session = db.writer_session
+    session()
+
+    assert db.init_db(config()) is db
+    assert db.get_engine('writer') is not engine
+    assert db.writer_session is not session
+    assert not session.registry.has()
@@ -0,0 +1,52 @@
+import pytest
+
+pytest.importorskip("momenttrack_shared_models")
+
+from momenttrack_shared_services.utils.totals import (  # noqa: E402
+    TotalsDelta,
+    net_lp_qty_moves
+)
+
+
+def test_delta_nets_and_drops_zero_keys():
+    delta = TotalsDelta()
+    delta.add((1, 10), 1)
+    delta.add((1, 10), -1)
+    delta.add((2, 10), 3)
+    delta.add((0, 10), -2)
+    assert delta.items() == [((0, 10), -2), ((2, 10), 3)]
+    assert len(delta) == 2
+    assert delta
+
+
+def test_empty_delta_is_falsy():
+    delta = TotalsDelta()
+    delta.add(1, 1)
+    delta.add(1, -1)
+    assert not delta
+    assert delta.items() == []
+
+
+def test_lp_qty_moves_net_per_location():
+    delta = net_lp_qty_moves(
+        {1: 5, 2: 5, 3: 0},
+        [(1, 3, 1), (2, 3, 1), (1, 3, 1)]
+    )
+    assert dict(delta.items()) == {1: -2, 2: -1, 3: 3}
+
+
+def test_lp_qty_moves_skip_empty_sources_like_single_moves():
+    # src 1 holds one unit: the second move out of it moves nothing
+    delta = net_lp_qty_moves({1: 1, 2: 0}, [(1, 2, 1), (1, 2, 1)])
+    assert dict(delta.items()) == {1: -1, 2: 1}
+
+
+def test_lp_qty_moves_see_earlier_moves_of_the_batch():
+    # location 2 starts empty but is filled by the first move
+    delta = net_lp_qty_moves({1: 1, 2: 0, 3: 0}, [(1, 2, 1), (2, 3, 1)])
+    assert dict(delta.items()) == {1: -1, 3: 1}
+
+
+def test_lp_qty_moves_treat_missing_and_null_as_empty():
+    delta = net_lp_qty_moves({1: None}, [(1, 2, 1), (4, 2, 1)])
+    assert not delta
@@ -0,0 +1,79 @@
+import pytest
+
+pytest.importorskip("momenttrack_shared_models")
+
+from momenttrack_shared_services.testing import FakeOpenSearch  # noqa: E402
+from momenttrack_shared_services.utils.ubq import (  # noqa: E402
+    DeadLetterSink,
+    UpdateTaskPoller,
+    update_by_query_many
+)
+
+
+class ListSink(DeadLetterSink):
+    def __init__(self):
+        self.entries = []
+
+    def write(self, kind, payload):
+        self.entries.append((kind, payload))
+
+
+@pytest.fixture
+def client():
+    client = FakeOpenSearch()
+    for lp_id in (1, 2, 3):
+        client.index(
+            index="lp_move_alias", id=lp_id,
+            body={"license_plate_id": lp_id, "serial": None}
+        )
+    return client
+
+
+def test_dead_letter_sink_is_abstract():
+    with pytest.raises(TypeError):
+        DeadLetterSink()
+
+
+def test_same_updates_share_one_task(client):
+    sink = ListSink()
+    poller = UpdateTaskPoller(client, dead_letter=sink)
+    task_ids = update_by_query_many(
+        client, "lp_move_alias",
+        [(1, {"serial": "a"}), (2, {"serial": "a"}), (3, {"serial": "b"})],
+        poller=poller
+    )
+    assert len(task_ids) == 2
+    assert sorted(poller.poll()) == sorted(task_ids)
+    assert sink.entries == []
+    docs = client.documents("lp_move_alias")
+    assert [docs[k]["serial"] for k in ("1", "2", "3")] == ["a", "a", "b"]
+
+
+def test_batch_that_fails_to_start_is_dead_lettered(client):
+    sink = ListSink()
+    poller = UpdateTaskPoller(client, dead_letter=sink)
+    client.fail_next("update_by_query")
+    task_ids = update_by_query_many(
+        client, "lp_move_alias",
+        [(1, {"serial": "a"}), (3, {"serial": "b"})],
+        poller=poller
+    )
+    assert len(task_ids) == 1
+    [(kind, payload)] = sink.entries
+    assert kind == "update_by_query"
+    assert payload["context"]["license_plate_id"] == [1]
+    assert client.documents("lp_move_alias")["3"]["serial"] == "b"
+
+
+def test_proceeded_conflicts_are_dead_lettered(client):
+    sink = ListSink()
+    poller = UpdateTaskPoller(client, dead_letter=sink)
+    client.conflict_rate = 1.0
+    update_by_query_many(
+        client, "lp_move_alias", [(1, {"serial": "a"})], poller=poller
+    )
+    poller.poll()
+    [(kind, payload)] = sink.entries
+    assert kind == "update_by_query"
+    assert payload["version_conflicts"] == 1
+    assert client.documents("lp_move_alias")["1"]["serial"] is None